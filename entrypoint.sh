@@ -3,4 +3,15 @@
 /wait-for-it.sh db:5432 --timeout=30 --strict -- echo "PostgreSQL is up"
 # Запускаем Django
 python parser_marketplaces/manage.py migrate
-python parser_marketplaces/manage.py runserver 0.0.0.0:8000
+# Пакеты, которые выполнял остановленный сервер, снова можно продолжить
+python parser_marketplaces/manage.py recover_batches
+# ASGI-сервер: поиск ждёт ответы маркетплейсов в цикле событий, не занимая воркер.
+# Под ASGI постоянные соединения с базой не переиспользуются между запросами,
+# поэтому по умолчанию включается пул (см. DB_POOL_SIZE в settings.py).
+export DB_CONN_MAX_AGE=${DB_CONN_MAX_AGE:-0}
+export DB_POOL_SIZE=${DB_POOL_SIZE:-10}
+exec uvicorn parser_marketplaces.asgi:application \
+    --app-dir parser_marketplaces \
+    --host 0.0.0.0 --port 8000 \
+    --workers "${WEB_CONCURRENCY:-2}" \
+    --proxy-headers
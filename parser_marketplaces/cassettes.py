@@ -0,0 +1,193 @@
+"""Record and replay of marketplace HTTP traffic.
+
+Adapters send requests through request(client, method, url, ...), where
+client is the requests or curl_cffi.requests module or a session of either.
+Without a cassette this is a plain call. In record mode every response is
+appended to a gzip-compressed JSON-lines cassette; in replay mode responses
+are answered from it, as objects of the client's own Response class, with
+their original timing or without delay. Client errors (timeouts, refused
+connections) are recorded too and raised again on replay.
+
+A cassette is taken from settings (HTTP_CASSETTE, HTTP_CASSETTE_MODE,
+HTTP_CASSETTE_TIMING) or activated with use(); it is shared by all threads.
+Requests are matched by method, path, query and JSON body, not by host, so
+a cassette recorded against the marketplaces replays against any base URL.
+"""
+import base64
+import gzip
+import importlib
+import json
+import threading
+import time
+import types
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import timedelta
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from django.conf import settings
+
+MODES = ('record', 'replay')
+TIMINGS = ('original', 'none')
+# Заголовки, которые не нужны разбору и не должны попасть в кассету
+SKIPPED_HEADERS = {'set-cookie', 'content-encoding', 'transfer-encoding', 'content-length'}
+# Модули, из которых при воспроизведении берутся классы записанных ошибок;
+# остальные ошибки воспроизводятся базовой ошибкой клиента
+ERROR_MODULES = ('builtins', 'requests', 'urllib3', 'curl_cffi')
+
+
+class CassetteMiss(LookupError):
+    pass
+
+
+def request_key(method, url, params=None, json_body=None):
+    parts = urlsplit(url)
+    query = sorted([*parse_qsl(parts.query), *((str(k), str(v)) for k, v in (params or {}).items())])
+    body = json.dumps(json_body, sort_keys=True, ensure_ascii=False) if json_body is not None else ''
+    return f"{method.upper()} {parts.path}?{urlencode(query)} {body}".rstrip()
+
+
+def _library(client):
+    name = client.__name__ if isinstance(client, types.ModuleType) else type(client).__module__
+    return 'curl_cffi' if name.startswith('curl_cffi') else 'requests'
+
+
+def _build_response(library, entry):
+    content = base64.b64decode(entry['body'])
+    if library == 'curl_cffi':
+        from curl_cffi.requests import Headers, Response
+        response = Response()
+        response.headers = Headers(entry['headers'])
+        response.content = content
+        response.ok = entry['status'] < 400
+        response.elapsed = entry['elapsed']
+    else:
+        import requests
+        from requests.structures import CaseInsensitiveDict
+        response = requests.Response()
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response._content = content
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.elapsed = timedelta(seconds=entry['elapsed'])
+    response.url = entry['url']
+    response.status_code = entry['status']
+    response.reason = entry['reason']
+    return response
+
+
+def _error_name(error):
+    return f"{type(error).__module__}.{type(error).__qualname__}"
+
+
+def _build_error(library, error):
+    """Return an exception of the recorded type with the recorded message."""
+    module_name, _, name = error['type'].rpartition('.')
+    error_class = None
+    if module_name.split('.')[0] in ERROR_MODULES:
+        try:
+            error_class = getattr(importlib.import_module(module_name), name, None)
+        except ImportError:
+            pass
+    if not (isinstance(error_class, type) and issubclass(error_class, Exception)):
+        if library == 'curl_cffi':
+            from curl_cffi.requests.exceptions import RequestException as error_class
+        else:
+            from requests.exceptions import RequestException as error_class
+    return error_class(error['message'])
+
+
+class Cassette:
+    def __init__(self, path, mode='replay', timing='original'):
+        if mode not in MODES:
+            raise ValueError(f"Режим кассеты {mode!r}, ожидается один из {MODES}")
+        if timing not in TIMINGS:
+            raise ValueError(f"Время ответов {timing!r}, ожидается одно из {TIMINGS}")
+        self.path = path
+        self.mode = mode
+        self.timing = timing
+        self._lock = threading.Lock()
+        self._entries = defaultdict(deque)
+        if mode == 'replay':
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                for line in file:
+                    entry = json.loads(line)
+                    self._entries[entry['key']].append(entry)
+
+    def __len__(self):
+        return sum(map(len, self._entries.values()))
+
+    def request(self, client, method, url, **kwargs):
+        key = request_key(method, url, kwargs.get('params'), kwargs.get('json'))
+        if self.mode == 'replay':
+            return self._replay(client, key)
+        start = time.perf_counter()
+        try:
+            response = getattr(client, method)(url, **kwargs)
+        except Exception as e:
+            # Ошибка записывается, чтобы воспроизведение повторяло и её
+            self._write({
+                'key': key,
+                'elapsed': round(time.perf_counter() - start, 4),
+                'error': {'type': _error_name(e), 'message': str(e)},
+            })
+            raise
+        self._write({
+            'key': key,
+            'url': str(response.url),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': {name: value for name, value in response.headers.items() if name.lower() not in SKIPPED_HEADERS},
+            'elapsed': round(time.perf_counter() - start, 4),
+            'body': base64.b64encode(response.content).decode(),
+        })
+        return response
+
+    def _write(self, entry):
+        with self._lock, gzip.open(self.path, 'at', encoding='utf-8') as file:
+            file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _replay(self, client, key):
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise CassetteMiss(f"Нет записанного ответа в {self.path}: {key}")
+            # Повторные одинаковые запросы получают ответы по порядку записи, последний — сколько угодно раз
+            entry = entries.popleft() if len(entries) > 1 else entries[0]
+        if self.timing == 'original':
+            time.sleep(entry['elapsed'])
+        if 'error' in entry:
+            raise _build_error(_library(client), entry['error'])
+        return _build_response(_library(client), entry)
+
+
+_UNSET = object()
+_active = _UNSET
+
+
+def active():
+    """Return the current cassette, built from settings on first use, or None."""
+    global _active
+    if _active is _UNSET:
+        _active = Cassette(
+            settings.HTTP_CASSETTE, settings.HTTP_CASSETTE_MODE, settings.HTTP_CASSETTE_TIMING,
+        ) if settings.HTTP_CASSETTE else None
+    return _active
+
+
+@contextmanager
+def use(path, mode='replay', timing='original'):
+    """Send requests of every thread through the cassette at path while the block runs."""
+    global _active
+    previous = _active
+    _active = Cassette(path, mode, timing)
+    try:
+        yield _active
+    finally:
+        _active = previous
+
+
+def request(client, method, url, **kwargs):
+    cassette = active()
+    if cassette is None:
+        return getattr(client, method)(url, **kwargs)
+    return cassette.request(client, method, url, **kwargs)
@@ -0,0 +1,74 @@
+from datetime import datetime, time, timedelta
+
+from django import forms
+from django.utils import timezone
+
+from search.models import Marketplace
+
+
+class HistoryFilterForm(forms.Form):
+    marketplace = forms.TypedChoiceField(
+        label="Маркетплейс",
+        choices=[("", "Все")] + Marketplace.choices,
+        coerce=int,
+        empty_value=None,
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-select form-select-sm'}),
+    )
+    date_from = forms.DateField(
+        label="С",
+        required=False,
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control form-control-sm'}),
+    )
+    date_to = forms.DateField(
+        label="По",
+        required=False,
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control form-control-sm'}),
+    )
+    price_min = forms.DecimalField(
+        label="Цена от",
+        required=False,
+        min_value=0,
+        widget=forms.NumberInput(attrs={'class': 'form-control form-control-sm'}),
+    )
+    price_max = forms.DecimalField(
+        label="Цена до",
+        required=False,
+        min_value=0,
+        widget=forms.NumberInput(attrs={'class': 'form-control form-control-sm'}),
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from, date_to = cleaned_data.get('date_from'), cleaned_data.get('date_to')
+        if date_from and date_to and date_from > date_to:
+            raise forms.ValidationError("Начальная дата позже конечной")
+        price_min, price_max = cleaned_data.get('price_min'), cleaned_data.get('price_max')
+        if price_min is not None and price_max is not None and price_min > price_max:
+            raise forms.ValidationError("Минимальная цена больше максимальной")
+        return cleaned_data
+
+    def filter(self, queryset):
+        """Apply valid filters to a SearchQuery queryset.
+
+        Marketplace uses the GIN index on marketplaces, dates and prices the
+        (user, created_at) and (user, min_price) indexes.
+        """
+        if not self.is_valid():
+            return queryset
+        data = self.cleaned_data
+        if data['marketplace']:
+            queryset = queryset.filter(marketplaces__contains=[data['marketplace']])
+        if data['date_from']:
+            queryset = queryset.filter(created_at__gte=self._day_start(data['date_from']))
+        if data['date_to']:
+            queryset = queryset.filter(created_at__lt=self._day_start(data['date_to'] + timedelta(days=1)))
+        if data['price_min'] is not None:
+            queryset = queryset.filter(min_price__gte=data['price_min'])
+        if data['price_max'] is not None:
+            queryset = queryset.filter(min_price__lte=data['price_max'])
+        return queryset
+
+    @staticmethod
+    def _day_start(day):
+        return timezone.make_aware(datetime.combine(day, time.min))
@@ -1,3 +1,189 @@
-from django.test import TestCase
+import json
+import logging
+import os
+import subprocess
+import sys
+from datetime import timedelta
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.urls import reverse
+
+from parser_marketplaces.logs import JsonFormatter, RequestIdMiddleware, SampleFilter, request_id_var
+from search.models import CatalogProduct, PriceObservation, SearchQuery, SearchResult, Marketplace
+from search.services import archive_results
+from .views import HISTORY_PAGE_SIZE, HISTORY_DETAIL_PAGE_SIZE
+
+
+class HistoryViewsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('history', password='pass')
+        other = get_user_model().objects.create_user('other', password='pass')
+        SearchQuery.objects.create(user=other, query_text='чужой запрос')
+
+        products = CatalogProduct.objects.bulk_create(
+            CatalogProduct(marketplace=Marketplace.WILDBERRIES, product_id=i, name=f'Товар {i}', pics=1)
+            for i in range(HISTORY_DETAIL_PAGE_SIZE + 5)
+        )
+        cls.queries = [
+            SearchQuery.objects.create(
+                user=cls.user,
+                query_text=f'запрос {i}',
+                marketplaces=[Marketplace.WILDBERRIES] if i % 2 else [Marketplace.YANDEX_MARKET, Marketplace.MEGAMARKET],
+                product_count=len(products),
+                min_price=100 + i,
+            )
+            for i in range(HISTORY_PAGE_SIZE + 5)
+        ]
+        for search_query in cls.queries:
+            observations = PriceObservation.objects.bulk_create(
+                PriceObservation(product=product, price_product=100 + position)
+                for position, product in enumerate(products)
+            )
+            SearchResult.objects.bulk_create(
+                SearchResult(searchquery=search_query, observation=observation, position=position)
+                for position, observation in enumerate(observations)
+            )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_history_pages_use_constant_number_of_queries(self):
+        # сессия, пользователь и одна агрегирующая выборка страницы
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('history'))
+        page = response.context['requests']
+        self.assertEqual(len(page), HISTORY_PAGE_SIZE)
+        self.assertEqual(page[0].query_text, self.queries[-1].query_text)
+        self.assertEqual(page[0].product_count, HISTORY_DETAIL_PAGE_SIZE + 5)
+        self.assertEqual(page[0].min_price, 100 + HISTORY_PAGE_SIZE + 4)
+
+        with self.assertNumQueries(3):
+            response = self.client.get(response.context['next_url'])
+        self.assertEqual(
+            [q.query_text for q in response.context['requests']],
+            [q.query_text for q in reversed(self.queries[:5])],
+        )
+        self.assertIsNone(response.context['next_url'])
+
+    def test_history_detail_pages_use_constant_number_of_queries(self):
+        url = reverse('search_history_detail', args=[self.queries[0].id])
+        # сессия, пользователь, запрос поиска и одна выборка товаров
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        products = response.context['products']
+        self.assertEqual(len(products), HISTORY_DETAIL_PAGE_SIZE)
+        self.assertEqual(products[0].product.name, 'Товар 0')
+
+        with self.assertNumQueries(4):
+            response = self.client.get(response.context['next_url'])
+        self.assertEqual(len(response.context['products']), 5)
+        self.assertIsNone(response.context['next_url'])
+
+    def test_history_detail_of_other_user_is_not_found(self):
+        other_query = SearchQuery.objects.exclude(user=self.user).get()
+        response = self.client.get(reverse('search_history_detail', args=[other_query.id]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_archived_results_are_read_from_snapshot(self):
+        search_query = self.queries[-1]
+        self.assertEqual(archive_results([search_query.id]), 1)
+        SearchResult.objects.filter(searchquery=search_query).delete()
+
+        response = self.client.get(reverse('search_history_detail', args=[search_query.id]))
+        products = response.context['products']
+        self.assertEqual(len(products), HISTORY_DETAIL_PAGE_SIZE)
+        self.assertEqual(products[0].product.name, 'Товар 0')
+        response = self.client.get(response.context['next_url'])
+        self.assertEqual(
+            [product.product.name for product in response.context['products']],
+            [f'Товар {i}' for i in range(HISTORY_DETAIL_PAGE_SIZE, HISTORY_DETAIL_PAGE_SIZE + 5)],
+        )
+
+    def test_history_filters(self):
+        response = self.client.get(reverse('history'), {'marketplace': Marketplace.MEGAMARKET, 'price_max': 105})
+        self.assertEqual(
+            [q.query_text for q in response.context['requests']],
+            ['запрос 4', 'запрос 2', 'запрос 0'],
+        )
+
+        response = self.client.get(reverse('history'), {'price_min': 101})
+        self.assertIn('price_min=101', response.context['next_url'])
+        response = self.client.get(response.context['next_url'])
+        self.assertEqual(
+            [q.query_text for q in response.context['requests']],
+            ['запрос 4', 'запрос 3', 'запрос 2', 'запрос 1'],
+        )
+
+        today = self.queries[0].created_at.astimezone().date()
+        response = self.client.get(reverse('history'), {'date_to': (today - timedelta(days=1)).isoformat()})
+        self.assertEqual(list(response.context['requests']), [])
+        response = self.client.get(reverse('history'), {'date_from': today.isoformat(), 'date_to': today.isoformat()})
+        self.assertEqual(len(response.context['requests']), HISTORY_PAGE_SIZE)
+
+
+class LoggingTests(TestCase):
+    def test_request_id_is_taken_from_header_or_generated(self):
+        response = self.client.get(reverse('about'), headers={'X-Request-ID': 'proxy-42'})
+        self.assertEqual(response['X-Request-ID'], 'proxy-42')
+        response = self.client.get(reverse('about'), headers={'X-Request-ID': 'bad id\n'})
+        self.assertRegex(response['X-Request-ID'], r'^[0-9a-f]{32}$')
+
+    def test_request_id_of_streaming_response_does_not_leak(self):
+        seen = []
+
+        def view(request):
+            def content():
+                seen.append(request_id_var.get())
+                yield b'ok'
+            return StreamingHttpResponse(content())
+
+        response = RequestIdMiddleware(view)(RequestFactory().get('/', headers={'X-Request-ID': 'stream-1'}))
+        self.assertEqual(request_id_var.get(), '-')
+        self.assertEqual(b''.join(response), b'ok')
+        self.assertEqual((seen, request_id_var.get()), (['stream-1'], '-'))
+
+    def test_json_records_and_sampling(self):
+        record = logging.makeLogRecord({
+            'name': 'wb_api', 'levelname': 'WARNING', 'msg': 'Ошибка загрузки %s', 'args': ('url',),
+            'request_id': 'abc', 'event': 'image_download_failed',
+        })
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual(
+            (data['message'], data['request_id'], data['event']), ('Ошибка загрузки url', 'abc', 'image_download_failed')
+        )
+
+        sample = SampleFilter({'image_download_failed': 10})
+        self.assertEqual(sum(sample.filter(record) for _ in range(100)), 10)
+        self.assertTrue(sample.filter(logging.makeLogRecord({'msg': 'other'})))
+
+
+class DatabaseSettingsTests(SimpleTestCase):
+    def _database(self, **env):
+        # Настройки читаются в отдельном процессе без подключения к базе: пул создаётся закрытым,
+        # а несуществующее имя базы не даёт случайно подключиться к настоящей
+        code = (
+            "import json, django; django.setup(); "
+            "from django.conf import settings; from django.db import connection; "
+            "database = settings.DATABASES['default']; pool = connection.pool; "
+            "print(json.dumps([database['CONN_MAX_AGE'], database['CONN_HEALTH_CHECKS'], "
+            "database.get('OPTIONS', {}).get('pool'), pool and [pool.min_size, pool.max_size, pool.closed]]))"
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True, text=True,
+            env={**os.environ, 'DB_NAME': 'no_such_database', 'DB_CONN_MAX_AGE': '60', 'DB_POOL_SIZE': '0', **env},
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return json.loads(result.stdout)
+
+    def test_connections_are_persistent_by_default(self):
+        self.assertEqual(self._database(), [60, True, None, None])
+
+    def test_pool_replaces_persistent_connections(self):
+        conn_max_age, health_checks, options, pool = self._database(DB_POOL_SIZE='3', DB_POOL_MIN_SIZE='5')
+        self.assertEqual((conn_max_age, health_checks), (0, True))
+        self.assertEqual((options['min_size'], options['max_size']), (3, 3))
+        self.assertEqual(pool, [3, 3, True])
@@ -4,6 +4,7 @@ from main import views
 urlpatterns = [
     path('', views.index, name='home'),
     path('about/', views.about, name='about'),
+    path('metrics', views.metrics, name='metrics'),
     path('history/', views.history, name='history'),
     path('history/<int:history_id>/', views.history_detail, name='search_history_detail'),
 ]
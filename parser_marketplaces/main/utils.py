@@ -3,4 +3,6 @@ menu: tuple[dict[str, str], ...] = (
         {'title': "О сайте", 'url_name': 'about'},
         {'title': "История поиска", 'url_name': 'history'},
         {'title': "Поиск товаров", 'url_name': 'search:search_page'},
+        {'title': "Аналитика цен", 'url_name': 'search:analytics'},
+        {'title': "Отслеживание цен", 'url_name': 'search:watches'},
 )
\ No newline at end of file
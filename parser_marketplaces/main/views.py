@@ -2,24 +2,28 @@ from django.shortcuts import get_object_or_404, render
 from django.http import HttpResponse, HttpResponseNotFound
 from django.template.loader import render_to_string
 import sys
-from search.models import SearchQuery, Product, SORT_VALUE_CHOICES
+from search.models import PriceWatch, SearchQuery, SearchResult, SORT_VALUE_CHOICES, RESULTS_WINDOW
 from users.models import User
-from wb_api import ProductManager  # ✅
 from django.shortcuts import redirect   
+from .forms import HistoryFilterForm
 from .utils import menu
 from django.contrib.auth.decorators import login_required # ✅
 import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db.models import Q
 from django.urls import reverse
+from django.conf import settings
+from django.views.decorators.http import require_GET
+import hmac
+from metrics import REGISTRY
 
 
 # Словарь для быстрого получения названия фильтра по его значению
 SORT_DICT = dict(SORT_VALUE_CHOICES)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    handlers=[logging.StreamHandler()]
-)
 
+# Поля, которые выводит карточка товара (includes/product_grid.html)
+DETAIL_OBSERVATION_FIELDS = ('price_product', 'review_rating', 'feedbacks', 'delivery_date', 'duty')
+DETAIL_PRODUCT_FIELDS = ('marketplace', 'product_id', 'name', 'brand', 'pics', 'url')
 logger = logging.getLogger(__name__)
 
 def index(request):
@@ -36,30 +40,123 @@ def page_not_found(request, exception):
 def about(request):
     return render(request, 'main/about.html', {'title': 'О сайте', 'menu': menu})
 
+
+@require_GET
+def metrics(request):
+    """Metrics of this process in the Prometheus text format."""
+    if settings.METRICS_TOKEN:
+        expected = f"Bearer {settings.METRICS_TOKEN}"
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+            return HttpResponse(status=401, headers={'WWW-Authenticate': 'Bearer'})
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Размеры страниц истории и результатов из истории
+HISTORY_PAGE_SIZE = 20
+HISTORY_DETAIL_PAGE_SIZE = 48
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def _parse_history_cursor(value):
+    """Разбирает курсор вида "<created_at в мкс>-<id>" в (datetime, id)."""
+    try:
+        timestamp, pk = value.split('-')
+        return EPOCH + int(timestamp) * MICROSECOND, int(pk)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+def _history_cursor(search_query):
+    return f"{(search_query.created_at - EPOCH) // MICROSECOND}-{search_query.pk}"
+
+
 @login_required # ✅
 def history(request):
-    user_queries = SearchQuery.objects.filter(user=request.user)
-    for query in user_queries:
-        logger.info(f"{query}")
+    filter_form = HistoryFilterForm(request.GET)
+    user_queries = filter_form.filter(
+        SearchQuery.objects
+        .filter(user=request.user)
+        .only('id', 'query_text', 'sort_value', 'created_at', 'product_count', 'min_price')
+        .order_by('-created_at', '-id')
+    )
+    cursor = _parse_history_cursor(request.GET.get('after'))
+    if cursor:
+        created_at, pk = cursor
+        user_queries = user_queries.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    page = list(user_queries[:HISTORY_PAGE_SIZE + 1])
+    # Фильтры сохраняются в ссылках на соседние страницы
+    filters = request.GET.copy()
+    filters.pop('after', None)
+    next_url = None
+    if len(page) > HISTORY_PAGE_SIZE:
+        page = page[:HISTORY_PAGE_SIZE]
+        filters['after'] = _history_cursor(page[-1])
+        next_url = f"{reverse('history')}?{filters.urlencode()}"
+        filters.pop('after')
+    logger.info("История поиска: пользователь %s, записей на странице %s", request.user.pk, len(page))
+
     data = {
         'title': 'История поиска',
-        'requests': user_queries,
+        'requests': page,
+        'filter_form': filter_form,
+        'next_url': next_url,
+        'first_url': f"{reverse('history')}?{filters.urlencode()}" if cursor else None,
         'menu': menu
     }
     return render(request, 'main/history.html', context=data)
 
+@login_required
 def history_detail(request, history_id):
-    search_query = get_object_or_404(SearchQuery, id=history_id, user=request.user)
-    
-    # Получаем товары, связанные с этим запросом
-    products = Product.objects.filter(searchquery=search_query)
-    
+    search_query = get_object_or_404(
+        SearchQuery.objects.select_related('archive').only('id', 'query_text', 'sort_value', 'created_at', 'archive'),
+        # Общие поиски отслеживаний цен видны всем наблюдателям этого запроса
+        Q(user=request.user) | Q(pk__in=PriceWatch.objects.filter(user=request.user).values('last_search')),
+        id=history_id,
+    )
+
+    # Получаем товары, связанные с этим запросом, страницами по позиции в выдаче
+    try:
+        after = max(int(request.GET.get('after', -1)), -1)
+    except ValueError:
+        after = -1
+    archive = getattr(search_query, 'archive', None)
+    if archive is not None:
+        # Секции с результатами удалены по сроку хранения, читаем сжатый снимок
+        page = list(enumerate(archive.observations()))[after + 1:after + 2 + HISTORY_DETAIL_PAGE_SIZE]
+    else:
+        results = (
+            SearchResult.objects
+            .filter(
+                searchquery=search_query,
+                position__gt=after,
+                observed_at__gte=search_query.created_at,
+                observed_at__lt=search_query.created_at + RESULTS_WINDOW,
+            )
+            .select_related('observation__product')
+            .only(
+                'position',
+                *(f'observation__{name}' for name in DETAIL_OBSERVATION_FIELDS),
+                *(f'observation__product__{name}' for name in DETAIL_PRODUCT_FIELDS),
+            )
+            .order_by('position')[:HISTORY_DETAIL_PAGE_SIZE + 1]
+        )
+        page = [(result.position, result.observation) for result in results]
+    next_url = None
+    if len(page) > HISTORY_DETAIL_PAGE_SIZE:
+        page = page[:HISTORY_DETAIL_PAGE_SIZE]
+        next_url = f"{reverse('search_history_detail', args=[history_id])}?after={page[-1][0]}"
+
     context = {
         'title': f'Результаты поиска товара "{search_query.query_text}"',
-        'products': products,
+        'products': [observation for _, observation in page],
+        'next_url': next_url,
+        'first_url': reverse('search_history_detail', args=[history_id]) if after >= 0 else None,
         'back_url': reverse('history'),
         'back_label': 'Вернуться к Истории поиска',
         'sort_label': SORT_DICT.get(search_query.sort_value, search_query.sort_value),
     }
 
-    return render(request, 'product_results.html', context)
\ No newline at end of file
+    return render(request, 'product_results.html', context)
@@ -0,0 +1,110 @@
+"""Files under MEDIA_ROOT written by the marketplace clients and the image proxy.
+
+A file is written to a temporary name unique to the process and thread and
+then renamed, so readers (the image proxy in every server worker) see it
+whole or not at all, and concurrent writers of the same file do not mix
+their bytes. Images written this way are registered in image_index.
+"""
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ImageIndex:
+    """In-memory set of files under media/image.
+
+    The directory is scanned by load(), which the ASGI and WSGI entry points
+    call at worker start-up, or on first use elsewhere (management commands,
+    tests, a changed MEDIA_ROOT). Afterwards lookups do not touch the file
+    system: write_atomic registers new files, and the image proxy discards
+    files that turn out to be deleted.
+    """
+
+    def __init__(self):
+        self._files: set[tuple[str, int, str]] = set()
+        self._root = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Scan MEDIA_ROOT unless it has been scanned already."""
+        if self._root != str(settings.MEDIA_ROOT):
+            with self._lock:
+                if self._root != str(settings.MEDIA_ROOT):
+                    self._files = self._scan(str(settings.MEDIA_ROOT))
+                    self._root = str(settings.MEDIA_ROOT)
+
+    @staticmethod
+    def _scan(root):
+        files = set()
+        base = os.path.join(root, 'image')
+        if not os.path.isdir(base):
+            return files
+        for marketplace in os.scandir(base):
+            if not marketplace.is_dir():
+                continue
+            for product in os.scandir(marketplace.path):
+                if not product.is_dir() or not product.name.isdigit():
+                    continue
+                product_id = int(product.name)
+                for entry in os.scandir(product.path):
+                    # Недописанные файлы прерванных загрузок не считаются
+                    if not entry.name.endswith('.tmp'):
+                        files.add((marketplace.name, product_id, entry.name))
+        return files
+
+    @staticmethod
+    def key(path):
+        """Return (marketplace, product id, file name) of a path under media/image, or None."""
+        parts = os.path.relpath(path, os.path.join(str(settings.MEDIA_ROOT), 'image')).split(os.sep)
+        if len(parts) != 3 or parts[0] == os.pardir or not parts[1].isdigit():
+            return None
+        return parts[0], int(parts[1]), parts[2]
+
+    def has(self, marketplace: str, product_id: int, name: str = '1.jpg') -> bool:
+        self.load()
+        return (marketplace, int(product_id), name) in self._files
+
+    def add(self, marketplace: str, product_id: int, name: str = '1.jpg') -> None:
+        # Пока каталог не просканирован, файл найдёт сканирование
+        with self._lock:
+            if self._root == str(settings.MEDIA_ROOT):
+                self._files.add((marketplace, int(product_id), name))
+
+    def discard(self, marketplace: str, product_id: int, name: str = '1.jpg') -> None:
+        with self._lock:
+            self._files.discard((marketplace, int(product_id), name))
+
+    def __len__(self):
+        self.load()
+        return len(self._files)
+
+
+image_index = ImageIndex()
+
+
+def write_atomic(path, content: bytes) -> bool:
+    """Write content to path, creating its directory; return False on a file system error.
+
+    The temporary file is removed when writing fails.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "wb") as file:
+            file.write(content)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error("Ошибка сохранения файла %s: %s", path, e)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+    key = ImageIndex.key(path)
+    if key:
+        image_index.add(*key)
+    return True
@@ -0,0 +1,157 @@
+"""Search metrics in the Prometheus text format, without external dependencies.
+
+Stages of a search are timed with ``stage(name, marketplace)``, which
+records a histogram, counts errors and adds a span to the current trace; REGISTRY.render() returns every
+metric for the /metrics endpoint. Values live in the memory of the process,
+so each server worker reports its own.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from tracing import span
+
+# Границы корзин гистограмм, секунд: от записи в базу до ответа маркетплейса
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = ''
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Yield (suffix, label values, extra labels, value) of every series."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.type}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, value in items:
+            yield '', values, (), value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((values, (list(counts), total)) for values, (counts, total) in self._values.items())
+        for values, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                yield '_bucket', values, (('le', _format_value(bound)),), cumulative
+            yield '_sum', values, (), total
+            yield '_count', values, (), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+
+    def render(self):
+        return ''.join(metric.render() + '\n' for metric in self._metrics.values())
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = Histogram(
+    'search_stage_duration_seconds',
+    'Время этапа поиска: network, parse, offers, images, adapter, persistence, render',
+    ['stage', 'marketplace'],
+)
+STAGE_ERRORS = Counter(
+    'search_stage_errors_total', 'Этапы поиска, завершившиеся исключением', ['stage', 'marketplace'],
+)
+MM_OFFER_CACHE_LOOKUPS = Counter(
+    'mm_offer_cache_lookups_total', 'Обращения к кэшу предложений Мегамаркета: hit или miss', ['result'],
+)
+
+
+@contextmanager
+def stage(name, marketplace='', detail=''):
+    """Time a search stage; marketplace is a short name (wb, yma, mm) or '' for shared stages.
+
+    The stage is also a span of the current trace; detail goes only there.
+    """
+    start = time.perf_counter()
+    try:
+        with span(name, marketplace, detail):
+            yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=name, marketplace=marketplace)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name, marketplace=marketplace)
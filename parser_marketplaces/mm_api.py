@@ -1,10 +1,14 @@
+import hashlib
 import logging
 from datetime import datetime
 import threading
+import time
 import concurrent.futures
+import contextvars
 import sys
 import json
 from time import sleep
+from collections import OrderedDict
 from typing import List
 from pathlib import Path
 import re
@@ -13,17 +17,14 @@ from typing import Optional
 import os
 from django.conf import settings
 
-from rich.progress import BarColumn, Progress, SpinnerColumn, TextColumn, TimeRemainingColumn
-from rich.logging import RichHandler
 from curl_cffi import requests
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    handlers=[logging.StreamHandler()]
-)
+import cassettes
+from media_files import write_atomic
+from metrics import MM_OFFER_CACHE_LOOKUPS, stage
+from tracing import span
+
 logger = logging.getLogger(__name__)
-logger.info("Приложение запущено")
 
 @dataclass
 class Product:
@@ -46,6 +47,240 @@ class Product:
     def bonus_percent(self) -> int:
         return 0
 
+# Поля товара, которые берутся из productOffers/get, а не из выдачи catalog/search
+OFFER_FIELDS = (
+    "price", "available_quantity", "product_id", "delivery_date",
+    "merchant_id", "merchant_name", "merchant_rating", "old_price",
+)
+
+
+def listing_fingerprint(item: dict) -> str:
+    """Fingerprint of a catalog/search item: goodsId, listing prices and availability.
+
+    While it is unchanged the item's offer is assumed unchanged too.
+    """
+    key = [item["goods"]["goodsId"], item.get("price"), item.get("finalPrice"), item.get("isAvailable")]
+    return hashlib.sha1(json.dumps(key, ensure_ascii=False).encode()).hexdigest()
+
+
+class MemoryOfferStore:
+    """Хранилище последних предложений по goodsId в памяти процесса.
+
+    Любое хранилище для ProductManager(offer_store=...) реализует get_many и save_many.
+    """
+
+    def __init__(self):
+        self.entries: dict[str, tuple[str, dict]] = {}
+
+    def get_many(self, goods_ids: list[str]) -> dict[str, tuple[str, dict]]:
+        """Return {goodsId: (fingerprint, offer fields)} for known goods."""
+        return {goods_id: self.entries[goods_id] for goods_id in goods_ids if goods_id in self.entries}
+
+    def save_many(self, entries: dict[str, tuple[str, dict]]) -> None:
+        self.entries.update(entries)
+
+
+class OfferCache:
+    """Кэш предложений по goodsId на короткое время, общий для всех поисков.
+
+    Популярные товары попадают в выдачу разных запросов; пока предложение в
+    кэше, productOffers/get для него не вызывается. Подклассы реализуют
+    _get_many и _set_many, счётчики попаданий ведутся здесь.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get_many(self, goods_ids: list[str]) -> dict[str, dict]:
+        """Return {goodsId: offer fields} of cached goods and count hits and misses."""
+        if not goods_ids:
+            return {}
+        found = self._get_many(goods_ids)
+        with self._stats_lock:
+            self.hits += len(found)
+            self.misses += len(goods_ids) - len(found)
+        MM_OFFER_CACHE_LOOKUPS.inc(len(found), result='hit')
+        MM_OFFER_CACHE_LOOKUPS.inc(len(goods_ids) - len(found), result='miss')
+        return found
+
+    def set_many(self, offers: dict[str, dict]) -> None:
+        if offers:
+            self._set_many(offers)
+
+    def _get_many(self, goods_ids: list[str]) -> dict[str, dict]:
+        raise NotImplementedError
+
+    def _set_many(self, offers: dict[str, dict]) -> None:
+        raise NotImplementedError
+
+
+class MemoryOfferCache(OfferCache):
+    """Кэш в памяти процесса: не больше max_size товаров, давно не запрашиваемые вытесняются первыми."""
+
+    def __init__(self, ttl: float, max_size: int = 10000):
+        super().__init__(ttl)
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get_many(self, goods_ids: list[str]) -> dict[str, dict]:
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for goods_id in goods_ids:
+                entry = self._entries.get(goods_id)
+                if entry is None:
+                    continue
+                if entry[0] <= now:
+                    del self._entries[goods_id]
+                    continue
+                self._entries.move_to_end(goods_id)
+                found[goods_id] = entry[1]
+        return found
+
+    def _set_many(self, offers: dict[str, dict]) -> None:
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for goods_id, offer in offers.items():
+                self._entries[goods_id] = (expires_at, offer)
+                self._entries.move_to_end(goods_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class DjangoOfferCache(OfferCache):
+    """Кэш в бэкенде кэша Django (например, Redis), общий для всех процессов.
+
+    Размер ограничивает сам бэкенд (MAX_ENTRIES, maxmemory); счётчики
+    попаданий — только этого процесса.
+    """
+    key_prefix = "mm_offer:"
+
+    def __init__(self, alias: str, ttl: float):
+        from django.core.cache import caches
+        super().__init__(ttl)
+        self.cache = caches[alias]
+
+    def _get_many(self, goods_ids: list[str]) -> dict[str, dict]:
+        found = self.cache.get_many([self.key_prefix + goods_id for goods_id in goods_ids])
+        return {key[len(self.key_prefix):]: offer for key, offer in found.items()}
+
+    def _set_many(self, offers: dict[str, dict]) -> None:
+        self.cache.set_many({self.key_prefix + goods_id: offer for goods_id, offer in offers.items()}, timeout=self.ttl)
+
+
+class ProgressSink:
+    """Приёмник прогресса разбора. Базовый ничего не делает — так парсер работает в сервере.
+
+    Страница выдачи обозначается номером (с 1); set_pages задаёт, сколько
+    страниц предстоит разобрать.
+    """
+
+    def start(self) -> None:
+        pass
+
+    def set_pages(self, total: int) -> None:
+        pass
+
+    def page_started(self, page: int, items: int) -> None:
+        pass
+
+    def item_done(self, page: int) -> None:
+        pass
+
+    def page_finished(self, page: int) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+
+class RichProgressSink(ProgressSink):
+    """Полосы прогресса rich для запуска из консоли: общая и по каждой странице."""
+
+    def __init__(self):
+        self.progress = None
+        self.main_task = None
+        self.page_tasks: dict[int, int] = {}
+
+    def start(self) -> None:
+        from rich.progress import BarColumn, Progress, SpinnerColumn, TextColumn, TimeRemainingColumn
+        self.progress = Progress(
+            "{task.description}",
+            SpinnerColumn(),
+            BarColumn(),
+            TextColumn("[progress.percentage]{task.completed}/{task.total}"),
+            TimeRemainingColumn(elapsed_when_finished=True, compact=True),
+        )
+        self.progress.start()
+        self.main_task = self.progress.add_task("[green]Общий прогресс", total=1)
+
+    def set_pages(self, total: int) -> None:
+        self.progress.update(self.main_task, total=total)
+
+    def page_started(self, page: int, items: int) -> None:
+        self.page_tasks[page] = self.progress.add_task(f"[orange]Страница {page}", total=items)
+
+    def item_done(self, page: int) -> None:
+        self.progress.update(self.page_tasks[page], advance=1)
+
+    def page_finished(self, page: int) -> None:
+        self.progress.remove_task(self.page_tasks.pop(page))
+        self.progress.update(self.main_task, advance=1)
+
+    def stop(self) -> None:
+        self.progress.stop()
+
+
+class JobProgressSink(ProgressSink):
+    """Передаёт (разобрано страниц, всего страниц) в report не чаще раза в interval секунд.
+
+    Через него фоновая задача записывает готовность в свою запись в базе.
+    """
+
+    def __init__(self, report, interval: float = 1.0):
+        self.report = report
+        self.interval = interval
+        self.pages = 1
+        self.pages_done = 0
+        self._reported_at = 0.0
+        self._lock = threading.Lock()
+
+    def set_pages(self, total: int) -> None:
+        self.pages = total
+
+    def page_finished(self, page: int) -> None:
+        # report вызывается под блокировкой, иначе поток с меньшим числом
+        # страниц может записать его после соседнего и готовность уменьшится
+        with self._lock:
+            self.pages_done += 1
+            now = time.monotonic()
+            if now - self._reported_at < self.interval and self.pages_done < self.pages:
+                return
+            self._reported_at = now
+            self.report(self.pages_done, self.pages)
+
+    def stop(self) -> None:
+        # Разбор закончен, даже если до последних страниц дело не дошло
+        with self._lock:
+            self.report(self.pages, self.pages)
+
+
+class MegamarketError(RuntimeError):
+    """Поиск на Мегамаркете невозможен: неверные параметры, файл кук или API не отвечает."""
+
+
 class ProductManager:
     def __init__(
         self,
@@ -56,22 +291,24 @@ class ProductManager:
         threads: int | None = None,
         delay: float | None = None,
         error_delay: float | None = None,
-        log_level: str = "INFO",
         max_pages: int | None = None,
         sorting: int = 0,
         price_min: str = '',
         price_max: str = '',
+        download_images: bool = True,
+        offer_store=None,
+        offer_cache: OfferCache | None = None,
+        progress: ProgressSink | None = None,
     ):
+        self.base_url = settings.MM_BASE_URL.rstrip('/')
         self.cookie_file_path = cookie_file_path
         self.connection_success_delay = delay or 1.8
         self.connection_error_delay = error_delay or 10.0
-        self.log_level = log_level
         self.max_pages = max_pages
         self.start_time: datetime | None = None
         self.region_id = "54"
         self.cookie_dict: dict | None = None
-        self.rich_progress = None
-        self.logger: logging.Logger = self._create_logger(self.log_level)
+        self.progress = progress or ProgressSink()
         self.product_name = product_name
         self.include = include
         self.exclude = exclude
@@ -79,10 +316,19 @@ class ProductManager:
         self.sorting = sorting
         self.price_min = price_min
         self.price_max = price_max
+        self.download_images = download_images
         self.scraped_tems_counter = 0
         self.address_id = None
         self.lock = threading.Lock()
         self.parsed_offers: List[Product] = []
+        # Инкрементальный режим: предложения запрашиваются только для новых и изменившихся товаров
+        self.offer_store = offer_store
+        self.offer_requests = 0
+        self.offers_reused = 0
+        # Кэш предложений, общий для разных запросов
+        self.offer_cache = offer_cache
+        self.cache_hits = 0
+        self.cache_misses = 0
         self._set_up()
         self.session = self._new_session()
 
@@ -92,31 +338,30 @@ class ProductManager:
         session.cookies["adult_disclaimer_confirmed"] = "1"
         return session
 
-    def _create_logger(self, log_level: str) -> logging.Logger:
-        logging.basicConfig(
-            level=log_level,
-            format="%(message)s",
-            datefmt="%H:%M:%S",
-            handlers=[RichHandler(rich_tracebacks=True)],
-        )
-        return logging.getLogger("rich")
-
     def _set_up(self) -> None:
         self.cookie_dict = self.cookie_file_path and self.parse_cookie_file(self.cookie_file_path)
         if self.include and not self.validate_regex(self.include):
-            sys.exit(f'Неверное выражение "{self.include}"!')
+            raise MegamarketError(f'Неверное выражение "{self.include}"!')
         if self.exclude and not self.validate_regex(self.exclude):
-            sys.exit(f'Неверное выражение "{self.exclude}"!')
+            raise MegamarketError(f'Неверное выражение "{self.exclude}"!')
 
     def parse(self) -> None:
         self.start_time = datetime.now()
-        self.logger.info("Поиск товара: %s", self.product_name)
-        self.logger.info("Потоков: %s", self.threads)
-        self.logger.info("Сортировка: %s", self.sorting)
-        self.logger.info("Фильтры цен: price_min=%s, price_max=%s", self.price_min, self.price_max)
-        self.logger.info("%s %s", self.product_name, self.start_time.strftime("%d-%m-%Y %H:%M:%S"))
+        logger.info(
+            "Поиск товара: %s, потоков: %s, сортировка: %s, price_min=%s, price_max=%s",
+            self.product_name, self.threads, self.sorting, self.price_min, self.price_max,
+        )
         self._parse_multi_page()
-        self.logger.info("Спаршено %s товаров", self.scraped_tems_counter)
+        logger.info("Спаршено %s товаров", self.scraped_tems_counter)
+        if self.offer_store is not None:
+            logger.info(
+                "Запросов предложений: %s, взято из сохранённых: %s", self.offer_requests, self.offers_reused
+            )
+        if self.offer_cache is not None:
+            logger.info(
+                "Кэш предложений: попаданий %s, промахов %s; доля попаданий за всё время %.0f%%",
+                self.cache_hits, self.cache_misses, self.offer_cache.hit_ratio * 100,
+            )
 
     def slugify(self, text: str) -> str:
         lowercase_text = text.lower()
@@ -133,13 +378,13 @@ class ProductManager:
     def parse_cookie_file(self, path: str) -> dict:
         file_path = Path(path)
         if not file_path.exists():
-            sys.exit(f"Путь {path} не найден!")
+            raise MegamarketError(f"Путь {path} не найден!")
         try:
             with open(file_path, "r", encoding="utf-8") as file:
                 cookies: list = json.load(file)
                 return {cookie["name"]: cookie["value"] for cookie in cookies}
         except (json.JSONDecodeError, KeyError, FileNotFoundError) as e:
-            sys.exit(f"Ошибка при чтении файла кук: {e}")
+            raise MegamarketError(f"Ошибка при чтении файла кук: {e}")
 
     def _api_request(self, api_url: str, json_data: dict, headers: dict, tries: int = 10, delay: float = 0) -> dict:
         json_data["addressId"] = self.address_id or ""
@@ -151,18 +396,20 @@ class ProductManager:
         }
         for i in range(tries):
             try:
-                response = self.session.post(api_url, json=json_data, headers=headers, verify=False)
+                response = cassettes.request(self.session, 'post', api_url, json=json_data, headers=headers, verify=False)
                 response_data: dict = response.json()
             except Exception:
                 response = None
             if response and response.status_code == 200 and not response_data.get("error"):
                 return response_data
-            if response and response.status_code == 200 and response_data.get("code") == 7:
-                self.logger.debug("Слишком частые запросы")
-                sleep(self.connection_error_delay)
-            else:
-                sleep(1 * i)
-        sys.exit("Ошибка получения данных api")
+            # Ожидание перед повтором видно в трассировке запроса
+            with span("retry", "mm", f"{api_url.rsplit('/', 1)[-1]}, попытка {i + 1}"):
+                if response and response.status_code == 200 and response_data.get("code") == 7:
+                    logger.debug("Слишком частые запросы")
+                    sleep(self.connection_error_delay)
+                else:
+                    sleep(1 * i)
+        raise MegamarketError(f"Ошибка получения данных api: {api_url}, попыток {tries}")
 
     def _get_headers_with_referer(self, referer_url: str) -> dict:
         headers = {
@@ -219,80 +466,130 @@ class ProductManager:
                     "type": 2,
                     "value": str(int(float(self.price_max)))
                 })
-            logger.info(f"Фильтры цен: selectedFilters={json_data['selectedFilters']}")
+            logger.debug("Фильтры цен: selectedFilters=%s", json_data['selectedFilters'])
         except ValueError as e:
-            logger.error(f"Ошибка при обработке цен: {e}, price_min={self.price_min}, price_max={self.price_max}")
+            logger.error("Ошибка при обработке цен: %s, price_min=%s, price_max=%s", e, self.price_min, self.price_max)
 
         headers = self._get_headers_with_referer("")
-        return self._api_request(
-            "https://megamarket.ru/api/mobile/v1/catalogService/catalog/search",
-            json_data,
-            headers=headers,
-            delay=self.connection_success_delay,
-        )
+        with stage('network', 'mm'):
+            return self._api_request(
+                f"{self.base_url}/api/mobile/v1/catalogService/catalog/search",
+                json_data,
+                headers=headers,
+                delay=self.connection_success_delay,
+            )
+
+    def _fetch_offer(self, item: dict) -> dict | None:
+        """Request the first offer of a catalog item and return its OFFER_FIELDS."""
+        json_data = {
+            "addressId": self.address_id or "",
+            "collectionId": None,
+            "goodsId": item["goods"]["goodsId"],
+            "listingParams": {
+                "priorDueDate": "UNKNOWN_OFFER_DUE_DATE",
+                "selectedFilters": [],
+            },
+            "merchantId": "0",
+            "requestVersion": 11,
+            "shopInfo": {},
+        }
+        headers = self._get_headers_with_referer(item["goods"]["webUrl"])
+        with self.lock:
+            self.offer_requests += 1
+        with stage('offers', 'mm', item["goods"]["goodsId"]):
+            response_offers = self._api_request(
+                f"{self.base_url}/api/mobile/v1/catalogService/productOffers/get",
+                json_data,
+                headers=headers,
+                delay=self.connection_success_delay
+            )
+        if not (response_offers.get("success") and response_offers.get("offers") and len(response_offers["offers"]) > 0):
+            return None
+        offer = response_offers["offers"][0]
+        return {
+            "price": offer.get("finalPrice", 0),
+            "available_quantity": offer.get("availableQuantity", 0),
+            "product_id": offer.get("goodsId", item["goods"]["goodsId"].split("_")[0]),
+            "delivery_date": offer["deliveryPossibilities"][0].get("displayDeliveryDate", ""),
+            "merchant_id": offer.get("merchantId", ""),
+            "merchant_name": offer.get("merchantName", ""),
+            "merchant_rating": offer.get("merchantSummaryRating"),
+            "old_price": offer.get("oldPrice", 0) or offer.get("finalPrice", 0),
+        }
 
     def _parse_page(self, response_json: dict) -> bool:
         items_per_page = int(response_json.get("limit", 44))
         if items_per_page == 0:
             return False
-        page_progress = self.rich_progress.add_task(f"[orange]Страница {int(int(response_json.get('offset', 0)) / items_per_page) + 1}")
-        self.rich_progress.update(page_progress, total=len(response_json["items"]))
-        for item in response_json["items"]:
+        page = int(response_json.get("offset", 0)) // items_per_page + 1
+        items = response_json["items"]
+        self.progress.page_started(page, len(items))
+        eligible = [
+            item for item in items
+            if not self._exclude_check(item["goods"]["title"]) and item["isAvailable"] is True
+            and self._include_check(item["goods"]["title"])
+        ]
+        fingerprints = {item["goods"]["goodsId"]: listing_fingerprint(item) for item in eligible}
+        stored = {}
+        if self.offer_store is not None:
+            stored = self.offer_store.get_many([item["goods"]["goodsId"] for item in items])
+        cached = {}
+        if self.offer_cache is not None:
+            # В кэше ищутся только товары, которые попадут в выдачу и не взяты из сохранённых
+            missing = [
+                goods_id for goods_id, fingerprint in fingerprints.items()
+                if goods_id not in stored or stored[goods_id][0] != fingerprint
+            ][:max(16 - len(self.parsed_offers), 0)]
+            with span("offer_cache", "mm", f"товаров: {len(missing)}"):
+                cached = self.offer_cache.get_many(missing)
+            with self.lock:
+                self.cache_hits += len(cached)
+                self.cache_misses += len(missing) - len(cached)
+        changed = {}
+        fetched = {}
+        for item in items:
             if len(self.parsed_offers) >= 16:
-                self.rich_progress.update(page_progress, advance=1)
-                return False
-            item_title = item["goods"]["title"]
-            if self._exclude_check(item_title) or (item["isAvailable"] is not True) or (not self._include_check(item_title)):
-                self.rich_progress.update(page_progress, advance=1)
+                self.progress.item_done(page)
+                break
+            goods_id = item["goods"]["goodsId"]
+            if goods_id not in fingerprints:
+                self.progress.item_done(page)
                 continue
-            json_data = {
-                "addressId": self.address_id or "",
-                "collectionId": None,
-                "goodsId": item["goods"]["goodsId"],
-                "listingParams": {
-                    "priorDueDate": "UNKNOWN_OFFER_DUE_DATE",
-                    "selectedFilters": [],
-                },
-                "merchantId": "0",
-                "requestVersion": 11,
-                "shopInfo": {},
-            }
-            headers = self._get_headers_with_referer(item["goods"]["webUrl"])
-            response_offers = self._api_request(
-                "https://megamarket.ru/api/mobile/v1/catalogService/productOffers/get",
-                json_data,
-                headers=headers,
-                delay=self.connection_success_delay
-            )
-            if response_offers.get("success") and response_offers.get("offers") and len(response_offers["offers"]) > 0:
-                offer = response_offers["offers"][0]
-                delivery_date = offer["deliveryPossibilities"][0].get("displayDeliveryDate", "")
-                product_id = offer.get("goodsId", item["goods"]["goodsId"].split("_")[0])
-                old_price = offer.get("oldPrice", 0) or offer.get("finalPrice", 0)
+            fingerprint = fingerprints[goods_id]
+            if goods_id in stored and stored[goods_id][0] == fingerprint:
+                offer_fields = stored[goods_id][1]
+                with self.lock:
+                    self.offers_reused += 1
+            elif goods_id in cached:
+                offer_fields = cached[goods_id]
+                changed[goods_id] = (fingerprint, offer_fields)
+            else:
+                offer_fields = self._fetch_offer(item)
+                if offer_fields is not None:
+                    changed[goods_id] = (fingerprint, offer_fields)
+                    fetched[goods_id] = offer_fields
+            if offer_fields is not None:
                 parsed_offer = Product(
                     name=item["goods"]["title"],
                     url=item["goods"]["webUrl"],
                     image_url=item["goods"]["titleImage"],
-                    price=offer.get("finalPrice", 0),
-                    available_quantity=offer.get("availableQuantity", 0),
-                    product_id=product_id,
-                    delivery_date=delivery_date,
-                    merchant_id=offer.get("merchantId", ""),
-                    merchant_name=offer.get("merchantName", ""),
                     brand=item["goods"].get("brand", None),
-                    merchant_rating=offer.get("merchantSummaryRating"),
-                    old_price=old_price,
                     rating=item.get("rating", None),
                     reviews_count=item.get("reviewCount", None),
+                    **offer_fields,
                 )
-                if parsed_offer.image_url:
+                if parsed_offer.image_url and self.download_images:
                     ImageDownloader.save_images(parsed_offer.product_id, parsed_offer.image_url)
                 with self.lock:
                     self.parsed_offers.append(parsed_offer)
                     self.scraped_tems_counter += 1
-            self.rich_progress.update(page_progress, advance=1)
-        self.rich_progress.remove_task(page_progress)
-        return len(self.parsed_offers) < 16 and response_json["items"] and response_json["items"][-1]["isAvailable"]
+            self.progress.item_done(page)
+        if changed and self.offer_store is not None:
+            self.offer_store.save_many(changed)
+        if fetched and self.offer_cache is not None:
+            self.offer_cache.set_many(fetched)
+        self.progress.page_finished(page)
+        return len(self.parsed_offers) < 16 and items and items[-1]["isAvailable"]
 
     def _exclude_check(self, title: str) -> bool:
         if self.exclude:
@@ -304,64 +601,65 @@ class ProductManager:
             return bool(re.search(self.include, title))
         return True
 
-    def _create_progress_bar(self) -> None:
-        self.rich_progress = Progress(
-            "{task.description}",
-            SpinnerColumn(),
-            BarColumn(),
-            TextColumn("[progress.percentage]{task.completed}/{task.total}"),
-            TimeRemainingColumn(elapsed_when_finished=True, compact=True),
-        )
-        self.rich_progress.start()
-
-    def _process_page(self, offset: int, main_job) -> tuple[bool, dict]:
+    def _process_page(self, offset: int) -> tuple[bool, dict]:
         response_json = self._get_page(offset)
         parse_next_page = self._parse_page(response_json)
-        self.rich_progress.update(main_job, advance=1)
         return parse_next_page, response_json
 
     def _parse_multi_page(self) -> None:
         start_offset = 0
         item_count_total = None
 
-        self._create_progress_bar()
+        self.progress.start()
         pages_to_parse = [start_offset]
-        main_job = self.rich_progress.add_task("[green]Общий прогресс", total=1)
-
-        max_threads = min(len(pages_to_parse), self.threads)
-        while pages_to_parse and len(self.parsed_offers) < 16:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
-                futures = {executor.submit(self._process_page, page, main_job): page for page in pages_to_parse}
-                for future in concurrent.futures.as_completed(futures):
-                    try:
-                        parse_next_page, response_json = future.result()
+
+        try:
+            max_threads = min(len(pages_to_parse), self.threads)
+            while pages_to_parse and len(self.parsed_offers) < 16:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
+                    # Потоки страниц записывают в трассировку запроса, который запустил разбор
+                    futures = {
+                        executor.submit(contextvars.copy_context().run, self._process_page, page): page
+                        for page in pages_to_parse
+                    }
+                    for future in concurrent.futures.as_completed(futures):
                         page = futures[future]
-                        if page == start_offset and item_count_total is None:
-                            items_per_page = int(response_json.get("limit", 44))
-                            item_count_total = int(response_json["total"])
-                            if self.max_pages is not None:
-                                max_items = self.max_pages * items_per_page
-                                item_count_total = min(item_count_total, max_items)
-                            pages_to_parse = list(range(items_per_page, item_count_total, items_per_page))
-                            self.rich_progress.update(main_job, total=len(pages_to_parse) + 1)
-                        if page in pages_to_parse:
-                            pages_to_parse.remove(page)
-                        if parse_next_page and len(self.parsed_offers) < 16:
-                            next_page = page + items_per_page
-                            if next_page < item_count_total and next_page not in pages_to_parse:
-                                pages_to_parse.append(next_page)
-                        else:
-                            self.logger.info("Дальше товары не в наличии или достигнуто 16 товаров, парсинг завершен")
-                            for fut in futures:
-                                future_page = futures[fut]
-                                if future_page > page:
-                                    if future_page in pages_to_parse:
-                                        pages_to_parse.remove(future_page)
-                                    self.rich_progress.update(main_job, total=len(pages_to_parse) + 1)
-                                    fut.cancel()
-                    except Exception:
-                        continue
-        self.rich_progress.stop()
+                        try:
+                            parse_next_page, response_json = future.result()
+                            if page == start_offset and item_count_total is None:
+                                items_per_page = int(response_json.get("limit", 44))
+                                item_count_total = int(response_json["total"])
+                                if self.max_pages is not None:
+                                    max_items = self.max_pages * items_per_page
+                                    item_count_total = min(item_count_total, max_items)
+                                pages_to_parse = list(range(items_per_page, item_count_total, items_per_page))
+                                self.progress.set_pages(len(pages_to_parse) + 1)
+                            if page in pages_to_parse:
+                                pages_to_parse.remove(page)
+                            if parse_next_page and len(self.parsed_offers) < 16:
+                                next_page = page + items_per_page
+                                if next_page < item_count_total and next_page not in pages_to_parse:
+                                    pages_to_parse.append(next_page)
+                            else:
+                                logger.info("Дальше товары не в наличии или достигнуто 16 товаров, парсинг завершен")
+                                for fut in futures:
+                                    future_page = futures[fut]
+                                    if future_page > page:
+                                        if future_page in pages_to_parse:
+                                            pages_to_parse.remove(future_page)
+                                        self.progress.set_pages(len(pages_to_parse) + 1)
+                                        fut.cancel()
+                        except MegamarketError as e:
+                            # Без первой страницы неизвестно, сколько товаров, искать дальше нечего
+                            if page == start_offset and item_count_total is None:
+                                raise
+                            logger.error("Страница %s не получена: %s", page, e)
+                            if page in pages_to_parse:
+                                pages_to_parse.remove(page)
+                        except Exception:
+                            continue
+        finally:
+            self.progress.stop()
 
     def _output_offers(self) -> None:
         output_data = [
@@ -388,47 +686,51 @@ class ProductManager:
         try:
             with open(output_file, "w", encoding="utf-8") as f:
                 json.dump(output_data, f, ensure_ascii=False, indent=2)
-            self.logger.info(f"Спаршенные товары сохранены в {output_file}")
+            logger.info("Спаршенные товары сохранены в %s", output_file)
         except Exception as e:
-            self.logger.error(f"Ошибка при сохранении в файл: {e}")
+            logger.error("Ошибка при сохранении в файл: %s", e)
 
-        self.logger.info("Спаршенные товары:")
+        logger.info("Спаршенные товары:")
         for i, offer in enumerate(output_data):
-            self.logger.info(
-                f"{i}) Название: {offer['name']}, Бренд: {offer['brand'] or '-'}, "
-                f"Цена: {offer['price']} руб., Старая цена: {offer['old_price']} руб., "
-                f"Рейтинг: {offer['rating'] or '-'}, Количество отзывов: {offer['reviews_count'] or '-'}, "
-                f"Количество: {offer['available_quantity']}, URL: {offer['url']}, "
-                f"Дата доставки: {offer['delivery_date'] or '-'}"
+            logger.info(
+                "%s) Название: %s, Бренд: %s, Цена: %s руб., Старая цена: %s руб., Рейтинг: %s, "
+                "Количество отзывов: %s, Количество: %s, URL: %s, Дата доставки: %s",
+                i, offer['name'], offer['brand'] or '-', offer['price'], offer['old_price'], offer['rating'] or '-',
+                offer['reviews_count'] or '-', offer['available_quantity'], offer['url'], offer['delivery_date'] or '-',
             )
-        self.logger.info(f"Всего выведено товаров: {len(output_data)}")
+        logger.info("Всего выведено товаров: %s", len(output_data))
 
 class ImageDownloader:
     @staticmethod
+    @stage('images', 'mm')
     def save_images(product_id: str, image_url: str, timeout: int = 10):
         folder_path = os.path.join(settings.MEDIA_ROOT, 'image', 'mm', str(product_id))
         image_path = os.path.join(folder_path, "1.jpg")
-        logger.info(f"Попытка загрузки изображения: {image_url}")
+        logger.debug("Попытка загрузки изображения: %s", image_url)
         try:
-            response = requests.get(image_url, timeout=timeout)
+            response = cassettes.request(requests, 'get', image_url, timeout=timeout)
             response.raise_for_status()
-            os.makedirs(folder_path, exist_ok=True)
-            with open(image_path, "wb") as file:
-                file.write(response.content)
-            logger.info(f"Успешно сохранено: {image_path}")
         except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка загрузки {image_url}: {e}")
-        except OSError as e:
-            logger.error(f"Ошибка сохранения файла {image_path}: {e}")
+            logger.warning("Ошибка загрузки %s: %s", image_url, e, extra={'event': 'image_download_failed'})
+            return False
+        if not write_atomic(image_path, response.content):
+            return False
+        logger.debug("Успешно сохранено: %s", image_path)
+        return True
 
 if __name__ == "__main__":
+    from rich.logging import RichHandler
+    logging.basicConfig(level=logging.DEBUG, format="%(message)s", datefmt="%H:%M:%S", handlers=[RichHandler(rich_tracebacks=True)])
     product_name = input("Введите название товара для поиска: ")
     sorting_value = int(input("Введите значение сортировки (например, 0 для по умолчанию, 1 для по цене и т.д.): "))
-    parser = ProductManager(
-        product_name=product_name,
-        cookie_file_path="cookies.json",
-        log_level="DEBUG",
-        max_pages=1,
-        sorting=sorting_value,
-    )
-    parser.parse()
\ No newline at end of file
+    try:
+        parser = ProductManager(
+            product_name=product_name,
+            cookie_file_path="cookies.json",
+            max_pages=1,
+            sorting=sorting_value,
+            progress=RichProgressSink(),
+        )
+        parser.parse()
+    except MegamarketError as e:
+        sys.exit(str(e))
\ No newline at end of file
@@ -1,5 +1,9 @@
 import time
 import json
+import logging
+import os
+import requests
+from django.conf import settings
 from selenium import webdriver
 from selenium_stealth import stealth
 from selenium.webdriver.common.by import By
@@ -8,12 +12,52 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 import tempfile
 
+import cassettes
+from media_files import write_atomic
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+
+def parse_tile(element) -> dict:
+    """Return the fields of a product tile of the search grid."""
+    def get_text(selector):
+        el = element.select_one(selector)
+        return el.get_text(strip=True) if el else None
+
+    link_el = element.select_one("a.tile-clickable-element")
+    link = link_el["href"] if link_el and "href" in link_el.attrs else None
+    image_el = element.select_one("img[src]")
+    return {
+        "url": f"https://www.ozon.ru{link}" if link else None,
+        "image_url": image_el["src"] if image_el else None,
+        "price": get_text("span.tsHeadline500Medium"),
+        "old_price": get_text("span.tsBodyControl400Small.c390-b"),
+        "discount": get_text("span.tsBodyControl400Small:not(.c390-b)"),
+        "left": get_text("div.p6b20-a span.p6b20-a4"),
+        "name": get_text("a.tile-clickable-element span.tsBody500Medium"),
+        "rating": get_text("div.tsBodyMBold span:nth-of-type(1) span"),
+        "reviews": get_text("div.tsBodyMBold span:nth-of-type(2) span"),
+    }
+
+
+def parse_tiles(html: str) -> list[dict]:
+    """Parse the inner HTML of a tileGridDesktop widget into product fields."""
+    soup = BeautifulSoup(html, "html.parser")
+    return [parse_tile(product) for product in soup.find_all("div", attrs={"data-index": True})]
+
+
 class OzonParser:
-    def __init__(self, query, scroll_count=2, scroll_loops=3):
+    """screenshot_dir: where to save a screenshot when the site does not load; by default none is saved."""
+
+    def __init__(self, query, scroll_count=2, scroll_loops=3, screenshot_dir=None):
         self.query = query
         self.scroll_count = scroll_count
         self.scroll_loops = scroll_loops
+        self.screenshot_dir = screenshot_dir
         self.count_link = 0
+        # Плитки по ссылке: при прокрутке сетка разбирается заново
+        self.products = {}
         self.driver = self._init_driver()
 
     def _init_driver(self):
@@ -49,10 +93,14 @@ class OzonParser:
             WebDriverWait(self.driver, 15).until(
                 EC.presence_of_element_located((By.CSS_SELECTOR, "input[placeholder='Искать на Ozon']"))
             )
-        except Exception as e:
-            print(f"Ошибка при загрузке страницы: {e}")
-            self.driver.save_screenshot("/app/ozon_error.png")
-
+        except Exception:
+            logger.warning("Страница %s не загрузилась", url, exc_info=True)
+            if self.screenshot_dir:
+                # Свой файл на каждую ошибку: поиски идут одновременно
+                fd, path = tempfile.mkstemp(prefix="ozon_error_", suffix=".png", dir=self.screenshot_dir)
+                os.close(fd)
+                if self.driver.save_screenshot(path):
+                    logger.warning("Снимок страницы: %s", path)
 
     def search_product(self):
         element_search = self.driver.find_element(By.CSS_SELECTOR, "input[placeholder='Искать на Ozon']")
@@ -78,34 +126,14 @@ class OzonParser:
     def _parse_products(self):
         elements = self.driver.find_elements(By.CSS_SELECTOR, "div[data-widget='tileGridDesktop']")
         for element in elements:
-            html = element.get_attribute("innerHTML")
-            soup = BeautifulSoup(html, "html.parser")
-
-            for product in soup.find_all("div", attrs={"data-index": True}):
-                self._print_product_info(product)
+            for product in parse_tiles(element.get_attribute("innerHTML")):
+                if product["url"]:
+                    self.products.setdefault(product["url"], product)
 
-    def _print_product_info(self, element):
+    def _print_product_info(self, product):
         print(f"Товар номер {self.count_link}: ")
-
-        def get_text(selector, cls=None):
-            el = element.select_one(selector if not cls else f"{selector}.{cls}")
-            return el.get_text(strip=True) if el else None
-
-        def get_attr(selector, attr):
-            el = element.select_one(selector)
-            return el[attr] if el and attr in el.attrs else None
-
-        link = get_attr("a.tile-clickable-element", "href")
-        print(f"https://www.ozon.ru{link}" if link else None)
-
-        print(get_text("span", "tsHeadline500Medium"))  # price
-        print(get_text("span", "tsBodyControl400Small.c390-b"))  # old price
-        print(get_text("span.tsBodyControl400Small:not(.c390-b)"))  # discount
-        print(get_text("div.p6b20-a span.p6b20-a4"))  # left
-        print(get_text("a.tile-clickable-element span.tsBody500Medium"))  # name
-        print(get_text("div.tsBodyMBold span:nth-of-type(1) span"))  # rating
-        print(get_text("div.tsBodyMBold span:nth-of-type(2) span"))  # reviews
-
+        for value in product.values():
+            print(value)
         self.count_link += 1
 
     def save_full_page(self, filename="page.html"):
@@ -113,18 +141,49 @@ class OzonParser:
         with open(filename, "w", encoding="utf-8") as file:
             file.write(soup.prettify())
 
+    def collect(self) -> list[dict]:
+        """Search for the query and return the parsed tiles; the browser is closed afterwards."""
+        try:
+            self.open_site()
+            self.search_product()
+            self.scroll_and_parse()
+            return list(self.products.values())
+        finally:
+            self.driver.quit()
+
     def run(self):
         self.open_site()
         self.search_product()
         self.scroll_and_parse()
+        for product in self.products.values():
+            self._print_product_info(product)
         self.save_full_page()
         print(f"Количество ссылок: {self.count_link}")
         self.driver.quit()
 
 
+class ImageDownloader:
+    @staticmethod
+    @stage('images', 'ozon')
+    def save_images(product_id: str, image_url: str, timeout: int = 10):
+        folder_path = os.path.join(settings.MEDIA_ROOT, 'image', 'ozon', str(product_id))
+        image_path = os.path.join(folder_path, "1.jpg")
+        logger.debug("Попытка загрузки изображения: %s", image_url)
+        try:
+            response = cassettes.request(requests, 'get', image_url, timeout=timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logger.warning("Ошибка загрузки %s: %s", image_url, e, extra={'event': 'image_download_failed'})
+            return False
+        if not write_atomic(image_path, response.content):
+            return False
+        logger.debug("Успешно сохранено: %s", image_path)
+        return True
+
+
 if __name__ == "__main__":
     query = input("Напишите товар для поиска: ")
     while not query:
         query = input("Напишите, пожалуйста товар для поиска: ")
-    parser = OzonParser(query="s24")
+    parser = OzonParser(query="s24", screenshot_dir=".")
     parser.run()
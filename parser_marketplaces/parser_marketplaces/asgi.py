@@ -9,8 +9,20 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'parser_marketplaces.settings')
 
 application = get_asgi_application()
+
+# Индекс изображений строится при запуске, а не первым запросом к /img/
+from search.images import image_index
+
+image_index.load()
+
+# Статику в режиме отладки раздаёт само приложение, как это делал runserver
+if settings.DEBUG:
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+
+    application = ASGIStaticFilesHandler(application)
@@ -0,0 +1,150 @@
+"""Project logging: request ids, JSON records and sampling of high-volume events.
+
+Logging is configured once, by settings.LOGGING; modules only call
+logging.getLogger(__name__) and pass arguments lazily
+(``logger.debug("... %s", value)``), so nothing is formatted when the level
+is off. A record logged with ``extra={'event': name}`` is a high-volume
+event: with LOG_SAMPLING = {name: N} only every N-th one is emitted.
+"""
+import itertools
+import json
+import logging
+import re
+import uuid
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import FileResponse
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+# Id от прокси принимается, только если он не сломает заголовок ответа и строку лога
+REQUEST_ID_RE = re.compile(r'[\w.-]{1,64}', re.ASCII)
+
+request_id_var: ContextVar[str] = ContextVar('request_id', default='-')
+
+
+class RequestIdFilter(logging.Filter):
+    """Add the id of the current request to every record as record.request_id."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SampleFilter(logging.Filter):
+    """Emit only every N-th record of each sampled event."""
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = {event: rate for event, rate in (rates or {}).items() if rate > 1}
+        self._counters = {event: itertools.count() for event in self.rates}
+
+    def filter(self, record):
+        event = getattr(record, 'event', None)
+        if event not in self.rates:
+            return True
+        return next(self._counters[event]) % self.rates[event] == 0
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; fields passed in extra are included as is."""
+    RESERVED = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage(),
+        }
+        data.update((key, value) for key, value in vars(record).items() if key not in self.RESERVED)
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def _with_request_id(content, request_id):
+    """Iterate content with request_id set while each chunk is produced, and only then."""
+    iterator = iter(content)
+    try:
+        while True:
+            token = request_id_var.set(request_id)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                request_id_var.reset(token)
+            yield chunk
+    finally:
+        # Клиент мог отключиться посреди ответа
+        if hasattr(iterator, 'close'):
+            iterator.close()
+
+
+async def _awith_request_id(content, request_id):
+    iterator = aiter(content)
+    try:
+        while True:
+            token = request_id_var.set(request_id)
+            try:
+                chunk = await anext(iterator)
+            except StopAsyncIteration:
+                return
+            finally:
+                request_id_var.reset(token)
+            yield chunk
+    finally:
+        if hasattr(iterator, 'aclose'):
+            await iterator.aclose()
+
+
+class RequestIdMiddleware:
+    """Take the request id from X-Request-ID or generate one, and return it in the response.
+
+    The id is reset when the view returns. A streaming response is produced
+    later, possibly in another context, so its content sets the id again
+    around each chunk.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def _request_id(request):
+        request_id = request.headers.get(REQUEST_ID_HEADER, '')
+        return request_id if REQUEST_ID_RE.fullmatch(request_id) else uuid.uuid4().hex
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_id = self._request_id(request)
+        token = request_id_var.set(request_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        return self._finish(response, request_id)
+
+    async def __acall__(self, request):
+        request_id = self._request_id(request)
+        token = request_id_var.set(request_id)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        return self._finish(response, request_id)
+
+    @staticmethod
+    def _finish(response, request_id):
+        # Файл отдаётся без записей в лог; обёртка отключила бы sendfile сервера
+        if response.streaming and not isinstance(response, FileResponse):
+            wrap = _awith_request_id if response.is_async else _with_request_id
+            response.streaming_content = wrap(response.streaming_content, request_id)
+        response[REQUEST_ID_HEADER] = request_id
+        return response
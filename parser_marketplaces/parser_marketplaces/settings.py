@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'parser_marketplaces.logs.RequestIdMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -90,9 +91,94 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST':     os.getenv('DB_HOST'),  # <--- это имя сервиса "db" из docker-compose
         'PORT':     os.getenv('DB_PORT', '5432'),
+        # Соединение переиспользуется между запросами DB_CONN_MAX_AGE секунд
+        # (0 — новое соединение на каждый запрос) и проверяется перед повторным использованием.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Пул соединений psycopg 3 вместо постоянных соединений. DB_POOL_SIZE — число
+# соединений на процесс, его стоит задавать равным числу потоков воркера
+# (например, --threads gunicorn); всего к базе открывается
+# воркеры * DB_POOL_SIZE соединений, это должно быть меньше max_connections.
+# При CONN_HEALTH_CHECKS пул проверяет соединение перед выдачей.
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '0'))
+if DB_POOL_SIZE:
+    DATABASES['default']['CONN_MAX_AGE'] = 0  # Django не допускает пул вместе с постоянными соединениями
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': min(int(os.getenv('DB_POOL_MIN_SIZE', '2')), DB_POOL_SIZE),
+            'max_size': DB_POOL_SIZE,
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),  # ожидание свободного соединения, с
+            'max_idle': 300,
+        },
+    }
+
+
+# Потоков для блокирующих запросов к маркетплейсам на процесс. Один поиск
+# занимает по потоку на каждый выбранный маркетплейс на время ответа маркетплейса.
+SEARCH_ADAPTER_THREADS = int(os.getenv('SEARCH_ADAPTER_THREADS', '64'))
+
+# Адреса маркетплейсов. Для нагрузочного теста все указывают на заглушку
+# manage.py stub_marketplaces, например http://127.0.0.1:8900.
+# WB_IMAGES_BASE_URL пусто — картинки Wildberries берутся с basket-NN.wbbasket.ru.
+WB_SEARCH_BASE_URL = os.getenv('WB_SEARCH_BASE_URL', 'https://search.wb.ru')
+WB_IMAGES_BASE_URL = os.getenv('WB_IMAGES_BASE_URL', '')
+YMA_BASE_URL = os.getenv('YMA_BASE_URL', 'https://market.yandex.ru')
+MM_BASE_URL = os.getenv('MM_BASE_URL', 'https://megamarket.ru')
+
+# Запись и воспроизведение ответов маркетплейсов (модуль cassettes): путь к
+# кассете .jsonl.gz, режим record или replay и время ответов при воспроизведении:
+# original — с записанной задержкой, none — сразу. Пустой путь — обычные запросы.
+HTTP_CASSETTE = os.getenv('HTTP_CASSETTE', '')
+HTTP_CASSETTE_MODE = os.getenv('HTTP_CASSETTE_MODE', 'replay')
+HTTP_CASSETTE_TIMING = os.getenv('HTTP_CASSETTE_TIMING', 'original')
+
+# Сколько часов сохранённое предложение Мегамаркета используется вместо нового
+# запроса, если строка товара в выдаче не изменилась (дата доставки со временем устаревает)
+MM_OFFER_MAX_AGE_HOURS = int(os.getenv('MM_OFFER_MAX_AGE_HOURS', '24'))
+
+# Кэш предложений Мегамаркета по goodsId, общий для разных запросов: сколько
+# секунд хранится предложение (0 — кэш выключен) и сколько товаров помещается
+# в кэш процесса. MM_OFFER_CACHE_ALIAS — псевдоним из CACHES, чтобы кэш был
+# общим для всех процессов (например, Redis); пусто — кэш в памяти процесса.
+MM_OFFER_CACHE_TTL = int(os.getenv('MM_OFFER_CACHE_TTL', '600'))
+MM_OFFER_CACHE_SIZE = int(os.getenv('MM_OFFER_CACHE_SIZE', '10000'))
+MM_OFFER_CACHE_ALIAS = os.getenv('MM_OFFER_CACHE_ALIAS', '')
+
+# REDIS_URL подключает общий кэш Redis (нужен пакет redis); без него — кэш в памяти процесса
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+    } if os.getenv('REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# Пакетная проверка цен: сколько запросов пакета выполняется одновременно.
+# Сколько одновременных обращений допускается к маркетплейсу, объявляет его
+# адаптер (search/adapters.py); BATCH_<WB|YMA|MM|OZON>_CONCURRENCY переопределяет.
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '8'))
+BATCH_HOST_CONCURRENCY = {
+    slug: int(os.environ[f'BATCH_{slug.upper()}_CONCURRENCY'])
+    for slug in ('wb', 'yma', 'mm', 'ozon')
+    if os.getenv(f'BATCH_{slug.upper()}_CONCURRENCY')
+}
+
+# Поиск на Ozon идёт через headless Chrome (ozon_selenium), поэтому включается явно
+OZON_SEARCH_ENABLED = os.getenv('OZON_SEARCH_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+
+# Метрики поиска на /metrics в формате Prometheus. Если задан METRICS_TOKEN,
+# нужен заголовок "Authorization: Bearer <токен>" (bearer_token в Prometheus).
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Трассировка поиска сохраняется (админка → Трассировки поиска), если поиск
+# шёл дольше стольких миллисекунд; 0 — не сохранять.
+SEARCH_TRACE_THRESHOLD_MS = int(os.getenv('SEARCH_TRACE_THRESHOLD_MS', '5000'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -166,20 +252,42 @@ AUTH_USER_MODEL = 'users.User'
 
 DEFAULT_USER_IMAGE = MEDIA_URL + 'users/default.png'
 
+# Логирование настраивается только здесь. LOG_FORMAT=json пишет по JSON-объекту
+# на запись (с request_id и полями из extra), text — строки для консоли.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+# Частые события (extra={'event': ...}): выводится только каждое N-е
+LOG_SAMPLING = {
+    'image_download_failed': int(os.getenv('LOG_SAMPLE_IMAGE_ERRORS', '10')),
+    'product_skipped': int(os.getenv('LOG_SAMPLE_PRODUCT_SKIPPED', '10')),
+    'yma_snippet_incomplete': int(os.getenv('LOG_SAMPLE_YMA_SNIPPET', '50')),
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {'()': 'parser_marketplaces.logs.RequestIdFilter'},
+        'sampling': {'()': 'parser_marketplaces.logs.SampleFilter', 'rates': LOG_SAMPLING},
+    },
+    'formatters': {
+        'text': {'format': '%(asctime)s [%(levelname)s] %(name)s %(request_id)s: %(message)s'},
+        'json': {'()': 'parser_marketplaces.logs.JsonFormatter'},
+    },
     'handlers': {
         'console': {
-            'level': 'INFO',  # Выводим логи уровня INFO и выше
-            'class': 'logging.StreamHandler',  # Логирование в стандартный вывод
+            'class': 'logging.StreamHandler',
+            'filters': ['request_id', 'sampling'],
+            'formatter': LOG_FORMAT,
         },
     },
+    'root': {
+        'handlers': ['console'],
+        'level': LOG_LEVEL,
+    },
     'loggers': {
         'django': {
-            'handlers': ['console'],  # Логируем в консоль
-            'level': 'INFO',  # Уровень логирования
-            'propagate': True,
+            'level': 'INFO',
         },
     },
 }
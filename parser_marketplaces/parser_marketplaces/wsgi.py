@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'parser_marketplaces.settings')
 
 application = get_wsgi_application()
+
+# Индекс изображений строится при запуске, а не первым запросом к /img/
+from search.images import image_index
+
+image_index.load()
@@ -0,0 +1,318 @@
+"""Marketplace adapters behind one async interface.
+
+Each adapter wraps the blocking client of a marketplace (wb_api, yandex_api,
+mm_api, ozon_selenium) and is searched the same way:
+``await get_adapter(marketplace).search(query, sort, price_range, limit)``
+returns ProductRecord objects. An adapter declares how it is scheduled: how
+many of its searches a batch runs at once and how long a search may take.
+
+The client module is imported on the first search, so management commands,
+the admin and worker start-up do not pay for requests, curl_cffi and bs4.
+A new marketplace is a Marketplace value with a slug plus a registered
+subclass.
+"""
+import asyncio
+import contextvars
+import functools
+import importlib
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from .models import BatchItem, Marketplace, MARKETPLACE_SLUGS, SORT_PARAM_MAPPING
+from .services import MMOfferStore, ProductRecord, _release_connection, convert_products
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Адаптеры маркетплейсов блокирующие (requests, Selenium), поэтому выполняются
+# в отдельном пуле потоков, а не в потоках Django и не в цикле событий.
+ADAPTER_EXECUTOR = ThreadPoolExecutor(max_workers=settings.SEARCH_ADAPTER_THREADS, thread_name_prefix="adapter")
+
+ADAPTERS = {}
+
+
+class PriceRange(NamedTuple):
+    """Price bounds of a search as entered by the user, '' for none."""
+    price_min: str = ''
+    price_max: str = ''
+
+    def __str__(self):
+        return f"{self.price_min}-{self.price_max}"
+
+
+def register(adapter_class):
+    ADAPTERS[adapter_class.marketplace] = adapter_class
+    return adapter_class
+
+
+def enabled_marketplaces():
+    """Return marketplaces whose adapters are enabled, in Marketplace order."""
+    return [marketplace for marketplace in Marketplace if marketplace in ADAPTERS and ADAPTERS[marketplace].enabled()]
+
+
+def get_adapter(marketplace, **options):
+    return ADAPTERS[Marketplace(marketplace)](**options)
+
+
+def adapter_module(marketplace):
+    """Return the client module of marketplace, importing it on the first call."""
+    return importlib.import_module(ADAPTERS[Marketplace(marketplace)].module)
+
+
+class MarketplaceAdapter:
+    marketplace = None
+    # Модуль клиента маркетплейса, импортируется при первом поиске
+    module = ''
+    # Сколько поисков на маркетплейсе пакет выполняет одновременно
+    # (переопределяется BATCH_HOST_CONCURRENCY) и сколько секунд ждать ответа
+    concurrency = 1
+    timeout = 60.0
+
+    def __init__(self, progress=None):
+        self.progress = progress
+
+    @classmethod
+    def enabled(cls):
+        return True
+
+    @classmethod
+    def batch_concurrency(cls):
+        return settings.BATCH_HOST_CONCURRENCY.get(MARKETPLACE_SLUGS[cls.marketplace], cls.concurrency)
+
+    @property
+    def slug(self):
+        return MARKETPLACE_SLUGS[self.marketplace]
+
+    @property
+    def client(self):
+        return importlib.import_module(self.module)
+
+    def fetch(self, query, sort, price_range):
+        """Search the marketplace; blocking, runs in the adapter pool. Returns client products."""
+        raise NotImplementedError
+
+    def to_record(self, product):
+        raise NotImplementedError
+
+    def save_image(self, product_id, image_url):
+        """Download the product image to media/image/<slug>/<product_id>/1.jpg; return True on success."""
+        return self.client.ImageDownloader.save_images(product_id, image_url)
+
+    async def search(self, query, sort='priceup', price_range=PriceRange(), limit=None):
+        """Search the marketplace and return up to limit records; errors and timeouts give no records."""
+        loop = asyncio.get_running_loop()
+        try:
+            with stage('adapter', self.slug):
+                # Контекст копируется, чтобы адаптер писал в трассировку текущего запроса
+                products = await asyncio.wait_for(
+                    loop.run_in_executor(
+                        ADAPTER_EXECUTOR, contextvars.copy_context().run, self.fetch, query, sort, price_range,
+                    ),
+                    self.timeout,
+                )
+        except TimeoutError:
+            logger.error("Поиск на %s не уложился в %s с", self.marketplace.label, self.timeout)
+            return []
+        except Exception as e:
+            logger.error("Ошибка поиска на %s: %s", self.marketplace.label, e)
+            return []
+        records = convert_products(products, self.to_record)
+        return records[:limit] if limit is not None else records
+
+
+@register
+class WildberriesAdapter(MarketplaceAdapter):
+    marketplace = Marketplace.WILDBERRIES
+    module = 'wb_api'
+    concurrency = 4
+    timeout = 30.0
+
+    def fetch(self, query, sort, price_range):
+        return self.client.ProductManager().search_and_display(
+            query, SORT_PARAM_MAPPING.get(sort, {}).get("wb", sort),
+            price_min=price_range.price_min, price_max=price_range.price_max, download_images=False,
+        )
+
+    def to_record(self, product):
+        return ProductRecord(
+            marketplace=Marketplace.WILDBERRIES,
+            product_id=product.product_id,
+            name=product.name or "Без названия",
+            brand=product.brand,
+            color=product.color,
+            supplier_id=product.supplier_id,
+            pics=product.pics or 0,
+            image_url=self.client.ImageDownloader.image_url(product.product_id) if product.pics else None,
+            price_product=product.price_product,
+            price_basic=product.price_basic,
+            review_rating=product.review_rating,
+            feedbacks=product.feedbacks,
+            supplier_rating=product.supplier_rating,
+            delivery_date=product.delivery_date,
+        )
+
+    def save_image(self, product_id, image_url):
+        # Ссылка на изображение WB строится по id товара
+        return self.client.ImageDownloader.save_images(product_id, 1, False)
+
+
+@register
+class YandexMarketAdapter(MarketplaceAdapter):
+    marketplace = Marketplace.YANDEX_MARKET
+    module = 'yandex_api'
+    concurrency = 2
+    timeout = 30.0
+
+    def fetch(self, query, sort, price_range):
+        return self.client.ProductManager().search_and_display(
+            query, SORT_PARAM_MAPPING.get(sort, {}).get("yandex", "dpop"),
+            price_min=price_range.price_min, price_max=price_range.price_max, save_image_all=False,
+        )
+
+    def to_record(self, product):
+        return ProductRecord(
+            marketplace=Marketplace.YANDEX_MARKET,
+            product_id=int(product.product_id),
+            name=product.name or "Без названия",
+            brand=product.brand,
+            pics=1 if product.image_url else 0,
+            image_url=product.image_url,
+            url=product.url,
+            price_product=product.price,
+            price_basic=product.original_price,
+            review_rating=product.rating,
+            feedbacks=product.reviews_count,
+            delivery_date=product.delivery_date,
+            duty=product.duty,
+        )
+
+
+@register
+class MegamarketAdapter(MarketplaceAdapter):
+    """progress is a mm_api.ProgressSink for the parser; by default progress is not reported."""
+    marketplace = Marketplace.MEGAMARKET
+    module = 'mm_api'
+    # Мегамаркет ограничивает частоту запросов, поэтому пакет обращается к нему по одному
+    concurrency = 1
+    timeout = 180.0
+
+    def fetch(self, query, sort, price_range):
+        parser = self.client.ProductManager(
+            product_name=query,
+            cookie_file_path=os.path.join(settings.BASE_DIR, "cookies.json"),
+            max_pages=1,
+            sorting=int(SORT_PARAM_MAPPING.get(sort, {}).get("mm", "0")),
+            price_min=price_range.price_min,
+            price_max=price_range.price_max,
+            download_images=False,
+            offer_store=MMOfferStore(),
+            offer_cache=mm_offer_cache(),
+            progress=self.progress,
+        )
+        parser.parse()
+        return parser.parsed_offers
+
+    def to_record(self, product):
+        return ProductRecord(
+            marketplace=Marketplace.MEGAMARKET,
+            product_id=int(product.product_id),
+            name=product.name or "Без названия",
+            brand=product.brand,
+            supplier_id=int(product.merchant_id) if str(product.merchant_id).isdigit() else None,
+            pics=1 if product.image_url else 0,
+            image_url=product.image_url,
+            url=product.url,
+            price_product=product.price,
+            price_basic=product.old_price,
+            review_rating=product.rating,
+            feedbacks=product.reviews_count,
+            supplier_rating=product.merchant_rating,
+            delivery_date=product.delivery_date,
+        )
+
+
+def _number(text, convert=int):
+    """Return the number in a price or rating text such as '1 299 ₽' or '4.8', or None."""
+    digits = re.sub(r'[^\d.,]', '', text or '').replace(',', '.').strip('.')
+    return convert(digits) if digits else None
+
+
+@register
+class OzonAdapter(MarketplaceAdapter):
+    """Ozon is searched in headless Chrome; enabled with OZON_SEARCH_ENABLED.
+
+    The search form of the site has no sorting or price filters, so sorting is
+    left to the caller and price bounds are applied to the parsed tiles.
+    """
+    marketplace = Marketplace.OZON
+    module = 'ozon_selenium'
+    concurrency = 1
+    timeout = 120.0
+
+    @classmethod
+    def enabled(cls):
+        return settings.OZON_SEARCH_ENABLED
+
+    def fetch(self, query, sort, price_range):
+        price_min = _number(price_range.price_min)
+        price_max = _number(price_range.price_max)
+        products = []
+        for tile in self.client.OzonParser(query).collect():
+            # id товара — число в конце ссылки на карточку
+            match = re.search(r'(\d+)/?(?:\?|$)', tile['url'] or '')
+            product = SimpleNamespace(**tile, product_id=int(match.group(1)) if match else None)
+            price = _number(product.price)
+            if price is not None and (price_min and price < price_min or price_max and price > price_max):
+                continue
+            products.append(product)
+        return products
+
+    def to_record(self, product):
+        return ProductRecord(
+            marketplace=Marketplace.OZON,
+            product_id=product.product_id,
+            name=product.name or "Без названия",
+            pics=1 if product.image_url else 0,
+            image_url=product.image_url,
+            url=product.url,
+            price_product=_number(product.price),
+            price_basic=_number(product.old_price),
+            review_rating=_number(product.rating, float),
+            feedbacks=_number(product.reviews),
+        )
+
+
+@functools.cache
+def mm_offer_cache():
+    """Return the Megamarket offer cache shared by all searches of the process, or None when disabled.
+
+    With MM_OFFER_CACHE_ALIAS the cache is shared by all processes.
+    """
+    if not settings.MM_OFFER_CACHE_TTL:
+        return None
+    mm_api = adapter_module(Marketplace.MEGAMARKET)
+    if settings.MM_OFFER_CACHE_ALIAS:
+        return mm_api.DjangoOfferCache(settings.MM_OFFER_CACHE_ALIAS, settings.MM_OFFER_CACHE_TTL)
+    return mm_api.MemoryOfferCache(settings.MM_OFFER_CACHE_TTL, settings.MM_OFFER_CACHE_SIZE)
+
+
+def item_progress(item):
+    """Return a progress sink that writes the Megamarket progress of a batch item to item.progress."""
+    def report(pages_done, pages):
+        try:
+            # Готовность только растёт, даже если отчёты записаны не по порядку
+            BatchItem.objects.filter(pk=item.pk).update(
+                progress=Greatest(F('progress'), min(pages_done * 100 // max(pages, 1), 100)),
+            )
+        finally:
+            _release_connection()
+
+    return adapter_module(Marketplace.MEGAMARKET).JobProgressSink(report)
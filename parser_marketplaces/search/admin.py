@@ -1,9 +1,118 @@
 from django.contrib import admin
-from .models import SearchQuery, Product
+from django.utils.html import format_html, format_html_join
+from .models import BatchItem, BatchJob, PriceAlert, PriceWatch, SearchQuery, SearchTrace, SearchArchive, CatalogProduct, PriceObservation, ProductPriceDaily, QueryPriceDaily
 
-@admin.register(Product)
-class AdminSearchProduct(admin.ModelAdmin):
-    list_display = ('name', 'price_product', 'feedbacks', "review_rating")
 
-admin.site.register(SearchQuery)
-# admin.site.register(Product, AdminSearchProduct)
+@admin.register(CatalogProduct)
+class AdminCatalogProduct(admin.ModelAdmin):
+    list_display = ('name', 'marketplace', 'brand', 'updated_at')
+    list_filter = ('marketplace',)
+    search_fields = ('name', 'product_id')
+
+
+@admin.register(PriceObservation)
+class AdminPriceObservation(admin.ModelAdmin):
+    list_display = ('product', 'price_product', 'feedbacks', 'review_rating', 'observed_at')
+    list_select_related = ('product',)
+    raw_id_fields = ('product',)
+
+
+@admin.register(SearchQuery)
+class AdminSearchQuery(admin.ModelAdmin):
+    list_display = ('__str__', 'created_at')
+    list_select_related = ('user',)
+
+
+@admin.register(SearchArchive)
+class AdminSearchArchive(admin.ModelAdmin):
+    list_display = ('searchquery', 'product_count', 'min_price', 'archived_at')
+    list_select_related = ('searchquery__user',)
+    exclude = ('data',)
+    raw_id_fields = ('searchquery',)
+
+
+@admin.register(ProductPriceDaily)
+class AdminProductPriceDaily(admin.ModelAdmin):
+    list_display = ('product', 'day', 'min_price', 'median_price', 'max_price', 'observation_count')
+    list_select_related = ('product',)
+    raw_id_fields = ('product',)
+
+
+@admin.register(QueryPriceDaily)
+class AdminQueryPriceDaily(admin.ModelAdmin):
+    list_display = ('query_key', 'marketplace', 'day', 'min_price', 'median_price', 'max_price', 'observation_count')
+    list_filter = ('marketplace',)
+    search_fields = ('query_key',)
+    raw_id_fields = ('min_product',)
+
+
+class BatchItemInline(admin.TabularInline):
+    model = BatchItem
+    fields = ('position', 'query_text', 'status', 'search_query', 'error', 'finished_at')
+    readonly_fields = fields
+    can_delete = False
+    extra = 0
+
+
+@admin.register(BatchJob)
+class AdminBatchJob(admin.ModelAdmin):
+    list_display = ('__str__', 'user', 'status', 'duplicates', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    inlines = (BatchItemInline,)
+
+
+@admin.register(PriceWatch)
+class AdminPriceWatch(admin.ModelAdmin):
+    list_display = ('query_text', 'user', 'threshold', 'last_price', 'is_active', 'next_run_at')
+    list_filter = ('is_active', 'interval_hours')
+    list_select_related = ('user',)
+    search_fields = ('query_key',)
+    raw_id_fields = ('user', 'last_search')
+
+
+@admin.register(PriceAlert)
+class AdminPriceAlert(admin.ModelAdmin):
+    list_display = ('__str__', 'product', 'created_at', 'sent_at')
+    list_select_related = ('watch', 'product')
+    raw_id_fields = ('watch', 'product', 'search_query')
+
+
+@admin.register(SearchTrace)
+class AdminSearchTrace(admin.ModelAdmin):
+    list_display = ('__str__', 'search_query', 'created_at')
+    list_select_related = ('search_query__user',)
+    list_filter = ('name',)
+    ordering = ('-created_at',)
+    fields = ('search_query', 'name', 'duration_ms', 'created_at', 'waterfall')
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description="Этапы")
+    def waterfall(self, obj):
+        # Полоса этапа смещена и растянута пропорционально его началу и длительности в поиске
+        total = max(obj.duration_ms, 1)
+        rows = format_html_join(
+            '',
+            '<tr><td>{}</td><td>{}</td><td>{}</td><td style="width:50%">'
+            '<div style="margin-left:{}%;width:{}%;min-width:1px;height:12px;background:{}"></div></td>'
+            '<td style="text-align:right">{} мс</td><td>{}</td></tr>',
+            (
+                (
+                    span['name'], span['marketplace'], span['detail'],
+                    f"{min(span['start_ms'] / total * 100, 100):.2f}",
+                    f"{min(span['duration_ms'] / total * 100, 100):.2f}",
+                    '#ba2121' if span.get('error') else '#417690',
+                    f"{span['duration_ms']:.1f}", span.get('error') or span['thread'],
+                )
+                for span in obj.spans
+            ),
+        )
+        return format_html(
+            '<table style="width:100%"><thead><tr><th>Этап</th><th>Маркетплейс</th><th>Подробности</th>'
+            '<th>{} мс</th><th>Длительность</th><th>Поток / ошибка</th></tr></thead><tbody>{}</tbody></table>',
+            f"0 — {obj.duration_ms:.0f}", rows,
+        )
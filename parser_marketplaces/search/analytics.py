@@ -0,0 +1,106 @@
+"""Daily price rollups per product and per normalized query.
+
+Rollups are refreshed for the products and query touched by each saved
+search, so the day's row is recomputed from that day's observations of a
+few keys only. Charts and analytics pages read the rollups and never scan
+raw observations.
+"""
+import logging
+import statistics
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.utils import timezone
+
+from .models import PriceObservation, ProductPriceDaily, QueryPriceDaily, SearchResult, RESULTS_WINDOW
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+SUMMARY_FIELDS = ('min_price', 'median_price', 'max_price', 'observation_count')
+
+
+def day_bounds(day):
+    """Return [start, end) of a local calendar day as aware datetimes."""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def _summary(prices):
+    prices = sorted(Decimal(price) for price in prices)
+    return {
+        'min_price': prices[0],
+        'median_price': statistics.median(prices).quantize(CENT),
+        'max_price': prices[-1],
+        'observation_count': len(prices),
+    }
+
+
+def refresh_product_rollups(product_ids, day):
+    """Recompute ProductPriceDaily of the given catalog products for day."""
+    start, end = day_bounds(day)
+    prices = defaultdict(list)
+    observations = PriceObservation.objects.filter(
+        product_id__in=product_ids, observed_at__gte=start, observed_at__lt=end, price_product__isnull=False
+    )
+    for product_id, price in observations.values_list('product_id', 'price_product'):
+        prices[product_id].append(price)
+    ProductPriceDaily.objects.bulk_create(
+        [ProductPriceDaily(product_id=product_id, day=day, **_summary(values)) for product_id, values in prices.items()],
+        update_conflicts=True,
+        unique_fields=['product', 'day'],
+        update_fields=SUMMARY_FIELDS,
+    )
+
+
+def refresh_query_rollups(query_key, day):
+    """Recompute QueryPriceDaily of a normalized query for day, one row per marketplace."""
+    start, end = day_bounds(day)
+    results = SearchResult.objects.filter(
+        searchquery__query_key=query_key,
+        searchquery__created_at__gte=start - RESULTS_WINDOW,
+        searchquery__created_at__lt=end,
+        observed_at__gte=start,
+        observed_at__lt=end,
+        observation__price_product__isnull=False,
+    )
+    prices = defaultdict(list)
+    cheapest = {}
+    for marketplace, product_id, price in results.values_list(
+        'observation__product__marketplace', 'observation__product_id', 'observation__price_product'
+    ):
+        prices[marketplace].append(price)
+        if marketplace not in cheapest or price < cheapest[marketplace][1]:
+            cheapest[marketplace] = (product_id, price)
+    QueryPriceDaily.objects.bulk_create(
+        [
+            QueryPriceDaily(
+                query_key=query_key,
+                marketplace=marketplace,
+                day=day,
+                min_product_id=cheapest[marketplace][0],
+                **_summary(values),
+            )
+            for marketplace, values in prices.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['query_key', 'day', 'marketplace'],
+        update_fields=SUMMARY_FIELDS + ('min_product',),
+    )
+
+
+def refresh_rollups(search_query, observations):
+    """Refresh rollups touched by a saved search.
+
+    Called after the search is committed; a failure is logged and does not
+    affect the search itself, ``manage.py rebuild_price_rollups`` repairs it.
+    """
+    if not observations:
+        return
+    day = timezone.localdate(observations[0].observed_at)
+    try:
+        refresh_product_rollups({observation.product_id for observation in observations}, day)
+        refresh_query_rollups(search_query.query_key, day)
+    except Exception as e:
+        logger.error("Ошибка при обновлении итогов цен для запроса %s: %s", search_query.pk, e)
@@ -0,0 +1,265 @@
+"""Batch price checks: many queries scheduled under per-marketplace limits.
+
+Each unique query of a job is searched on the job's marketplaces the same
+way as a regular search and saved to history as soon as it finishes, so an
+interrupted job resumes from the items that are not done yet.
+
+The limits are shared by every job of the process (API jobs, price watches,
+batch_search), whichever event loop runs them: at most BATCH_CONCURRENCY
+queries are in flight and each marketplace gets at most the simultaneous
+requests its adapter allows.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .adapters import ADAPTERS, PriceRange, enabled_marketplaces, get_adapter, item_progress
+from .models import BatchItem, BatchJob, Marketplace, SearchQuery, normalize_query
+from .services import order_records, save_trace, store_results
+from tracing import Trace, activate
+
+logger = logging.getLogger(__name__)
+
+# Запросов в одном пакете, не считая повторов
+MAX_BATCH_QUERIES = 2000
+
+# Пакеты, запущенные из API в этом процессе; ссылки не дают сборщику мусора удалить задачи
+_running = {}
+
+
+class Limiter:
+    """Counting semaphore shared by all event loops of the process.
+
+    limit is a callable, so the current settings apply to every acquire.
+    Waiters get free slots in arrival order.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    async def __aenter__(self):
+        with self._lock:
+            if self.active < self.limit() and not self._waiters:
+                self.active += 1
+                return
+            loop = asyncio.get_running_loop()
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                queued = waiter in self._waiters
+                if queued:
+                    self._waiters.remove(waiter)
+            # Место уже передано этой задаче: возвращаем его следующей
+            if not queued and waiter[1].done() and not waiter[1].cancelled():
+                self.release()
+            raise
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                loop, future = self._waiters.popleft()
+                try:
+                    # Место переходит ожидающему, счётчик не меняется
+                    loop.call_soon_threadsafe(self._wake, future)
+                    return
+                except RuntimeError:
+                    # Цикл событий ожидающего уже закрыт
+                    continue
+            self.active -= 1
+
+    def _wake(self, future):
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+
+# Запросов в работе во всех пакетах процесса и обращений к каждому маркетплейсу
+QUERY_LIMITER = Limiter(lambda: settings.BATCH_CONCURRENCY)
+MARKETPLACE_LIMITERS = {
+    marketplace: Limiter(adapter_class.batch_concurrency) for marketplace, adapter_class in ADAPTERS.items()
+}
+
+
+@dataclass
+class BatchStats:
+    done: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def queries_per_minute(self):
+        return (self.done + self.failed) * 60 / self.elapsed if self.elapsed else 0.0
+
+
+def create_batch_job(user, lines, marketplaces, sort_value="priceup", price_min=None, price_max=None):
+    """Create a job from query lines.
+
+    Blank lines, ``#`` comments and queries equal to an earlier one after
+    normalize_query are skipped; repeats are counted in job.duplicates.
+    Raises ValueError when no queries are left or there are too many, or
+    when a marketplace's adapter is disabled.
+    """
+    disabled = [Marketplace(marketplace) for marketplace in marketplaces if marketplace not in enabled_marketplaces()]
+    if disabled:
+        raise ValueError(f"Поиск выключен на маркетплейсах: {', '.join(marketplace.label for marketplace in disabled)}")
+    queries = {}
+    duplicates = 0
+    for line in lines:
+        text = line.strip()[:255]
+        if not text or text.startswith('#'):
+            continue
+        key = normalize_query(text)
+        if key in queries:
+            duplicates += 1
+        else:
+            queries[key] = text
+    if not queries:
+        raise ValueError("В списке нет запросов")
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise ValueError(f"В пакете больше {MAX_BATCH_QUERIES} запросов")
+
+    with transaction.atomic():
+        job = BatchJob.objects.create(
+            user=user,
+            sort_value=sort_value,
+            price_min=price_min,
+            price_max=price_max,
+            marketplaces=[int(marketplace) for marketplace in marketplaces],
+            duplicates=duplicates,
+        )
+        BatchItem.objects.bulk_create([
+            BatchItem(job=job, position=position, query_text=text, query_key=key)
+            for position, (key, text) in enumerate(queries.items())
+        ])
+    return job
+
+
+def item_result(item):
+    """Return the JSON-ready result of a batch item."""
+    search_query = item.search_query
+    return {
+        'query': item.query_text,
+        'status': item.status,
+        'search_id': item.search_query_id,
+        'product_count': search_query.product_count if search_query else None,
+        'min_price': search_query.min_price if search_query else None,
+        'error': item.error or None,
+        'progress': 100 if item.status != BatchItem.Status.PENDING else item.progress,
+    }
+
+
+async def _run_item(job, item):
+    price_range = PriceRange(*job.price_bounds)
+    current_trace = Trace(f'batch {job.pk}')
+
+    async def search(marketplace):
+        # Ограничение на маркетплейс общее для всех пакетов процесса
+        options = {'progress': item_progress(item)} if marketplace == Marketplace.MEGAMARKET else {}
+        async with MARKETPLACE_LIMITERS[marketplace]:
+            return await get_adapter(marketplace, **options).search(item.query_text, job.sort_value, price_range)
+
+    try:
+        with activate(current_trace):
+            record_lists = await asyncio.gather(*(search(Marketplace(value)) for value in job.marketplaces))
+        search_query = await SearchQuery.objects.acreate(
+            user_id=job.user_id,
+            query_text=item.query_text,
+            sort_value=job.sort_value,
+            price_range=str(price_range),
+            marketplaces=job.marketplaces,
+        )
+        with activate(current_trace):
+            await sync_to_async(store_results)(search_query, order_records(record_lists, job.sort_value))
+        await save_trace(current_trace, search_query)
+    except Exception as e:
+        logger.error("Ошибка запроса «%s» пакета %s: %s", item.query_text, job.pk, e)
+        item.status, item.error = BatchItem.Status.FAILED, str(e)
+    else:
+        item.status, item.error, item.search_query = BatchItem.Status.DONE, "", search_query
+    item.finished_at = timezone.now()
+    await item.asave(update_fields=['status', 'error', 'search_query', 'finished_at'])
+
+
+async def run_batch(job, on_item=None):
+    """Run the items of job that are not done yet and return stats of this run.
+
+    Items wait for QUERY_LIMITER and MARKETPLACE_LIMITERS, which are shared
+    with the other jobs of the process. on_item(item) is called after each
+    item is saved.
+    """
+    items = [
+        item async for item in job.items.exclude(status=BatchItem.Status.DONE).order_by('position')
+    ]
+    job.status, job.started_at, job.finished_at = BatchJob.Status.RUNNING, timezone.now(), None
+    await job.asave(update_fields=['status', 'started_at', 'finished_at'])
+    logger.info("Пакет %s: запросов к выполнению %s", job.pk, len(items))
+
+    stats = BatchStats()
+    pending = iter(items)
+    started = time.perf_counter()
+
+    async def worker():
+        # Все исполнители берут запросы из общего итератора по порядку
+        for item in pending:
+            async with QUERY_LIMITER:
+                await _run_item(job, item)
+            if item.status == BatchItem.Status.DONE:
+                stats.done += 1
+            else:
+                stats.failed += 1
+            if on_item:
+                on_item(item)
+
+    await asyncio.gather(*(worker() for _ in range(max(min(settings.BATCH_CONCURRENCY, len(items)), 1))))
+    stats.elapsed = time.perf_counter() - started
+    job.status, job.finished_at = BatchJob.Status.DONE, timezone.now()
+    await job.asave(update_fields=['status', 'finished_at'])
+    logger.info(
+        "Пакет %s завершён: выполнено %s, ошибок %s, %.1f запросов/мин",
+        job.pk, stats.done, stats.failed, stats.queries_per_minute,
+    )
+    return stats
+
+
+def recover_interrupted_jobs():
+    """Return jobs left running by a stopped process to the queue; return their number.
+
+    Only for server start-up, before any worker runs jobs: API jobs live in
+    the ASGI worker and stop with it, after which they can be resumed with
+    batch_search --resume.
+    """
+    count = BatchJob.objects.filter(status=BatchJob.Status.RUNNING).update(status=BatchJob.Status.PENDING)
+    if count:
+        logger.warning("Пакетов, прерванных остановкой сервера: %s", count)
+    return count
+
+
+def start_batch(job):
+    """Run job in the background on the running event loop (ASGI server process)."""
+    def finished(task):
+        _running.pop(job.pk, None)
+        if not task.cancelled() and task.exception():
+            logger.error("Пакет %s прерван: %s", job.pk, task.exception())
+
+    task = asyncio.get_running_loop().create_task(run_batch(job))
+    _running[job.pk] = task
+    task.add_done_callback(finished)
+    return task
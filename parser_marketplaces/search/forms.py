@@ -2,6 +2,9 @@
 
 from django import forms
 
+from .adapters import enabled_marketplaces
+from .models import PriceWatch, MARKETPLACE_SLUGS, SORT_VALUE_CHOICES
+
 class SearchForm(forms.Form):
     query = forms.CharField(
         max_length=255,
@@ -12,4 +15,91 @@ class SearchForm(forms.Form):
     #     initial=20,
     #     min_value=1,
     #     max_value=100
-    # )
\ No newline at end of file
+    # )
+
+class AnalyticsForm(forms.Form):
+    query = forms.CharField(
+        max_length=255,
+        label="Запрос",
+        widget=forms.TextInput(attrs={'class': 'form-control'}),
+    )
+    days = forms.TypedChoiceField(
+        label="Период",
+        choices=[(7, "Неделя"), (30, "Месяц"), (90, "3 месяца")],
+        coerce=int,
+        initial=7,
+        widget=forms.Select(attrs={'class': 'form-select'}),
+    )
+
+
+def _marketplace_choices():
+    return [(marketplace.value, marketplace.label) for marketplace in enabled_marketplaces()]
+
+
+def _marketplace_slug_choices():
+    return [(MARKETPLACE_SLUGS[marketplace], marketplace.label) for marketplace in enabled_marketplaces()]
+
+
+class PriceWatchForm(forms.ModelForm):
+    # Варианты вычисляются при создании формы: адаптер Ozon включается настройкой
+    marketplaces = forms.TypedMultipleChoiceField(
+        label="Маркетплейсы",
+        choices=_marketplace_choices,
+        coerce=int,
+        initial=lambda: [marketplace.value for marketplace in enabled_marketplaces()],
+        widget=forms.CheckboxSelectMultiple(attrs={'class': 'form-check-input'}),
+    )
+
+    class Meta:
+        model = PriceWatch
+        fields = ('query_text', 'marketplaces', 'threshold', 'interval_hours')
+        widgets = {
+            'query_text': forms.TextInput(attrs={'class': 'form-control'}),
+            'threshold': forms.NumberInput(attrs={'class': 'form-control', 'min': 1}),
+            'interval_hours': forms.Select(attrs={'class': 'form-select'}),
+        }
+
+
+class ApiSearchParamsForm(forms.Form):
+    """Общие параметры поиска в API: как у страницы поиска, маркетплейсы задаются кодами."""
+    sort = forms.ChoiceField(choices=SORT_VALUE_CHOICES, required=False)
+    price_min = forms.IntegerField(min_value=0, required=False)
+    price_max = forms.IntegerField(min_value=0, required=False)
+    marketplaces = forms.MultipleChoiceField(
+        choices=_marketplace_slug_choices,
+        required=False,
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        price_min, price_max = cleaned_data.get('price_min'), cleaned_data.get('price_max')
+        if price_min is not None and price_max is not None and price_min > price_max:
+            raise forms.ValidationError("Минимальная цена больше максимальной")
+        cleaned_data['sort'] = cleaned_data.get('sort') or 'priceup'
+        marketplaces = enabled_marketplaces()
+        slugs = set(cleaned_data.get('marketplaces') or (MARKETPLACE_SLUGS[marketplace] for marketplace in marketplaces))
+        cleaned_data['marketplaces'] = [marketplace for marketplace in marketplaces if MARKETPLACE_SLUGS[marketplace] in slugs]
+        return cleaned_data
+
+
+class ApiSearchForm(ApiSearchParamsForm):
+    query = forms.CharField(max_length=255)
+
+
+class ApiBatchForm(ApiSearchParamsForm):
+    """Пакет запросов: по одному на строку, текстом в поле queries или файлом file."""
+    queries = forms.CharField(required=False)
+    file = forms.FileField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('file'):
+            try:
+                cleaned_data['lines'] = cleaned_data['file'].read().decode('utf-8-sig').splitlines()
+            except UnicodeDecodeError:
+                raise forms.ValidationError("Файл должен быть в кодировке UTF-8")
+        elif cleaned_data.get('queries'):
+            cleaned_data['lines'] = cleaned_data['queries'].splitlines()
+        else:
+            raise forms.ValidationError("Передайте запросы в поле queries или файлом file")
+        return cleaned_data
@@ -0,0 +1,135 @@
+import io
+import os
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from PIL import Image
+
+from .adapters import get_adapter
+from .models import Marketplace, MARKETPLACE_SLUGS
+from media_files import image_index, write_atomic
+
+# Маркетплейсы по короткому имени; изображения скачивает адаптер маркетплейса
+SLUG_MARKETPLACES = {slug: marketplace for marketplace, slug in MARKETPLACE_SLUGS.items()}
+
+# Ширины миниатюр для карточек товаров (1x и 2x для плотных экранов).
+THUMBNAIL_WIDTHS = (200, 400)
+THUMBNAIL_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", {"quality": 80, "optimize": True, "progressive": True}),
+}
+
+# Сколько секунд не повторять неудавшуюся загрузку изображения
+IMAGE_MISS_TTL = 300
+
+_inflight: dict[tuple, list] = {}
+_inflight_guard = threading.Lock()
+
+
+# Начала файлов форматов, которые отдают маркетплейсы
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+)
+
+
+def image_content_type(file) -> str:
+    """Return the MIME type of an open image file by its first bytes.
+
+    Originals are saved as 1.jpg whatever their format (WB serves WebP).
+    """
+    head = file.read(12)
+    file.seek(0)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return next((content_type for signature, content_type in IMAGE_SIGNATURES if head.startswith(signature)), "image/jpeg")
+
+
+def image_path(marketplace: str, product_id: int) -> str:
+    """Return absolute path of the cached original image."""
+    return os.path.join(settings.MEDIA_ROOT, 'image', marketplace, str(product_id), '1.jpg')
+
+
+def thumbnail_path(marketplace: str, product_id: int, width: int, fmt: str) -> str:
+    """Return absolute path of a thumbnail stored next to the original."""
+    return os.path.join(settings.MEDIA_ROOT, 'image', marketplace, str(product_id), f'1_{width}.{fmt}')
+
+
+@contextmanager
+def _single_flight(key):
+    """Serialize concurrent fetches of the same image within the process."""
+    with _inflight_guard:
+        entry = _inflight.get(key)
+        if entry is None:
+            entry = _inflight[key] = [threading.Lock(), 0]
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _inflight_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _inflight[key]
+
+
+def fetch_image(marketplace: str, product_id: int, image_url: str | None = None) -> str | None:
+    """Return path of the cached image, downloading it on first request.
+
+    Concurrent requests for the same image wait for the first download
+    instead of hitting the marketplace again, and a failed download is not
+    repeated for IMAGE_MISS_TTL seconds.
+    """
+    path = image_path(marketplace, product_id)
+    if image_index.has(marketplace, product_id):
+        return path
+    if marketplace not in SLUG_MARKETPLACES:
+        return None
+    miss_key = f"image-miss:{marketplace}:{product_id}"
+    if cache.get(miss_key):
+        return None
+    with _single_flight((marketplace, product_id)):
+        # Файл мог скачать другой процесс, индекс которого нам не виден.
+        if not os.path.exists(path):
+            # WB строит ссылку на изображение по id товара, остальным нужна ссылка, сохранённая при поиске
+            if SLUG_MARKETPLACES[marketplace] != Marketplace.WILDBERRIES and not image_url:
+                return None
+            if cache.get(miss_key):
+                return None
+            # Скачанный файл регистрирует в индексе write_atomic
+            if not get_adapter(SLUG_MARKETPLACES[marketplace]).save_image(product_id, image_url):
+                cache.set(miss_key, True, IMAGE_MISS_TTL)
+                return None
+        else:
+            image_index.add(marketplace, product_id)
+    return path
+
+
+def make_thumbnail(marketplace: str, product_id: int, width: int, fmt: str) -> str | None:
+    """Return path of the thumbnail, generating it from the cached original on first request."""
+    path = thumbnail_path(marketplace, product_id, width, fmt)
+    name = os.path.basename(path)
+    if image_index.has(marketplace, product_id, name):
+        return path
+    source = image_path(marketplace, product_id)
+    pil_format, options = THUMBNAIL_FORMATS[fmt]
+    with _single_flight((marketplace, product_id, width, fmt)):
+        if os.path.exists(path):
+            image_index.add(marketplace, product_id, name)
+            return path
+        buffer = io.BytesIO()
+        try:
+            with Image.open(source) as image:
+                image.thumbnail((width, width * 4))
+                if image.mode not in ("RGB", "RGBA") or (pil_format == "JPEG" and image.mode != "RGB"):
+                    image = image.convert("RGB")
+                image.save(buffer, pil_format, **options)
+        except OSError:
+            return None
+        # Миниатюру могут одновременно строить воркеры сервера: каждый пишет в свой временный файл
+        if not write_atomic(path, buffer.getvalue()):
+            return None
+    return path
@@ -0,0 +1,89 @@
+import json
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from search.adapters import enabled_marketplaces
+from search.batch import create_batch_job, item_result, run_batch
+from search.models import BatchJob, MARKETPLACE_SLUGS, SORT_VALUE_CHOICES
+
+
+class Command(BaseCommand):
+    help = (
+        "Пакетная проверка цен: выполняет запросы из файла (по одному на строку) на выбранных "
+        "маркетплейсах с ограничением одновременных обращений к каждому маркетплейсу. Повторы "
+        "запросов отбрасываются, результаты сохраняются в историю и дописываются в файл --output "
+        "по мере выполнения. Прерванный пакет продолжается с --resume."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', nargs='?', help='файл запросов в UTF-8, по одному на строку')
+        parser.add_argument('--user', help='пользователь, в историю которого сохраняются поиски')
+        parser.add_argument('--resume', type=int, metavar='JOB_ID', help='продолжить прерванный пакет')
+        parser.add_argument(
+            '--marketplaces',
+            help='коды маркетплейсов через запятую: ' + ', '.join(MARKETPLACE_SLUGS.values())
+                 + '; по умолчанию все, на которых поиск включён',
+        )
+        parser.add_argument('--sort', default='priceup', choices=[value for value, _ in SORT_VALUE_CHOICES])
+        parser.add_argument('--price-min', type=int)
+        parser.add_argument('--price-max', type=int)
+        parser.add_argument('--output', help='файл NDJSON, в который дописывается результат каждого запроса')
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            try:
+                job = BatchJob.objects.get(pk=options['resume'])
+            except BatchJob.DoesNotExist:
+                raise CommandError(f"Пакет {options['resume']} не найден")
+        else:
+            job = self._create(options)
+
+        output = open(options['output'], 'a', encoding='utf-8') if options['output'] else None
+        total = job.items.count()
+
+        def on_item(item):
+            self.stdout.write(f"[{item.position + 1}/{total}] {item.query_text}: {item.get_status_display()}")
+            if output:
+                output.write(json.dumps(item_result(item), ensure_ascii=False, cls=DjangoJSONEncoder) + "\n")
+                output.flush()
+
+        try:
+            stats = async_to_sync(run_batch)(job, on_item=on_item)
+        except KeyboardInterrupt:
+            raise CommandError(f"Пакет {job.pk} прерван, продолжить: manage.py batch_search --resume {job.pk}")
+        finally:
+            if output:
+                output.close()
+        self.stdout.write(self.style.SUCCESS(
+            f"Пакет {job.pk}: выполнено {stats.done}, ошибок {stats.failed}, повторов отброшено {job.duplicates}, "
+            f"за {stats.elapsed:.1f} с — {stats.queries_per_minute:.1f} запросов/мин"
+        ))
+
+    def _create(self, options):
+        if not options['file'] or not options['user']:
+            raise CommandError("Укажите файл запросов и --user либо --resume")
+        try:
+            user = get_user_model().objects.get(username=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"Пользователь {options['user']} не найден")
+        enabled = {MARKETPLACE_SLUGS[marketplace] for marketplace in enabled_marketplaces()}
+        slugs = set(options['marketplaces'].split(',')) if options['marketplaces'] else enabled
+        unknown = slugs - set(MARKETPLACE_SLUGS.values())
+        if unknown:
+            raise CommandError(f"Неизвестные маркетплейсы: {', '.join(sorted(unknown))}")
+        if slugs - enabled:
+            raise CommandError(f"Поиск выключен на маркетплейсах: {', '.join(sorted(slugs - enabled))}")
+        with open(options['file'], encoding='utf-8-sig') as f:
+            lines = f.read().splitlines()
+        try:
+            job = create_batch_job(
+                user, lines, [marketplace for marketplace, slug in MARKETPLACE_SLUGS.items() if slug in slugs],
+                sort_value=options['sort'], price_min=options['price_min'], price_max=options['price_max'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"Пакет {job.pk}: запросов {job.items.count()}, повторов отброшено {job.duplicates}")
+        return job
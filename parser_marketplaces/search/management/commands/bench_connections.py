@@ -0,0 +1,139 @@
+import io
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.postgresql.base import DatabaseWrapper
+from django.db.backends.postgresql.psycopg_any import is_psycopg3
+from django.urls import reverse
+
+USERNAME = "bench_connections"
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест соединений с базой: прогоняет запросы страницы истории через "
+        "WSGI-обработчик Django с соединением на каждый запрос, с постоянными "
+        "соединениями (CONN_MAX_AGE) и с пулом psycopg 3 и сравнивает время ответа "
+        "и затраты на получение соединения."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='запросов на каждый профиль')
+        parser.add_argument('--threads', type=int, default=4, help='параллельных потоков (потоки одного воркера)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Бенчмарк поддерживает только PostgreSQL")
+
+        profiles = {
+            "на каждый запрос": {'CONN_MAX_AGE': 0, 'OPTIONS': {}},
+            "постоянные": {'CONN_MAX_AGE': 60, 'CONN_HEALTH_CHECKS': True, 'OPTIONS': {}},
+        }
+        if is_psycopg3:
+            profiles["пул psycopg 3"] = {
+                'CONN_MAX_AGE': 0,
+                'OPTIONS': {'pool': {'min_size': options['threads'], 'max_size': options['threads']}},
+            }
+        else:
+            self.stdout.write("psycopg 3 не установлен, профиль с пулом пропущен")
+
+        user, _ = get_user_model().objects.get_or_create(username=USERNAME)
+        session = SessionStore()
+        session['_auth_user_id'] = str(user.pk)
+        session['_auth_user_backend'] = 'django.contrib.auth.backends.ModelBackend'
+        session['_auth_user_hash'] = user.get_session_auth_hash()
+        session.create()
+        base_settings = dict(connections.settings['default'])
+        try:
+            results = {name: self._run(base_settings, profile, session.session_key, options) for name, profile in profiles.items()}
+        finally:
+            connections.settings['default'].clear()
+            connections.settings['default'].update(base_settings)
+            session.delete()
+            user.delete()
+        self._report(results)
+
+    def _run(self, base_settings, profile, session_key, options):
+        connections.close_all()
+        connections.settings['default'].clear()
+        connections.settings['default'].update(base_settings, **profile)
+
+        handler = WSGIHandler()
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': reverse('history'),
+            'QUERY_STRING': '',
+            'SERVER_NAME': '127.0.0.1',
+            'SERVER_PORT': '80',
+            'HTTP_HOST': '127.0.0.1',
+            'HTTP_COOKIE': f'{settings.SESSION_COOKIE_NAME}={session_key}',
+            'wsgi.url_scheme': 'http',
+        }
+        durations = []
+        connects = []
+        lock = threading.Lock()
+        get_new_connection = DatabaseWrapper.get_new_connection
+
+        def timed_get_new_connection(wrapper, conn_params):
+            start = time.perf_counter()
+            try:
+                return get_new_connection(wrapper, conn_params)
+            finally:
+                with lock:
+                    connects.append(time.perf_counter() - start)
+
+        def worker(count):
+            local = []
+            for _ in range(count):
+                start = time.perf_counter()
+                response = handler({**environ, 'wsgi.input': io.BytesIO()}, lambda status, headers: None)
+                b''.join(response)
+                response.close()  # request_finished: закрытие или возврат соединения
+                local.append(time.perf_counter() - start)
+            with lock:
+                durations.extend(local)
+            connections.close_all()
+
+        per_thread = max(options['requests'] // options['threads'], 1)
+        DatabaseWrapper.get_new_connection = timed_get_new_connection
+        try:
+            threads = [threading.Thread(target=worker, args=(per_thread,)) for _ in range(options['threads'])]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            # Для пула get_new_connection выдаёт соединение из пула, физических соединений меньше
+            pool = connections['default'].pool
+            opened = pool.get_stats()['connections_num'] if pool else len(connects)
+        finally:
+            DatabaseWrapper.get_new_connection = get_new_connection
+            if 'pool' in profile['OPTIONS']:
+                connections['default'].close_pool()
+        durations.sort()
+        return {
+            'rps': len(durations) / elapsed,
+            'median': statistics.median(durations) * 1000,
+            'p95': durations[int(len(durations) * 0.95)] * 1000,
+            'opened': opened,
+            'connect_ms': sum(connects) * 1000 / len(durations),
+        }
+
+    def _report(self, results):
+        self.stdout.write(
+            f"{'профиль':<20}{'запр/с':>10}{'медиана, мс':>14}{'p95, мс':>10}"
+            f"{'открыто соединений':>20}{'получение соединения на запрос, мс':>36}"
+        )
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:<20}{r['rps']:>10.0f}{r['median']:>14.2f}{r['p95']:>10.2f}"
+                f"{r['opened']:>20}{r['connect_ms']:>36.3f}"
+            )
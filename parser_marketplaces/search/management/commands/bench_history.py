@@ -0,0 +1,188 @@
+import re
+import statistics
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from search.models import CatalogProduct, PriceObservation, SearchQuery, SearchResult, RESULTS_WINDOW
+
+USERNAME_PREFIX = "bench_history_"
+# Тестовые товары получают id за пределами реальных id маркетплейсов.
+PRODUCT_ID_OFFSET = 10 ** 15
+EXECUTION_TIME_RE = re.compile(r"Execution Time: ([\d.]+) ms")
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Заполняет PostgreSQL тестовой историей поиска и сравнивает EXPLAIN ANALYZE "
+        "запросов страниц истории с индексами и без них. Удаление индексов "
+        "выполняется в откатываемой транзакции и блокирует таблицы на время замера."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='количество тестовых пользователей')
+        parser.add_argument('--queries', type=int, default=100_000, help='количество запросов поиска')
+        parser.add_argument('--products-per-query', type=int, default=20, help='товаров на один запрос')
+        parser.add_argument('--catalog-size', type=int, default=200_000, help='количество различных товаров')
+        parser.add_argument('--repeat', type=int, default=5, help='повторов каждого EXPLAIN ANALYZE')
+        parser.add_argument('--keep', action='store_true', help='не удалять тестовые данные после замера')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Бенчмарк поддерживает только PostgreSQL")
+
+        user_ids = self._seed(
+            options['users'], options['queries'], options['products_per_query'], options['catalog_size']
+        )
+        try:
+            samples = self._samples(user_ids)
+            after = self._measure(samples, options['repeat'])
+            try:
+                with transaction.atomic():
+                    with connection.schema_editor(atomic=False) as editor:
+                        for model in (SearchQuery, PriceObservation):
+                            for index in model._meta.indexes:
+                                editor.remove_index(model, index)
+                    before = self._measure(samples, options['repeat'])
+                    raise _Rollback
+            except _Rollback:
+                pass
+            self._report(before, after)
+        finally:
+            if not options['keep']:
+                self._cleanup()
+
+    def _seed(self, users, queries, products_per_query, catalog_size):
+        self._cleanup()
+        user_model = get_user_model()
+        user_model.objects.bulk_create(
+            user_model(username=f"{USERNAME_PREFIX}{i}", email=f"{USERNAME_PREFIX}{i}@example.com")
+            for i in range(users)
+        )
+        user_ids = list(
+            user_model.objects.filter(username__startswith=USERNAME_PREFIX).values_list('id', flat=True)
+        )
+        self.stdout.write(
+            f"Создаю {catalog_size} товаров, {queries} запросов и {queries * products_per_query} результатов..."
+        )
+
+        catalog_table = CatalogProduct._meta.db_table
+        query_table = SearchQuery._meta.db_table
+        observation_table = PriceObservation._meta.db_table
+        result_table = SearchResult._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {catalog_table} (marketplace, product_id, name, brand, pics, url, first_seen_at, updated_at)
+                SELECT 1 + g %% 3, %s + g, 'Товар ' || g, 'Бренд', 1, 'https://example.com/' || g, now(), now()
+                FROM generate_series(0, %s - 1) AS g
+                """,
+                [PRODUCT_ID_OFFSET, catalog_size],
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {query_table} (user_id, query_text, sort_value, price_range, created_at, marketplaces,
+                                           product_count, min_price)
+                SELECT (%s::bigint[])[1 + g %% %s], 'товар ' || (g %% 5000), 'priceup', '-',
+                       now() - (g || ' minutes')::interval, ARRAY[1 + g %% 3], %s, 1100
+                FROM generate_series(1, %s) AS g
+                """,
+                [user_ids, len(user_ids), products_per_query, queries],
+            )
+            # observed_at уникален для каждой пары (запрос, позиция), по нему
+            # результаты связываются с только что вставленными наблюдениями.
+            cursor.execute(
+                f"""
+                WITH src AS (
+                    SELECT q.id AS searchquery_id, n,
+                           q.created_at + n * interval '1 microsecond' AS observed_at,
+                           c.id AS product_id
+                    FROM {query_table} q
+                    CROSS JOIN generate_series(1, %s) AS n
+                    JOIN {catalog_table} c
+                      ON c.product_id = %s + (q.id * 7 + n) %% %s
+                    WHERE q.user_id = ANY(%s)
+                ), obs AS (
+                    INSERT INTO {observation_table} (product_id, observed_at, price_product, price_basic,
+                                                     review_rating, feedbacks)
+                    SELECT product_id, observed_at, 1000 + n * 100, 2000 + n * 100, 4.5, n * 10
+                    FROM src
+                    RETURNING id, product_id, observed_at
+                )
+                INSERT INTO {result_table} (searchquery_id, observation_id, position, observed_at)
+                SELECT src.searchquery_id, obs.id, src.n - 1, obs.observed_at
+                FROM src
+                JOIN obs ON obs.product_id = src.product_id AND obs.observed_at = src.observed_at
+                """,
+                [products_per_query, PRODUCT_ID_OFFSET, catalog_size, user_ids],
+            )
+            for table in (catalog_table, query_table, observation_table, result_table):
+                cursor.execute(f"ANALYZE {table}")
+        return user_ids
+
+    def _samples(self, user_ids):
+        user_id = user_ids[len(user_ids) // 2]
+        search_query = SearchQuery.objects.filter(user_id=user_id).order_by('-created_at')[10]
+        product_id = SearchResult.objects.filter(searchquery=search_query).values_list(
+            'observation__product_id', flat=True
+        ).first()
+        return {
+            "history": SearchQuery.objects.filter(user_id=user_id).order_by('-created_at')[:50],
+            "history_marketplace": SearchQuery.objects.filter(user_id=user_id, marketplaces__contains=[2])
+            .order_by('-created_at')[:50],
+            "history_price": SearchQuery.objects.filter(user_id=user_id, min_price__gte=1000, min_price__lte=1200)
+            .order_by('-created_at')[:50],
+            "history_detail": SearchResult.objects.filter(
+                searchquery=search_query,
+                observed_at__gte=search_query.created_at,
+                observed_at__lt=search_query.created_at + RESULTS_WINDOW,
+            )
+            .select_related('observation__product')
+            .order_by('position'),
+            "price_history": PriceObservation.objects.filter(product_id=product_id).order_by('-observed_at')[:50],
+        }
+
+    def _measure(self, samples, repeat):
+        results = {}
+        for name, queryset in samples.items():
+            timings = []
+            for _ in range(repeat):
+                plan = queryset.explain(analyze=True)
+                timings.append(float(EXECUTION_TIME_RE.search(plan).group(1)))
+            results[name] = (statistics.median(timings), plan.splitlines()[0])
+        return results
+
+    def _report(self, before, after):
+        self.stdout.write(f"{'запрос':<20}{'без индексов, мс':>20}{'с индексами, мс':>20}")
+        for name in after:
+            self.stdout.write(f"{name:<20}{before[name][0]:>20.3f}{after[name][0]:>20.3f}")
+        self.stdout.write("")
+        for name in after:
+            self.stdout.write(f"{name}:\n  без индексов: {before[name][1]}\n  с индексами:  {after[name][1]}")
+
+    def _cleanup(self):
+        users = get_user_model().objects.filter(username__startswith=USERNAME_PREFIX)
+        user_ids = list(users.values_list('id', flat=True))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                DELETE FROM {SearchResult._meta.db_table}
+                WHERE searchquery_id IN (SELECT id FROM {SearchQuery._meta.db_table} WHERE user_id = ANY(%s))
+                """,
+                [user_ids],
+            )
+            cursor.execute(
+                f"""
+                DELETE FROM {PriceObservation._meta.db_table}
+                WHERE product_id IN (SELECT id FROM {CatalogProduct._meta.db_table} WHERE product_id >= %s)
+                """,
+                [PRODUCT_ID_OFFSET],
+            )
+            cursor.execute(f"DELETE FROM {CatalogProduct._meta.db_table} WHERE product_id >= %s", [PRODUCT_ID_OFFSET])
+            cursor.execute(f"DELETE FROM {SearchQuery._meta.db_table} WHERE user_id = ANY(%s)", [user_ids])
+        users.delete()
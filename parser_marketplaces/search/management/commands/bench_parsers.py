@@ -0,0 +1,185 @@
+import gc
+import json
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+import mm_api
+import ozon_selenium
+import wb_api
+import yandex_api
+
+BENCH_DATA = Path(__file__).resolve().parents[2] / 'bench_data'
+BASELINE = BENCH_DATA / 'baseline.json'
+
+
+def _read(name):
+    return (BENCH_DATA / name).read_text(encoding='utf-8')
+
+
+def _wb():
+    products = json.loads(_read('wb_search.json'))['data']['products']
+    return lambda: [wb_api.Product.from_api_data(data) for data in products]
+
+
+def _yma():
+    html = _read('yma_search.html')
+    manager = yandex_api.ProductManager()
+    return lambda: manager._parse_response(html)
+
+
+def _mm():
+    catalog = json.loads(_read('mm_catalog.json'))
+    offer = json.loads(_read('mm_offer.json'))
+    manager = mm_api.ProductManager(product_name='bench', download_images=False)
+    # Предложения отдаются из файла: замеряется разбор, а не сеть
+    manager._api_request = lambda *args, **kwargs: offer
+
+    def run():
+        manager.parsed_offers = []
+        manager._parse_page(catalog)
+        return manager.parsed_offers
+    return run
+
+
+def _ozon():
+    html = _read('ozon_tiles.html')
+    return lambda: ozon_selenium.parse_tiles(html)
+
+
+def _calibration():
+    """Fixed string and dict work, the same on every machine: its speed is the unit of parser speeds."""
+    lines = [f"Товар {i} цена {i * 7 % 1000} ₽" for i in range(500)]
+
+    def run():
+        prices = {}
+        for line in lines:
+            name, _, price = line.partition(" цена ")
+            prices[name.lower()] = int(price.rstrip(" ₽"))
+        return list(prices)
+    return run
+
+
+PARSERS = {
+    'wb': ('wb_api.Product.from_api_data', _wb),
+    'yma': ('yandex_api.ProductManager._parse_response', _yma),
+    'mm': ('mm_api.ProductManager._parse_page', _mm),
+    'ozon': ('ozon_selenium.parse_tiles', _ozon),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет разбор сохранённых ответов маркетплейсов из search/bench_data без сети: "
+        "товаров в секунду, пиковую и удерживаемую память и число блоков памяти в результате. "
+        "Скорость сравнивается с bench_data/baseline.json относительно калибровочного цикла, "
+        "выполняемого в том же процессе, поэтому база переносима между машинами; падение скорости, "
+        "рост пиковой памяти или числа блоков больше --max-regression процентов завершает команду с ошибкой."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--parsers', default=','.join(PARSERS), help='разборщики через запятую: ' + ', '.join(PARSERS),
+        )
+        parser.add_argument('--min-time', type=float, default=2.0, help='секунд замера каждого разборщика')
+        parser.add_argument('--max-regression', type=float, default=20.0, help='допустимое ухудшение, %%')
+        parser.add_argument('--save-baseline', action='store_true', help='записать результат как новую базу')
+
+    def handle(self, *args, **options):
+        names = options['parsers'].split(',')
+        unknown = set(names) - set(PARSERS)
+        if unknown:
+            raise CommandError(f"Неизвестные разборщики: {', '.join(sorted(unknown))}")
+        baseline = json.loads(BASELINE.read_text(encoding='utf-8')) if BASELINE.exists() else {}
+
+        results = {}
+        regressions = []
+        for name in names:
+            title, factory = PARSERS[name]
+            result = results[name] = self._measure(factory(), options['min_time'])
+            self.stdout.write(
+                f"{title}: {result['items_per_s']:.0f} товаров/с ({result['relative_speed']:.4g} за калибровочный цикл), "
+                f"пик памяти {result['peak_kib']:.0f} КиБ, удерживается {result['retained_kib']:.1f} КиБ, "
+                f"блоков в результате {result['blocks']} ({result['items']} товаров за вызов)"
+            )
+            base = baseline.get(name)
+            if base and not options['save_baseline']:
+                regressions += self._compare(title, result, base, options['max_regression'])
+
+        if options['save_baseline']:
+            BASELINE.write_text(json.dumps({**baseline, **results}, indent=2) + "\n", encoding='utf-8')
+            self.stdout.write(self.style.SUCCESS(f"База записана в {BASELINE}"))
+        elif regressions:
+            raise CommandError("Ухудшение относительно базы:\n" + "\n".join(regressions))
+
+    @staticmethod
+    def _calls_per_s(run, duration):
+        calls = 0
+        start = time.perf_counter()
+        elapsed = 0.0
+        while elapsed < duration or calls < 1:
+            run()
+            calls += 1
+            elapsed = time.perf_counter() - start
+        return calls / elapsed
+
+    @classmethod
+    def _measure(cls, run, min_time, rounds=10):
+        """Return speed and memory of run.
+
+        The parser and the calibration loop are timed in alternating short
+        rounds; neighbouring rounds run at the same machine speed, so the
+        median ratio (relative_speed, items per calibration loop) does not
+        depend on the machine, its frequency scaling or its other load.
+        """
+        items = len(run())  # прогрев: импорты, кэши парсеров
+        calibrate = _calibration()
+        calibrate()
+        speeds, ratios = [], []
+        for _ in range(rounds):
+            speed = cls._calls_per_s(run, min_time / rounds) * items
+            speeds.append(speed)
+            ratios.append(speed / cls._calls_per_s(calibrate, min_time / rounds / 2))
+
+        gc.collect()
+        tracemalloc.start()
+        try:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            result = run()
+            peak = tracemalloc.get_traced_memory()[1]
+            # Блоки, выделенные вызовом и удерживаемые его результатом: не зависят от скорости машины
+            blocks = sum(stat.count_diff for stat in tracemalloc.take_snapshot().compare_to(snapshot, 'filename'))
+            del result
+            gc.collect()
+            retained = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        return {
+            'items': items,
+            'items_per_s': round(statistics.median(speeds), 1),
+            'relative_speed': float(f"{statistics.median(ratios):.4g}"),
+            'peak_kib': round((peak - before) / 1024, 1),
+            'retained_kib': round(max(retained - before, 0) / 1024, 1),
+            'blocks': blocks,
+        }
+
+    @staticmethod
+    def _compare(title, result, base, max_regression):
+        regressions = []
+        slowdown = (1 - result['relative_speed'] / base['relative_speed']) * 100
+        if slowdown > max_regression:
+            regressions.append(
+                f"{title}: скорость {result['relative_speed']:.4g} товаров за калибровочный цикл против "
+                f"{base['relative_speed']:.4g} "
+                f"(-{slowdown:.0f}%)"
+            )
+        for field, label in (('peak_kib', 'пик памяти, КиБ'), ('blocks', 'блоков в результате')):
+            growth = (result[field] / base[field] - 1) * 100 if base[field] else 0
+            if growth > max_regression:
+                regressions.append(f"{title}: {label} {result[field]:.0f} против {base[field]:.0f} (+{growth:.0f}%)")
+        return regressions
@@ -0,0 +1,162 @@
+import asyncio
+import statistics
+import time
+from types import SimpleNamespace
+from unittest import mock
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.urls import reverse
+
+from search.models import SearchQuery
+
+USERNAME = "bench_search"
+
+
+def login_session(username):
+    """Create the user if needed and a logged-in session for it; return (user, session)."""
+    user, _ = get_user_model().objects.get_or_create(username=username)
+    session = SessionStore()
+    session['_auth_user_id'] = str(user.pk)
+    session['_auth_user_backend'] = 'django.contrib.auth.backends.ModelBackend'
+    session['_auth_user_hash'] = user.get_session_auth_hash()
+    session.create()
+    return user, session
+
+
+async def asgi_get(handler, path, query_string, session_key):
+    """Send a GET through the ASGI handler as a logged-in user; return (seconds, status)."""
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': unquote(path),
+        'raw_path': path.encode(),
+        'query_string': query_string.encode(),
+        'root_path': '',
+        'headers': [
+            (b'host', b'127.0.0.1'),
+            (b'cookie', f'{settings.SESSION_COOKIE_NAME}={session_key}'.encode()),
+        ],
+        'client': ('127.0.0.1', 50000),
+        'server': ('127.0.0.1', 80),
+    }
+    statuses = []
+    disconnect = asyncio.Event()
+
+    async def receive():
+        if not statuses:
+            statuses.append(None)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses[0] = message['status']
+        elif not message.get('more_body'):
+            disconnect.set()
+
+    start = time.perf_counter()
+    await handler(scope, receive, send)
+    return time.perf_counter() - start, statuses[0]
+
+
+class _WBManager:
+    """Заглушка адаптера Wildberries: ждёт, как сетевой запрос, и возвращает товары."""
+    latency = 0
+    products = 0
+
+    def search_and_display(self, query, sort, **kwargs):
+        time.sleep(self.latency)
+        return [
+            SimpleNamespace(
+                product_id=900_000_000 + i, name=f"{query} {i}", brand=None, color=None, supplier_id=None, pics=0,
+                price_product=1000 + i, price_basic=None, review_rating=None, feedbacks=None,
+                supplier_rating=None, delivery_date=None,
+            )
+            for i in range(self.products)
+        ]
+
+
+class _YandexManager:
+    latency = 0
+
+    def search_and_display(self, query, sort, **kwargs):
+        time.sleep(self.latency)
+        return []
+
+
+class _MMParser:
+    latency = 0
+
+    def __init__(self, **kwargs):
+        self.parsed_offers = []
+
+    def parse(self):
+        time.sleep(self.latency)
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест поиска под ASGI: отправляет одновременно N поисковых запросов "
+        "в ASGI-обработчик Django, адаптеры маркетплейсов заменены заглушками с заданной "
+        "задержкой. Показывает, сколько поисков один процесс держит открытыми одновременно."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--levels', default='10,50,100,200', help='число одновременных поисков через запятую')
+        parser.add_argument('--latency', type=float, default=1.0, help='задержка ответа маркетплейса, секунд')
+        parser.add_argument('--products', type=int, default=20, help='товаров в ответе заглушки Wildberries')
+
+    def handle(self, *args, **options):
+        levels = [int(level) for level in options['levels'].split(',')]
+        for adapter in (_WBManager, _YandexManager, _MMParser):
+            adapter.latency = options['latency']
+        _WBManager.products = options['products']
+
+        user, session = login_session(USERNAME)
+        connections.close_all()
+        self.stdout.write(
+            f"задержка маркетплейса {options['latency']} с, потоков адаптеров {settings.SEARCH_ADAPTER_THREADS}, "
+            f"пул соединений: {connections['default'].settings_dict['OPTIONS'].get('pool') or 'нет'}"
+        )
+        self.stdout.write(f"{'одновременно':>14}{'время, с':>10}{'поисков/с':>11}{'медиана, с':>12}{'p95, с':>9}{'ошибок':>8}")
+        try:
+            with mock.patch('wb_api.ProductManager', _WBManager), \
+                    mock.patch('yandex_api.ProductManager', _YandexManager), \
+                    mock.patch('mm_api.ProductManager', _MMParser):
+                for level in levels:
+                    r = asyncio.run(self._run(level, session.session_key))
+                    self.stdout.write(
+                        f"{level:>14}{r['elapsed']:>10.2f}{level / r['elapsed']:>11.1f}"
+                        f"{r['median']:>12.2f}{r['p95']:>9.2f}{r['errors']:>8}"
+                    )
+        finally:
+            connections.close_all()
+            SearchQuery.objects.filter(user=user).delete()
+            session.delete()
+            user.delete()
+
+    async def _run(self, level, session_key):
+        handler = ASGIHandler()
+        path = reverse('search:product_search', kwargs={'product_name': 'нагрузка'})
+        started = time.perf_counter()
+        results = await asyncio.gather(*(
+            asgi_get(handler, path, 'sort=priceup', session_key) for _ in range(level)
+        ))
+        elapsed = time.perf_counter() - started
+        durations = sorted(duration for duration, _ in results)
+        return {
+            'elapsed': elapsed,
+            'median': statistics.median(durations),
+            'p95': durations[int(len(durations) * 0.95)],
+            'errors': sum(status != 200 for _, status in results),
+        }
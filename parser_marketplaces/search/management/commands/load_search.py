@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import override_settings
+from django.urls import reverse
+
+import cassettes
+from search.models import SearchQuery
+from .bench_search_concurrency import asgi_get, login_session
+from .stub_marketplaces import make_server
+
+USERNAME = "load_search"
+BASE_URL_SETTINGS = ('WB_SEARCH_BASE_URL', 'WB_IMAGES_BASE_URL', 'YMA_BASE_URL', 'MM_BASE_URL')
+# Нагрузочный тест не должен уйти на настоящие маркетплейсы
+REAL_HOSTS = ('wb.ru', 'wbbasket.ru', 'yandex.ru', 'megamarket.ru')
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values."""
+    return values[min(len(values) - 1, max(0, round(len(values) * percent / 100) - 1))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест полного поиска: отправляет --requests поисков в ASGI-обработчик Django "
+        "по --concurrency одновременно, с настоящими адаптерами, разбором и записью в базу. "
+        "Маркетплейсы — заглушка stub_marketplaces: с --stub она запускается в этом же процессе, "
+        "иначе адаптеры должны быть направлены на неё настройками *_BASE_URL либо отвечать "
+        "из кассеты HTTP_CASSETTE в режиме replay. "
+        "Показывает поисков в секунду и перцентили времени ответа."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='всего поисков')
+        parser.add_argument('--concurrency', type=int, default=20, help='одновременных поисков')
+        parser.add_argument('--queries', type=int, default=20, help='различных текстов запросов')
+        parser.add_argument('--sort', default='priceup')
+        parser.add_argument('--stub', action='store_true', help='запустить заглушку в этом процессе')
+        parser.add_argument('--latency', action='append', metavar='MP=SPEC', help='задержки заглушки, см. stub_marketplaces')
+        parser.add_argument('--error-rate', action='append', metavar='MP=RATE', help='доля ошибок заглушки')
+        parser.add_argument('--throttle-rate', type=float, default=0.0, help='доля ответов Мегамаркета с code 7')
+
+    def handle(self, *args, **options):
+        with ExitStack() as stack:
+            if options['stub']:
+                try:
+                    server = make_server(
+                        latency=options['latency'], error_rate=options['error_rate'],
+                        throttle_rate=options['throttle_rate'],
+                    )
+                except ValueError as e:
+                    raise CommandError(str(e))
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+                stack.callback(server.server_close)
+                stack.callback(server.shutdown)
+                stack.enter_context(override_settings(**dict.fromkeys(BASE_URL_SETTINGS, server.base_url)))
+            self._check_targets()
+            self._load(options)
+
+    def _check_targets(self):
+        cassette = cassettes.active()
+        # Воспроизведение кассеты (HTTP_CASSETTE) к маркетплейсам не обращается
+        if cassette is None or cassette.mode != 'replay':
+            for name in BASE_URL_SETTINGS:
+                host = urlsplit(getattr(settings, name)).hostname or ''
+                if not host or host.endswith(REAL_HOSTS):
+                    raise CommandError(f"{name} указывает на настоящий маркетплейс; запустите с --stub или на заглушку")
+        # Без файла кук парсер Мегамаркета завершает процесс
+        if not (Path(settings.BASE_DIR) / 'cookies.json').exists():
+            raise CommandError(f"Нет {Path(settings.BASE_DIR) / 'cookies.json'}; для заглушки достаточно файла с []")
+
+    def _load(self, options):
+        user, session = login_session(USERNAME)
+        connections.close_all()
+        cassette = cassettes.active()
+        self.stdout.write(
+            f"поисков {options['requests']}, одновременно {options['concurrency']}, маркетплейсы: "
+            + (f"кассета {cassette.path} ({cassette.mode})" if cassette else settings.MM_BASE_URL)
+        )
+        try:
+            r = asyncio.run(self._run(options, session.session_key))
+        finally:
+            connections.close_all()
+            SearchQuery.objects.filter(user=user).delete()
+            session.delete()
+            user.delete()
+        durations = r['durations']
+        self.stdout.write(
+            f"за {r['elapsed']:.1f} с: {len(durations) / r['elapsed']:.2f} поисков/с, ошибок {r['errors']}\n"
+            f"время ответа, с: p50 {percentile(durations, 50):.2f}, p90 {percentile(durations, 90):.2f}, "
+            f"p95 {percentile(durations, 95):.2f}, p99 {percentile(durations, 99):.2f}, макс {durations[-1]:.2f}"
+        )
+
+    async def _run(self, options, session_key):
+        handler = ASGIHandler()
+        paths = [
+            reverse('search:product_search', kwargs={'product_name': f'нагрузка {i}'})
+            for i in range(options['queries'])
+        ]
+        requests = iter(range(options['requests']))
+        results = []
+
+        async def worker():
+            for i in requests:
+                results.append(await asgi_get(handler, paths[i % len(paths)], f"sort={options['sort']}", session_key))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(options['concurrency'])))
+        return {
+            'elapsed': time.perf_counter() - started,
+            'durations': sorted(duration for duration, _ in results),
+            'errors': sum(status != 200 for _, status in results),
+        }
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from search.models import SearchResult
+from search.partitions import (
+    MONTHS_AHEAD, PARTITIONED_TABLES, add_months, drop_partition, ensure_partitions, is_partitioned,
+    list_partitions, month_start, partition_name,
+)
+from search.services import archive_results
+
+
+class Command(BaseCommand):
+    help = (
+        "Создаёт месячные секции наблюдений и результатов поиска на несколько месяцев вперёд "
+        "и удаляет секции старше срока хранения, предварительно сохраняя результаты "
+        "запросов в сжатый архив (или без архива с --drop). Запускать по расписанию, "
+        "например раз в сутки."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=MONTHS_AHEAD, help='на сколько месяцев вперёд создавать секции')
+        parser.add_argument('--retain', type=int, help='срок хранения в месяцах; более старые секции удаляются')
+        parser.add_argument('--drop', action='store_true', help='удалять старые секции без архивации результатов')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Секционирование поддерживается только в PostgreSQL")
+        with connection.cursor() as cursor:
+            if not all(is_partitioned(cursor, table) for table in PARTITIONED_TABLES):
+                raise CommandError("Таблицы не секционированы, примените миграции")
+
+        if options['retain'] is not None and options['retain'] < 1:
+            raise CommandError("Срок хранения должен быть не меньше одного месяца")
+
+        current = month_start(timezone.now())
+        with transaction.atomic(), connection.cursor() as cursor:
+            created = ensure_partitions(cursor, current, add_months(current, options['ahead']))
+        for name in created:
+            self.stdout.write(f"Создана секция {name}")
+
+        if options['retain'] is not None:
+            self._expire(add_months(current, -options['retain']), options['drop'])
+
+    def _expire(self, cutoff, drop):
+        """Удаляет секции месяцев, закончившихся до cutoff."""
+        with connection.cursor() as cursor:
+            months = sorted({
+                month for table in PARTITIONED_TABLES for month in list_partitions(cursor, table) if month < cutoff
+            })
+        for month in months:
+            with transaction.atomic():
+                archived = 0
+                if not drop:
+                    search_query_ids = list(
+                        SearchResult.objects
+                        .filter(observed_at__gte=month, observed_at__lt=add_months(month, 1))
+                        .values_list('searchquery_id', flat=True)
+                        .distinct()
+                    )
+                    archived = archive_results(search_query_ids)
+                with connection.cursor() as cursor:
+                    # Результаты удаляются раньше наблюдений, на которые ссылаются.
+                    for table in reversed(PARTITIONED_TABLES):
+                        if month in list_partitions(cursor, table):
+                            drop_partition(cursor, table, month)
+                            self.stdout.write(f"Удалена секция {partition_name(table, month)}")
+            if not drop:
+                self.stdout.write(f"{month:%Y-%m}: в архив сохранено запросов: {archived}")
@@ -0,0 +1,44 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from search.analytics import day_bounds, refresh_product_rollups, refresh_query_rollups
+from search.models import PriceObservation, SearchQuery, RESULTS_WINDOW
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает дневные итоги цен по товарам и запросам из наблюдений. "
+        "Нужен после переноса данных или если обновление итогов при поиске завершилось ошибкой; "
+        "при обычной работе итоги обновляются автоматически."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='сколько последних дней пересчитать')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        for offset in range(options['days'] - 1, -1, -1):
+            day = today - timedelta(days=offset)
+            start, end = day_bounds(day)
+            product_ids = list(
+                PriceObservation.objects
+                .filter(observed_at__gte=start, observed_at__lt=end)
+                .values_list('product_id', flat=True)
+                .distinct()
+            )
+            for i in range(0, len(product_ids), BATCH_SIZE):
+                refresh_product_rollups(product_ids[i:i + BATCH_SIZE], day)
+            query_keys = list(
+                SearchQuery.objects
+                .filter(created_at__gte=start - RESULTS_WINDOW, created_at__lt=end, product_count__gt=0)
+                .values_list('query_key', flat=True)
+                .distinct()
+            )
+            for query_key in query_keys:
+                refresh_query_rollups(query_key, day)
+            if product_ids or query_keys:
+                self.stdout.write(f"{day}: товаров {len(product_ids)}, запросов {len(query_keys)}")
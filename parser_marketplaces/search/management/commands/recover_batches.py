@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from search.batch import recover_interrupted_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Возвращает в очередь пакеты, оставшиеся в статусе «Выполняется» после остановки сервера. "
+        "Запускается при старте контейнера до запуска воркеров; продолжить пакет: "
+        "manage.py batch_search --resume <id>."
+    )
+
+    def handle(self, *args, **options):
+        count = recover_interrupted_jobs()
+        self.stdout.write(f"Прерванных пакетов возвращено в очередь: {count}")
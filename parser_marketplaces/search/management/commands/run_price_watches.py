@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from search.watches import run_due_watches
+
+
+class Command(BaseCommand):
+    help = (
+        "Проверяет отслеживания цен, срок проверки которых наступил. Каждый уникальный запрос "
+        "выполняется один раз для всех его наблюдателей, пороги проверяются сразу для всех. "
+        "Запускается по расписанию (cron) или постоянно с --loop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=int, metavar='SECONDS', help='повторять проверку с этим интервалом')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            stats = run_due_watches()
+            if stats.watches:
+                self.stdout.write(
+                    f"Отслеживаний {stats.watches}, уникальных запросов {stats.queries} "
+                    f"(повторно использовано {stats.reused}, выполнено {stats.searched}), "
+                    f"уведомлений {stats.alerts}, {time.perf_counter() - started:.1f} с"
+                )
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,182 @@
+import io
+import json
+import logging
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from .bench_parsers import BENCH_DATA
+
+logger = logging.getLogger(__name__)
+
+MARKETPLACES = ('wb', 'yma', 'mm', 'images')
+# Задержки по умолчанию близки к ответам настоящих маркетплейсов
+DEFAULT_LATENCY = {
+    'wb': 'lognormal:0.3:0.5',
+    'yma': 'lognormal:0.8:0.4',
+    'mm': 'lognormal:0.25:0.5',
+    'images': 'lognormal:0.05:0.5',
+}
+MM_THROTTLED = {"success": False, "code": 7, "error": "Too many requests"}
+
+
+def parse_latency(spec):
+    """Return a function giving a delay in seconds for "fixed:S", "uniform:A:B" or "lognormal:MEDIAN:SIGMA"."""
+    kind, *args = spec.split(':')
+    try:
+        args = [float(arg) for arg in args]
+    except ValueError:
+        raise ValueError(f"Неверная задержка: {spec}")
+    if kind == 'fixed' and len(args) == 1:
+        return lambda: args[0]
+    if kind == 'uniform' and len(args) == 2:
+        return lambda: random.uniform(*args)
+    if kind == 'lognormal' and len(args) == 2 and args[0] > 0:
+        return lambda: args[0] * random.lognormvariate(0, args[1])
+    raise ValueError(f"Неверная задержка: {spec}")
+
+
+def _per_marketplace(values, parse, defaults):
+    result = dict(defaults)
+    for value in values or ():
+        name, sep, setting = value.partition('=')
+        if not sep or name not in MARKETPLACES:
+            raise ValueError(f"Ожидается маркетплейс=значение, маркетплейсы: {', '.join(MARKETPLACES)}: {value}")
+        result[name] = setting
+    return {name: parse(setting) for name, setting in result.items()}
+
+
+class Corpus:
+    """Responses of the stub, built from search/bench_data with image links pointing at the stub."""
+
+    def __init__(self, base_url):
+        self.wb = (BENCH_DATA / 'wb_search.json').read_bytes()
+        yma = (BENCH_DATA / 'yma_search.html').read_text(encoding='utf-8')
+        self.yma = re.sub(r'src="https://[^/"]+/', f'src="{base_url}/images/yma/', yma).encode()
+        self.mm_catalog = json.loads((BENCH_DATA / 'mm_catalog.json').read_text(encoding='utf-8'))
+        for item in self.mm_catalog['items']:
+            item['goods']['titleImage'] = f"{base_url}/images/mm/{item['goods']['goodsId']}.jpg"
+        self.mm_offer = json.loads((BENCH_DATA / 'mm_offer.json').read_text(encoding='utf-8'))
+        buffer = io.BytesIO()
+        Image.new('RGB', (400, 400), (200, 120, 40)).save(buffer, 'JPEG')
+        self.image = buffer.getvalue()
+
+    def mm_page(self, body):
+        return {**self.mm_catalog, 'offset': str(body.get('offset', 0))}
+
+    def mm_offers(self, body):
+        # У каждого товара свой id предложения, как у настоящего Мегамаркета
+        goods_id = str(body.get('goodsId', '')).split('_')[0]
+        return {**self.mm_offer, 'offers': [{**offer, 'goodsId': goods_id} for offer in self.mm_offer['offers']]}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Задаются в make_server
+    corpus = None
+    latency = {}
+    error_rate = {}
+    throttle_rate = 0.0
+
+    def log_message(self, format, *args):
+        logger.debug("%s " + format, self.address_string(), *args)
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/exactmatch/ru/male/v13/search':
+            self._reply('wb', self.corpus.wb, 'application/json')
+        elif path == '/search':
+            self._reply('yma', self.corpus.yma, 'text/html; charset=utf-8')
+        elif path.startswith(('/images/', '/vol')):
+            self._reply('images', self.corpus.image, 'image/jpeg')
+        else:
+            self._send(404, b'', 'text/plain')
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        if self.path.endswith('/catalogService/catalog/search'):
+            payload = self.corpus.mm_page(body)
+        elif self.path.endswith('/catalogService/productOffers/get'):
+            payload = self.corpus.mm_offers(body)
+        else:
+            self._send(404, b'', 'text/plain')
+            return
+        if random.random() < self.throttle_rate:
+            payload = MM_THROTTLED
+        self._reply('mm', json.dumps(payload, ensure_ascii=False).encode(), 'application/json')
+
+    def _reply(self, marketplace, body, content_type):
+        time.sleep(self.latency[marketplace]())
+        if random.random() < self.error_rate[marketplace]:
+            self._send(503, b'Service Unavailable', 'text/plain')
+        else:
+            self._send(200, body, content_type)
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(host='127.0.0.1', port=0, latency=None, error_rate=None, throttle_rate=0.0):
+    """Create a stub server; latency and error_rate map marketplaces (wb, yma, mm, images) to settings."""
+    server = ThreadingHTTPServer((host, port), None)
+    server.daemon_threads = True
+    base_url = f"http://{host}:{server.server_address[1]}"
+    server.RequestHandlerClass = type('StubHandler', (StubHandler,), {
+        'corpus': Corpus(base_url),
+        'latency': _per_marketplace(latency, parse_latency, DEFAULT_LATENCY),
+        'error_rate': _per_marketplace(error_rate, float, dict.fromkeys(MARKETPLACES, '0')),
+        'throttle_rate': throttle_rate,
+    })
+    server.base_url = base_url
+    return server
+
+
+class Command(BaseCommand):
+    help = (
+        "Заглушка маркетплейсов для нагрузочного теста: отдаёт сохранённые ответы Wildberries, "
+        "Яндекс Маркета, Мегамаркета и картинки из search/bench_data с заданной задержкой, "
+        "долей ошибок 503 и долей ответов Мегамаркета «слишком частые запросы» (code 7). "
+        "Адаптеры направляются на неё настройками WB_SEARCH_BASE_URL, WB_IMAGES_BASE_URL, "
+        "YMA_BASE_URL и MM_BASE_URL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8900)
+        parser.add_argument(
+            '--latency', action='append', metavar='MP=SPEC',
+            help='задержка маркетплейса (wb, yma, mm, images): fixed:S, uniform:A:B или lognormal:MEDIAN:SIGMA, '
+                 'секунд; по умолчанию ' + ', '.join(f'{name}={spec}' for name, spec in DEFAULT_LATENCY.items()),
+        )
+        parser.add_argument('--error-rate', action='append', metavar='MP=RATE', help='доля ответов 503, например mm=0.05')
+        parser.add_argument('--throttle-rate', type=float, default=0.0, help='доля ответов Мегамаркета с code 7')
+        parser.add_argument('--seed', type=int, help='зерно случайных задержек и ошибок')
+
+    def handle(self, *args, **options):
+        if options['seed'] is not None:
+            random.seed(options['seed'])
+        try:
+            server = make_server(
+                options['host'], options['port'], options['latency'], options['error_rate'], options['throttle_rate'],
+            )
+        except (ValueError, OSError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Заглушка маркетплейсов на {server.base_url}"))
+        self.stdout.write(
+            f"WB_SEARCH_BASE_URL={server.base_url} WB_IMAGES_BASE_URL={server.base_url} "
+            f"YMA_BASE_URL={server.base_url} MM_BASE_URL={server.base_url}"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,55 @@
+# Generated by Django 5.2 on 2026-10-19 14:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('marketplace_name', models.CharField(max_length=100, verbose_name='Название маркетплейса')),
+                ('product_id', models.BigIntegerField(verbose_name='Id товара')),
+                ('name', models.CharField(max_length=510, verbose_name='Названия')),
+                ('brand', models.CharField(blank=True, max_length=100, null=True, verbose_name='Бренд')),
+                ('review_rating', models.FloatField(blank=True, null=True, verbose_name='Рейтинг')),
+                ('feedbacks', models.IntegerField(blank=True, null=True, verbose_name='Количество отзывов')),
+                ('color', models.CharField(blank=True, max_length=50, null=True, verbose_name='Цвет')),
+                ('price_product', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Цена')),
+                ('price_basic', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Цена до скидки')),
+                ('supplier_id', models.BigIntegerField(blank=True, null=True, verbose_name='ID продавца')),
+                ('supplier_rating', models.FloatField(blank=True, null=True, verbose_name='Рейтинг продавца')),
+                ('pics', models.IntegerField(default=0, verbose_name='Количество фотографий')),
+                ('first_image_path', models.CharField(blank=True, max_length=1024, null=True, verbose_name='Путь до 1 изображения')),
+                ('url', models.URLField(blank=True, max_length=1024, null=True, verbose_name='Ссылка на товар')),
+                ('delivery_date', models.CharField(blank=True, max_length=255, null=True, verbose_name='Дата доставки')),
+                ('duty', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Пошлина')),
+            ],
+            options={
+                'verbose_name': 'Товар',
+                'verbose_name_plural': 'Товары',
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query_text', models.CharField(max_length=255, verbose_name='Текст запроса')),
+                ('sort_value', models.CharField(choices=[('popular', 'По популярности'), ('rate', 'По рейтингу'), ('priceup', 'По возрастанию цены'), ('pricedown', 'По убыванию цены')], default='priceup', max_length=20, verbose_name='Фильтр сортировки')),
+                ('price_range', models.CharField(blank=True, max_length=20, null=True, verbose_name='Диапозон цены')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('marketplace_names', models.TextField(blank=True, default='[]', verbose_name='Названия маркетплейсов')),
+            ],
+            options={
+                'verbose_name': 'История поиска',
+                'verbose_name_plural': 'История поиска',
+            },
+        ),
+    ]
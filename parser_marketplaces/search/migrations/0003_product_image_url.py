@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 14:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_url',
+            field=models.URLField(blank=True, max_length=1024, null=True, verbose_name='Ссылка на изображение на маркетплейсе'),
+        ),
+    ]
@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.db import migrations, models
+
+# Значения Marketplace на момент миграции.
+MARKETPLACE_VALUES = {
+    "Wildberries": 1,
+    "Яндекс.Маркет": 2,
+    "Мегамаркет": 3,
+}
+
+
+# Написания, встречавшиеся в старых записях: без учёта регистра и пробелов по краям
+MARKETPLACE_ALIASES = {
+    **{name.lower(): value for name, value in MARKETPLACE_VALUES.items()},
+    "яндекс маркет": 2,
+    "wb": 1,
+    "yma": 2,
+    "mm": 3,
+}
+
+
+def fill_marketplace(apps, schema_editor):
+    Product = apps.get_model('search', 'Product')
+    names = Product.objects.values_list('marketplace_name', flat=True).distinct()
+    for name in names:
+        value = MARKETPLACE_ALIASES.get((name or '').strip().lower())
+        if value is not None:
+            Product.objects.filter(marketplace_name=name).update(marketplace=value)
+    # Следующая операция делает поле обязательным; без понятной ошибки она упала бы посреди миграции
+    unmapped = (
+        Product.objects.filter(marketplace__isnull=True)
+        .values('marketplace_name').annotate(count=models.Count('pk')).order_by('marketplace_name')
+    )
+    if unmapped:
+        listed = ", ".join(f"{row['marketplace_name']!r} ({row['count']})" for row in unmapped)
+        raise RuntimeError(
+            f"Неизвестные названия маркетплейсов у товаров: {listed}. "
+            f"Исправьте marketplace_name на одно из {', '.join(MARKETPLACE_VALUES)} или удалите эти товары и повторите миграцию."
+        )
+
+
+def fill_marketplace_name(apps, schema_editor):
+    Product = apps.get_model('search', 'Product')
+    for name, value in MARKETPLACE_VALUES.items():
+        Product.objects.filter(marketplace=value).update(marketplace_name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0003_product_image_url'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='marketplace',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Wildberries'), (2, 'Яндекс.Маркет'), (3, 'Мегамаркет')], null=True, verbose_name='Маркетплейс'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='marketplace_name',
+            field=models.CharField(max_length=100, null=True, verbose_name='Название маркетплейса'),
+        ),
+        migrations.RunPython(fill_marketplace, fill_marketplace_name),
+        migrations.AlterField(
+            model_name='product',
+            name='marketplace',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Wildberries'), (2, 'Яндекс.Маркет'), (3, 'Мегамаркет')], verbose_name='Маркетплейс'),
+        ),
+        migrations.RemoveField(
+            model_name='product',
+            name='marketplace_name',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['marketplace', 'product_id'], name='product_marketplace_pid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchquery',
+            index=models.Index(fields=['user', '-created_at'], name='searchquery_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,177 @@
+# Generated by Django 5.2 on 2026-10-19 14:33
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.utils import timezone
+
+BATCH_SIZE = 2000
+
+DESCRIPTIVE_FIELDS = ('name', 'brand', 'color', 'supplier_id', 'pics', 'image_url', 'url')
+OBSERVATION_FIELDS = ('price_product', 'price_basic', 'review_rating', 'feedbacks', 'supplier_rating', 'delivery_date', 'duty')
+MARKETPLACE_SLUGS = {1: 'wb', 2: 'yma', 3: 'mm'}
+
+
+def _copy_batch(apps, rows, catalog, positions):
+    CatalogProduct = apps.get_model('search', 'CatalogProduct')
+    PriceObservation = apps.get_model('search', 'PriceObservation')
+    SearchResult = apps.get_model('search', 'SearchResult')
+
+    latest = {(row['marketplace'], row['product_id']): row for row in rows}
+    existing = [key for key in latest if key in catalog]
+    if existing:
+        CatalogProduct.objects.bulk_update(
+            [
+                CatalogProduct(id=catalog[key], marketplace=key[0], product_id=key[1],
+                               **{name: latest[key][name] for name in DESCRIPTIVE_FIELDS})
+                for key in existing
+            ],
+            DESCRIPTIVE_FIELDS,
+        )
+    created = CatalogProduct.objects.bulk_create([
+        CatalogProduct(marketplace=key[0], product_id=key[1], **{name: row[name] for name in DESCRIPTIVE_FIELDS})
+        for key, row in latest.items()
+        if key not in catalog
+    ])
+    for product in created:
+        catalog[product.marketplace, product.product_id] = product.id
+
+    observations = PriceObservation.objects.bulk_create([
+        PriceObservation(
+            product_id=catalog[row['marketplace'], row['product_id']],
+            observed_at=row['searchquery__created_at'] or timezone.now(),
+            **{name: row[name] for name in OBSERVATION_FIELDS},
+        )
+        for row in rows
+    ])
+    results = []
+    for row, observation in zip(rows, observations):
+        searchquery_id = row['searchquery_id']
+        if searchquery_id is None:
+            continue
+        position = positions.get(searchquery_id, 0)
+        positions[searchquery_id] = position + 1
+        results.append(SearchResult(searchquery_id=searchquery_id, observation_id=observation.id, position=position))
+    SearchResult.objects.bulk_create(results)
+
+
+def copy_products_to_catalog(apps, schema_editor):
+    Product = apps.get_model('search', 'Product')
+    rows = (
+        Product.objects.order_by('id')
+        .values('marketplace', 'product_id', 'searchquery_id', 'searchquery__created_at',
+                *DESCRIPTIVE_FIELDS, *OBSERVATION_FIELDS)
+    )
+    catalog = {}
+    positions = {}
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            _copy_batch(apps, batch, catalog, positions)
+            batch = []
+    if batch:
+        _copy_batch(apps, batch, catalog, positions)
+
+
+def copy_catalog_to_products(apps, schema_editor):
+    Product = apps.get_model('search', 'Product')
+    SearchResult = apps.get_model('search', 'SearchResult')
+    results = (
+        SearchResult.objects.select_related('observation__product')
+        .order_by('searchquery_id', 'position')
+    )
+    batch = []
+    for result in results.iterator(chunk_size=BATCH_SIZE):
+        observation = result.observation
+        product = observation.product
+        slug = MARKETPLACE_SLUGS.get(product.marketplace)
+        batch.append(Product(
+            marketplace=product.marketplace,
+            product_id=product.product_id,
+            searchquery_id=result.searchquery_id,
+            first_image_path=f"/img/{slug}/{product.product_id}/" if product.pics and slug else None,
+            **{name: getattr(product, name) for name in DESCRIPTIVE_FIELDS},
+            **{name: getattr(observation, name) for name in OBSERVATION_FIELDS},
+        ))
+        if len(batch) == BATCH_SIZE:
+            Product.objects.bulk_create(batch)
+            batch = []
+    Product.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0004_product_marketplace_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('marketplace', models.PositiveSmallIntegerField(choices=[(1, 'Wildberries'), (2, 'Яндекс.Маркет'), (3, 'Мегамаркет')], verbose_name='Маркетплейс')),
+                ('product_id', models.BigIntegerField(verbose_name='Id товара')),
+                ('name', models.CharField(max_length=510, verbose_name='Названия')),
+                ('brand', models.CharField(blank=True, max_length=100, null=True, verbose_name='Бренд')),
+                ('color', models.CharField(blank=True, max_length=50, null=True, verbose_name='Цвет')),
+                ('supplier_id', models.BigIntegerField(blank=True, null=True, verbose_name='ID продавца')),
+                ('pics', models.IntegerField(default=0, verbose_name='Количество фотографий')),
+                ('image_url', models.URLField(blank=True, max_length=1024, null=True, verbose_name='Ссылка на изображение на маркетплейсе')),
+                ('url', models.URLField(blank=True, max_length=1024, null=True, verbose_name='Ссылка на товар')),
+                ('first_seen_at', models.DateTimeField(auto_now_add=True, verbose_name='Впервые найден')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлён')),
+            ],
+            options={
+                'verbose_name': 'Товар',
+                'verbose_name_plural': 'Товары',
+                'constraints': [models.UniqueConstraint(fields=('marketplace', 'product_id'), name='catalog_marketplace_pid_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PriceObservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('observed_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время наблюдения')),
+                ('price_product', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Цена')),
+                ('price_basic', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Цена до скидки')),
+                ('review_rating', models.FloatField(blank=True, null=True, verbose_name='Рейтинг')),
+                ('feedbacks', models.IntegerField(blank=True, null=True, verbose_name='Количество отзывов')),
+                ('supplier_rating', models.FloatField(blank=True, null=True, verbose_name='Рейтинг продавца')),
+                ('delivery_date', models.CharField(blank=True, max_length=255, null=True, verbose_name='Дата доставки')),
+                ('duty', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Пошлина')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='observations', to='search.catalogproduct', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Наблюдение цены',
+                'verbose_name_plural': 'История цен',
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(verbose_name='Позиция в выдаче')),
+                ('observation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_results', to='search.priceobservation')),
+                ('searchquery', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='search.searchquery')),
+            ],
+            options={
+                'verbose_name': 'Результат поиска',
+                'verbose_name_plural': 'Результаты поиска',
+                'ordering': ['position'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='priceobservation',
+            index=models.Index(fields=['product', '-observed_at'], name='observation_product_time_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='searchresult',
+            constraint=models.UniqueConstraint(fields=('searchquery', 'position'), name='searchresult_query_position_uniq'),
+        ),
+        migrations.RunPython(copy_products_to_catalog, copy_catalog_to_products),
+        migrations.DeleteModel(
+            name='Product',
+        ),
+    ]
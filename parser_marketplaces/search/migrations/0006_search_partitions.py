@@ -0,0 +1,195 @@
+# Generated by Django 5.2 on 2026-10-19 14:39
+
+from datetime import datetime, timezone as dt_timezone
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+# Функции секционирования скопированы из search.partitions в том виде, в каком их
+# применяла эта миграция: модуль может меняться, история миграций — нет.
+PARTITIONED_TABLES = {
+    "search_priceobservation": "observed_at",
+    "search_searchresult": "observed_at",
+}
+MONTHS_AHEAD = 3
+
+
+def month_start(value):
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def create_partition(cursor, table, month):
+    name = f"{table}_p{month:%Y_%m}"
+    cursor.execute("SELECT to_regclass(%s)", [name])
+    if cursor.fetchone()[0] is not None:
+        return
+    key = PARTITIONED_TABLES[table]
+    lower, upper = month.isoformat(), add_months(month, 1).isoformat()
+    cursor.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cursor.execute(
+        f"""
+        WITH moved AS (
+            DELETE FROM {table}_default WHERE {key} >= %s AND {key} < %s RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+        """,
+        [lower, upper],
+    )
+    cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{lower}') TO ('{upper}')")
+
+
+def table_constraints_and_indexes(cursor, table):
+    cursor.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype IN ('u', 'f', 'c')
+        """,
+        [table],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        """
+        SELECT indexdef FROM pg_indexes
+        WHERE tablename = %s
+          AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)
+        """,
+        [table, table],
+    )
+    return constraints, [row[0] for row in cursor.fetchall()]
+
+
+def partition_table(cursor, table, end):
+    key = PARTITIONED_TABLES[table]
+    constraints, indexes = table_constraints_and_indexes(cursor, table)
+    cursor.execute(f"SELECT min({key}) FROM {table}")
+    oldest = cursor.fetchone()[0]
+
+    old = f"{table}_unpartitioned"
+    # Identity-колонки у секционированных таблиц появились только в PostgreSQL 17,
+    # поэтому id получает значения из обычной последовательности.
+    sequence = f"{table}_id_seq"
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {old}")
+    cursor.execute(f"ALTER TABLE {old} ALTER COLUMN id DROP IDENTITY IF EXISTS")
+    cursor.execute(f"ALTER TABLE {old} ALTER COLUMN id DROP DEFAULT")
+    cursor.execute(f"DROP SEQUENCE IF EXISTS {sequence}")
+    cursor.execute(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE ({key})")
+    cursor.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+    month = month_start(oldest or end)
+    while month <= end:
+        create_partition(cursor, table, month)
+        month = add_months(month, 1)
+    cursor.execute(f"INSERT INTO {table} SELECT * FROM {old}")
+    cursor.execute(f"DROP TABLE {old}")
+
+    cursor.execute(f"CREATE SEQUENCE {sequence} OWNED BY {table}.id")
+    cursor.execute(f"SELECT setval('{sequence}', coalesce(max(id), 0) + 1, false) FROM {table}")
+    cursor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+    cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, {key})")
+    for name, definition in constraints:
+        cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+    for definition in indexes:
+        cursor.execute(definition)
+
+
+def unpartition_table(cursor, table):
+    constraints, indexes = table_constraints_and_indexes(cursor, table)
+    indexes = [definition.replace(" ON ONLY ", " ON ") for definition in indexes]
+
+    old = f"{table}_partitioned"
+    sequence = f"{table}_id_seq"
+    cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {old}")
+    cursor.execute(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS)")
+    cursor.execute(f"INSERT INTO {table} SELECT * FROM {old}")
+    cursor.execute(f"DROP TABLE {old} CASCADE")
+    cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+    cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id)")
+    for name, definition in constraints:
+        cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+    for definition in indexes:
+        cursor.execute(definition)
+
+
+def fill_result_observed_at(apps, schema_editor):
+    PriceObservation = apps.get_model('search', 'PriceObservation')
+    SearchResult = apps.get_model('search', 'SearchResult')
+    SearchResult.objects.update(observed_at=Subquery(
+        PriceObservation.objects.filter(id=OuterRef('observation_id')).values('observed_at')[:1]
+    ))
+
+
+def partition_tables(apps, schema_editor):
+    # Секционирование есть только в PostgreSQL, в остальных СУБД таблицы остаются обычными.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    end = add_months(month_start(timezone.now()), MONTHS_AHEAD)
+    with schema_editor.connection.cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            partition_table(cursor, table, end)
+
+
+def unpartition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            unpartition_table(cursor, table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0005_product_catalog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Время архивации')),
+                ('product_count', models.PositiveIntegerField(verbose_name='Количество товаров')),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Минимальная цена')),
+                ('data', models.BinaryField(verbose_name='Результаты (JSON, zlib)')),
+            ],
+            options={
+                'verbose_name': 'Архив результатов поиска',
+                'verbose_name_plural': 'Архив результатов поиска',
+            },
+        ),
+        migrations.RemoveConstraint(
+            model_name='searchresult',
+            name='searchresult_query_position_uniq',
+        ),
+        migrations.AddField(
+            model_name='searchresult',
+            name='observed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время наблюдения'),
+        ),
+        migrations.RunPython(fill_result_observed_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='searchresult',
+            name='observation',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='search_results', to='search.priceobservation'),
+        ),
+        migrations.AddConstraint(
+            model_name='searchresult',
+            constraint=models.UniqueConstraint(fields=('searchquery', 'position', 'observed_at'), name='searchresult_query_position_uniq'),
+        ),
+        migrations.AddField(
+            model_name='searcharchive',
+            name='searchquery',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='archive', to='search.searchquery'),
+        ),
+        migrations.RunPython(partition_tables, unpartition_tables),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2 on 2026-10-19 14:43
+
+import django.contrib.postgres.fields
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import json
+
+# Значения Marketplace на момент миграции.
+MARKETPLACE_VALUES = {
+    "Wildberries": 1,
+    "Яндекс.Маркет": 2,
+    "Мегамаркет": 3,
+}
+
+
+def fill_marketplaces(apps, schema_editor):
+    SearchQuery = apps.get_model('search', 'SearchQuery')
+    # Различных сочетаний маркетплейсов немного, поэтому обновление идёт одним UPDATE на сочетание.
+    for names in SearchQuery.objects.values_list('marketplace_names', flat=True).distinct():
+        try:
+            values = [MARKETPLACE_VALUES[name] for name in json.loads(names or '[]') if name in MARKETPLACE_VALUES]
+        except ValueError:
+            values = []
+        SearchQuery.objects.filter(marketplace_names=names).update(marketplaces=values)
+
+
+def fill_marketplace_names(apps, schema_editor):
+    SearchQuery = apps.get_model('search', 'SearchQuery')
+    labels = {value: name for name, value in MARKETPLACE_VALUES.items()}
+    for values in SearchQuery.objects.values_list('marketplaces', flat=True).distinct():
+        SearchQuery.objects.filter(marketplaces=values).update(
+            marketplace_names=json.dumps([labels[value] for value in values if value in labels])
+        )
+
+
+def fill_result_summary(apps, schema_editor):
+    SearchQuery = apps.get_model('search', 'SearchQuery')
+    SearchResult = apps.get_model('search', 'SearchResult')
+    SearchArchive = apps.get_model('search', 'SearchArchive')
+    results = SearchResult.objects.filter(searchquery=OuterRef('pk')).order_by().values('searchquery')
+    archive = SearchArchive.objects.filter(searchquery=OuterRef('pk'))
+    SearchQuery.objects.update(
+        product_count=Coalesce(
+            Subquery(archive.values('product_count')),
+            Subquery(results.annotate(count=Count('pk')).values('count')),
+            0,
+        ),
+        min_price=Coalesce(
+            Subquery(archive.values('min_price')),
+            Subquery(results.annotate(price=Min('observation__price_product')).values('price')),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0006_search_partitions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchquery',
+            name='marketplaces',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.PositiveSmallIntegerField(choices=[(1, 'Wildberries'), (2, 'Яндекс.Маркет'), (3, 'Мегамаркет')]), blank=True, default=list, size=None, verbose_name='Маркетплейсы'),
+        ),
+        migrations.AddField(
+            model_name='searchquery',
+            name='min_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Минимальная цена'),
+        ),
+        migrations.AddField(
+            model_name='searchquery',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество товаров'),
+        ),
+        migrations.RunPython(fill_marketplaces, fill_marketplace_names),
+        migrations.RunPython(fill_result_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-19 14:43
+
+import django.contrib.postgres.indexes
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Отдельная миграция: в PostgreSQL нельзя менять таблицу в той же транзакции,
+    # где обновлённые строки оставили отложенные проверки внешних ключей.
+
+    dependencies = [
+        ('search', '0007_searchquery_marketplaces_array'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='searchquery',
+            name='marketplace_names',
+        ),
+        migrations.AddIndex(
+            model_name='searchquery',
+            index=models.Index(fields=['user', 'min_price'], name='searchquery_user_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchquery',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['marketplaces'], name='searchquery_marketplaces_gin'),
+        ),
+    ]
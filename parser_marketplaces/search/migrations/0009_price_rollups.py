@@ -0,0 +1,93 @@
+# Generated by Django 5.2 on 2026-10-19 14:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from collections import defaultdict
+
+
+def normalize_query(text):
+    # Копия search.models.normalize_query на момент миграции
+    return " ".join(text.lower().replace("ё", "е").split())
+
+
+def fill_query_key(apps, schema_editor):
+    SearchQuery = apps.get_model('search', 'SearchQuery')
+    texts = defaultdict(list)
+    for text in SearchQuery.objects.values_list('query_text', flat=True).distinct().iterator():
+        texts[normalize_query(text)].append(text)
+    for key, group in texts.items():
+        SearchQuery.objects.filter(query_text__in=group).update(query_key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0008_remove_searchquery_marketplace_names'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPriceDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('min_price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Минимальная цена')),
+                ('median_price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Медианная цена')),
+                ('max_price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Максимальная цена')),
+                ('observation_count', models.PositiveIntegerField(verbose_name='Количество наблюдений')),
+            ],
+            options={
+                'verbose_name': 'Дневная цена товара',
+                'verbose_name_plural': 'Дневные цены товаров',
+                'ordering': ['day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='QueryPriceDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query_key', models.CharField(max_length=255, verbose_name='Нормализованный запрос')),
+                ('marketplace', models.PositiveSmallIntegerField(choices=[(1, 'Wildberries'), (2, 'Яндекс.Маркет'), (3, 'Мегамаркет')], verbose_name='Маркетплейс')),
+                ('day', models.DateField(verbose_name='День')),
+                ('min_price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Минимальная цена')),
+                ('median_price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Медианная цена')),
+                ('max_price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Максимальная цена')),
+                ('observation_count', models.PositiveIntegerField(verbose_name='Количество наблюдений')),
+            ],
+            options={
+                'verbose_name': 'Дневная цена запроса',
+                'verbose_name_plural': 'Дневные цены запросов',
+                'ordering': ['day', 'marketplace'],
+            },
+        ),
+        migrations.AddField(
+            model_name='searchquery',
+            name='query_key',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Нормализованный запрос'),
+        ),
+        migrations.AddIndex(
+            model_name='searchquery',
+            index=models.Index(fields=['query_key', 'created_at'], name='searchquery_key_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='productpricedaily',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_prices', to='search.catalogproduct', verbose_name='Товар'),
+        ),
+        migrations.AddField(
+            model_name='querypricedaily',
+            name='min_product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='search.catalogproduct', verbose_name='Самый дешёвый товар'),
+        ),
+        migrations.AddConstraint(
+            model_name='productpricedaily',
+            constraint=models.UniqueConstraint(fields=('product', 'day'), name='product_daily_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='querypricedaily',
+            constraint=models.UniqueConstraint(fields=('query_key', 'day', 'marketplace'), name='query_daily_uniq'),
+        ),
+        migrations.RunPython(fill_query_key, migrations.RunPython.noop),
+    ]
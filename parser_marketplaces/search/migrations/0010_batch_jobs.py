@@ -0,0 +1,59 @@
+# Generated by Django 5.2 on 2026-10-19 15:18
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0009_price_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sort_value', models.CharField(choices=[('popular', 'По популярности'), ('rate', 'По рейтингу'), ('priceup', 'По возрастанию цены'), ('pricedown', 'По убыванию цены')], default='priceup', max_length=20, verbose_name='Фильтр сортировки')),
+                ('price_min', models.PositiveIntegerField(blank=True, null=True, verbose_name='Цена от')),
+                ('price_max', models.PositiveIntegerField(blank=True, null=True, verbose_name='Цена до')),
+                ('marketplaces', django.contrib.postgres.fields.ArrayField(base_field=models.PositiveSmallIntegerField(choices=[(1, 'Wildberries'), (2, 'Яндекс.Маркет'), (3, 'Мегамаркет')]), size=None, verbose_name='Маркетплейсы')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершена')], default='pending', max_length=10, verbose_name='Статус')),
+                ('duplicates', models.PositiveIntegerField(default=0, verbose_name='Повторов')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Последний запуск')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершена')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batch_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Пакетная проверка',
+                'verbose_name_plural': 'Пакетные проверки',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BatchItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(verbose_name='Номер в списке')),
+                ('query_text', models.CharField(max_length=255, verbose_name='Текст запроса')),
+                ('query_key', models.CharField(max_length=255, verbose_name='Нормализованный запрос')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('done', 'Выполнен'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Статус')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Ошибка')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Выполнен')),
+                ('search_query', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='search.searchquery', verbose_name='Поиск')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='search.batchjob', verbose_name='Пакет')),
+            ],
+            options={
+                'verbose_name': 'Запрос пакета',
+                'verbose_name_plural': 'Запросы пакета',
+                'ordering': ['job', 'position'],
+                'indexes': [models.Index(fields=['job', 'status'], name='batchitem_job_status_idx')],
+                'constraints': [models.UniqueConstraint(fields=('job', 'query_key'), name='batchitem_job_key_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2 on 2026-10-19 15:20
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0010_batch_jobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceWatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query_text', models.CharField(max_length=255, verbose_name='Текст запроса')),
+                ('query_key', models.CharField(blank=True, default='', max_length=255, verbose_name='Нормализованный запрос')),
+                ('marketplaces', django.contrib.postgres.fields.ArrayField(base_field=models.PositiveSmallIntegerField(choices=[(1, 'Wildberries'), (2, 'Яндекс.Маркет'), (3, 'Мегамаркет')]), size=None, verbose_name='Маркетплейсы')),
+                ('threshold', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Уведомить при цене не выше')),
+                ('interval_hours', models.PositiveSmallIntegerField(choices=[(6, 'Каждые 6 часов'), (12, 'Каждые 12 часов'), (24, 'Раз в день'), (168, 'Раз в неделю')], default=24, verbose_name='Проверять')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Включено')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('next_run_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Следующая проверка')),
+                ('last_checked_at', models.DateTimeField(blank=True, null=True, verbose_name='Последняя проверка')),
+                ('last_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Последняя цена')),
+                ('last_search', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='search.searchquery', verbose_name='Последний поиск')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_watches', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Отслеживание цены',
+                'verbose_name_plural': 'Отслеживания цен',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PriceAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Цена')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Отправлено')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='search.catalogproduct', verbose_name='Товар')),
+                ('search_query', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='search.searchquery', verbose_name='Поиск')),
+                ('watch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alerts', to='search.pricewatch', verbose_name='Отслеживание')),
+            ],
+            options={
+                'verbose_name': 'Уведомление о цене',
+                'verbose_name_plural': 'Уведомления о цене',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='pricewatch',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['next_run_at'], name='pricewatch_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pricewatch',
+            index=models.Index(fields=['user', '-created_at'], name='pricewatch_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-19 15:23
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0011_price_watches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MMListingOffer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('goods_id', models.CharField(max_length=64, unique=True, verbose_name='goodsId')),
+                ('fingerprint', models.CharField(max_length=40, verbose_name='Отпечаток строки выдачи')),
+                ('offer', models.JSONField(verbose_name='Поля предложения')),
+                ('updated_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Предложение Мегамаркета',
+                'verbose_name_plural': 'Предложения Мегамаркета',
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-19 15:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0012_mm_listing_offers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTrace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Обработчик')),
+                ('duration_ms', models.FloatField(verbose_name='Длительность, мс')),
+                ('spans', models.JSONField(default=list, verbose_name='Этапы')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Создано')),
+                ('search_query', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='traces', to='search.searchquery', verbose_name='Поиск')),
+            ],
+            options={
+                'verbose_name': 'Трассировка поиска',
+                'verbose_name_plural': 'Трассировки поиска',
+            },
+        ),
+    ]
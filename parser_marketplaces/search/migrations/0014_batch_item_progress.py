@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 15:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0013_search_traces'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchitem',
+            name='progress',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Разобрано страниц Мегамаркета, %'),
+        ),
+    ]
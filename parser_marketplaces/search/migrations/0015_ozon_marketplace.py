@@ -0,0 +1,39 @@
+# Generated by Django 5.2 on 2026-10-19 15:47
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0014_batch_item_progress'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='batchjob',
+            name='marketplaces',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.PositiveSmallIntegerField(choices=[(1, 'Wildberries'), (2, 'Яндекс.Маркет'), (3, 'Мегамаркет'), (4, 'Ozon')]), size=None, verbose_name='Маркетплейсы'),
+        ),
+        migrations.AlterField(
+            model_name='catalogproduct',
+            name='marketplace',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Wildberries'), (2, 'Яндекс.Маркет'), (3, 'Мегамаркет'), (4, 'Ozon')], verbose_name='Маркетплейс'),
+        ),
+        migrations.AlterField(
+            model_name='pricewatch',
+            name='marketplaces',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.PositiveSmallIntegerField(choices=[(1, 'Wildberries'), (2, 'Яндекс.Маркет'), (3, 'Мегамаркет'), (4, 'Ozon')]), size=None, verbose_name='Маркетплейсы'),
+        ),
+        migrations.AlterField(
+            model_name='querypricedaily',
+            name='marketplace',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Wildberries'), (2, 'Яндекс.Маркет'), (3, 'Мегамаркет'), (4, 'Ozon')], verbose_name='Маркетплейс'),
+        ),
+        migrations.AlterField(
+            model_name='searchquery',
+            name='marketplaces',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.PositiveSmallIntegerField(choices=[(1, 'Wildberries'), (2, 'Яндекс.Маркет'), (3, 'Мегамаркет'), (4, 'Ozon')]), blank=True, default=list, size=None, verbose_name='Маркетплейсы'),
+        ),
+    ]
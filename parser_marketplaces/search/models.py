@@ -1,9 +1,17 @@
 from django.db import models
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db.utils import IntegrityError
 from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta
 import json
+import zlib
 
 SORT_VALUE_CHOICES = [
     ("popular", "По популярности"),
@@ -22,35 +30,138 @@ SORT_PARAM_MAPPING = {
     "pricedown": {"wb": "pricedown", "yandex": "dprice", "mm": "2"},
 }
 
-class Product(models.Model):
-    marketplace_name = models.CharField(max_length=100, verbose_name="Название маркетплейса")
+
+class Marketplace(models.IntegerChoices):
+    WILDBERRIES = 1, "Wildberries"
+    YANDEX_MARKET = 2, "Яндекс.Маркет"
+    MEGAMARKET = 3, "Мегамаркет"
+    OZON = 4, "Ozon"
+
+
+# Короткие имена маркетплейсов, используемые в путях к изображениям
+# (media/image/<slug>/<product_id>/) и в URL прокси изображений.
+MARKETPLACE_SLUGS = {
+    Marketplace.WILDBERRIES: "wb",
+    Marketplace.YANDEX_MARKET: "yma",
+    Marketplace.MEGAMARKET: "mm",
+    Marketplace.OZON: "ozon",
+}
+
+class CatalogProduct(models.Model):
+    """Товар маркетплейса: одна строка на пару (маркетплейс, id товара)."""
+    marketplace = models.PositiveSmallIntegerField(choices=Marketplace.choices, verbose_name="Маркетплейс")
     product_id = models.BigIntegerField(verbose_name='Id товара')  # ID товара на маркетплейсе
     name = models.CharField(max_length=510, verbose_name='Названия')
     brand = models.CharField(max_length=100, blank=True, null=True, verbose_name='Бренд')
-    review_rating = models.FloatField(blank=True, null=True, verbose_name='Рейтинг')
-    feedbacks = models.IntegerField(blank=True, null=True, verbose_name='Количество отзывов')
     color = models.CharField(max_length=50, blank=True, null=True, verbose_name='Цвет')
-    price_product = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, verbose_name='Цена')
-    price_basic = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, verbose_name='Цена до скидки')
     supplier_id = models.BigIntegerField(blank=True, null=True, verbose_name='ID продавца')
-    supplier_rating = models.FloatField(blank=True, null=True, verbose_name='Рейтинг продавца')
     pics = models.IntegerField(default=0, verbose_name='Количество фотографий')
-    first_image_path = models.CharField(max_length=1024, blank=True, null=True, verbose_name='Путь до 1 изображения')
-    searchquery = models.ForeignKey('SearchQuery', on_delete=models.SET_NULL, related_name='products', null=True, blank=True)
+    image_url = models.URLField(max_length=1024, blank=True, null=True, verbose_name='Ссылка на изображение на маркетплейсе')
     url = models.URLField(max_length=1024, blank=True, null=True, verbose_name='Ссылка на товар')
-    delivery_date = models.CharField(max_length=255, blank=True, null=True, verbose_name='Дата доставки')
-    duty = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, verbose_name='Пошлина')
+    first_seen_at = models.DateTimeField(auto_now_add=True, verbose_name='Впервые найден')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлён')
+
+    # Поля карточки, которые обновляются при повторной встрече товара
+    DESCRIPTIVE_FIELDS = ('name', 'brand', 'color', 'supplier_id', 'pics', 'image_url', 'url')
 
     class Meta:
         verbose_name = "Товар"
         verbose_name_plural = "Товары"
+        constraints = [
+            models.UniqueConstraint(fields=['marketplace', 'product_id'], name='catalog_marketplace_pid_uniq'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.marketplace_name})"
 
+    @property
+    def marketplace_name(self):
+        return self.get_marketplace_display()
+
+    @property
+    def image_src(self):
+        """Return URL of the product image served through the image proxy."""
+        slug = MARKETPLACE_SLUGS.get(self.marketplace)
+        if not slug or not self.pics:
+            return None
+        return reverse('search:image_proxy', args=[slug, self.product_id])
+
+    @property
+    def image_srcset(self):
+        """Return srcset of card-sized thumbnails for the product image."""
+        from .images import THUMBNAIL_WIDTHS
+
+        slug = MARKETPLACE_SLUGS.get(self.marketplace)
+        if not slug or not self.pics:
+            return ""
+        return ", ".join(
+            f"{reverse('search:image_thumbnail', args=[slug, self.product_id, width])} {width}w"
+            for width in THUMBNAIL_WIDTHS
+        )
+
+
+class PriceObservation(models.Model):
+    """Цена и показатели товара в момент, когда он встретился в выдаче."""
+    product = models.ForeignKey(CatalogProduct, on_delete=models.CASCADE, related_name='observations', verbose_name='Товар')
+    observed_at = models.DateTimeField(default=timezone.now, verbose_name='Время наблюдения')
+    price_product = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, verbose_name='Цена')
+    price_basic = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, verbose_name='Цена до скидки')
+    review_rating = models.FloatField(blank=True, null=True, verbose_name='Рейтинг')
+    feedbacks = models.IntegerField(blank=True, null=True, verbose_name='Количество отзывов')
+    supplier_rating = models.FloatField(blank=True, null=True, verbose_name='Рейтинг продавца')
+    delivery_date = models.CharField(max_length=255, blank=True, null=True, verbose_name='Дата доставки')
+    duty = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, verbose_name='Пошлина')
+
+    class Meta:
+        verbose_name = "Наблюдение цены"
+        verbose_name_plural = "История цен"
+        indexes = [
+            models.Index(fields=['product', '-observed_at'], name='observation_product_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.price_product} ({self.observed_at:%d.%m.%Y %H:%M})"
+
+
+# Результаты сохраняются сразу после поиска, поэтому их observed_at лежит в этом
+# окне от created_at запроса. Условие по окну отсекает лишние месячные секции.
+RESULTS_WINDOW = timedelta(days=1)
+
+
+class SearchResult(models.Model):
+    """Связь запроса поиска с наблюдениями, показанными в его выдаче."""
+    searchquery = models.ForeignKey('SearchQuery', on_delete=models.CASCADE, related_name='results')
+    # В PostgreSQL наблюдения секционированы по месяцам (search/partitions.py),
+    # а внешний ключ на секционированную таблицу требует уникальности по
+    # (id, observed_at), поэтому ограничение в базе не создаётся.
+    observation = models.ForeignKey(
+        PriceObservation, on_delete=models.CASCADE, related_name='search_results', db_constraint=False
+    )
+    position = models.PositiveSmallIntegerField(verbose_name='Позиция в выдаче')
+    # Копия observed_at наблюдения: ключ секционирования результатов.
+    observed_at = models.DateTimeField(default=timezone.now, verbose_name='Время наблюдения')
+
+    class Meta:
+        verbose_name = "Результат поиска"
+        verbose_name_plural = "Результаты поиска"
+        ordering = ['position']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['searchquery', 'position', 'observed_at'], name='searchresult_query_position_uniq'
+            ),
+        ]
+
+
+def normalize_query(text):
+    """Return query text reduced to the form used to group searches in analytics."""
+    return " ".join(text.lower().replace("ё", "е").split())
+
+
 class SearchQuery(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='search_queries')
     query_text = models.CharField(max_length=255, verbose_name="Текст запроса")
+    # Нормализованный текст запроса (normalize_query), по нему строится аналитика цен
+    query_key = models.CharField(max_length=255, blank=True, default="", verbose_name="Нормализованный запрос")
     sort_value = models.CharField(
         max_length=20,
         choices=SORT_VALUE_CHOICES,
@@ -59,18 +170,31 @@ class SearchQuery(models.Model):
     )
     price_range = models.CharField(max_length=20, blank=True, null=True, verbose_name="Диапозон цены")
     created_at = models.DateTimeField(auto_now_add=True)
-    marketplace_names = models.TextField(verbose_name="Названия маркетплейсов", blank=True, default="[]")
+    marketplaces = ArrayField(
+        models.PositiveSmallIntegerField(choices=Marketplace.choices),
+        blank=True,
+        default=list,
+        verbose_name="Маркетплейсы",
+    )
+    # Итоги выдачи, сохраняются вместе с результатами (search.services.store_results)
+    product_count = models.PositiveIntegerField(default=0, verbose_name="Количество товаров")
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, verbose_name="Минимальная цена")
+
+    def save(self, *args, **kwargs):
+        if not self.query_key:
+            self.query_key = normalize_query(self.query_text)
+        super().save(*args, **kwargs)
 
     def get_marketplace_names(self):
         """Return list of marketplace names."""
-        return json.loads(self.marketplace_names)
+        return [Marketplace(value).label for value in self.marketplaces]
 
     def set_marketplace_names(self, names):
-        """Set list of marketplace names."""
-        self.marketplace_names = json.dumps(names)
+        """Set marketplaces from list of marketplace names."""
+        self.marketplaces = [marketplace.value for marketplace in Marketplace if marketplace.label in names]
 
     def __str__(self):
-        m_names = ', '.join(json.loads(self.marketplace_names)[:3])
+        m_names = ', '.join(self.get_marketplace_names()[:3])
         return f"Запрос \"{self.query_text}\" пользователя {self.user.username} ({m_names})"
     
     @property
@@ -80,4 +204,277 @@ class SearchQuery(models.Model):
     
     class Meta:
         verbose_name = "История поиска"
-        verbose_name_plural = "История поиска"
\ No newline at end of file
+        verbose_name_plural = "История поиска"
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='searchquery_user_created_idx'),
+            models.Index(fields=['user', 'min_price'], name='searchquery_user_price_idx'),
+            GinIndex(fields=['marketplaces'], name='searchquery_marketplaces_gin'),
+            models.Index(fields=['query_key', 'created_at'], name='searchquery_key_created_idx'),
+        ]
+
+class SearchArchive(models.Model):
+    """Сжатый снимок результатов запроса, секции которых удалены по сроку хранения."""
+    searchquery = models.OneToOneField(SearchQuery, on_delete=models.CASCADE, related_name='archive')
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name='Время архивации')
+    product_count = models.PositiveIntegerField(verbose_name='Количество товаров')
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, verbose_name='Минимальная цена')
+    data = models.BinaryField(verbose_name='Результаты (JSON, zlib)')
+
+    class Meta:
+        verbose_name = "Архив результатов поиска"
+        verbose_name_plural = "Архив результатов поиска"
+
+    def __str__(self):
+        return f"Архив запроса {self.searchquery_id} ({self.product_count} товаров)"
+
+    def set_rows(self, rows):
+        """Store result rows (dicts in display order) compressed."""
+        self.data = zlib.compress(json.dumps(rows, cls=DjangoJSONEncoder, ensure_ascii=False).encode(), 9)
+
+    def get_rows(self):
+        return json.loads(zlib.decompress(bytes(self.data)))
+
+    def observations(self):
+        """Return unsaved observations with their products, as history pages expect."""
+        product_fields = {'marketplace', 'product_id', *CatalogProduct.DESCRIPTIVE_FIELDS}
+        observations = []
+        for row in self.get_rows():
+            product = CatalogProduct(**{name: row[name] for name in product_fields if name in row})
+            observation = PriceObservation(
+                product=product,
+                **{name: value for name, value in row.items() if name not in product_fields},
+            )
+            observation.observed_at = parse_datetime(row['observed_at'])
+            observations.append(observation)
+        return observations
+
+
+class ProductPriceDaily(models.Model):
+    """Дневные итоги цены товара по всем его наблюдениям за день."""
+    product = models.ForeignKey(CatalogProduct, on_delete=models.CASCADE, related_name='daily_prices', verbose_name='Товар')
+    day = models.DateField(verbose_name='День')
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Минимальная цена')
+    median_price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Медианная цена')
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Максимальная цена')
+    observation_count = models.PositiveIntegerField(verbose_name='Количество наблюдений')
+
+    class Meta:
+        verbose_name = "Дневная цена товара"
+        verbose_name_plural = "Дневные цены товаров"
+        ordering = ['day']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'day'], name='product_daily_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} {self.day}: {self.min_price}–{self.max_price}"
+
+
+class QueryPriceDaily(models.Model):
+    """Дневные итоги цен в выдаче нормализованного запроса на одном маркетплейсе."""
+    query_key = models.CharField(max_length=255, verbose_name='Нормализованный запрос')
+    marketplace = models.PositiveSmallIntegerField(choices=Marketplace.choices, verbose_name='Маркетплейс')
+    day = models.DateField(verbose_name='День')
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Минимальная цена')
+    median_price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Медианная цена')
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Максимальная цена')
+    observation_count = models.PositiveIntegerField(verbose_name='Количество наблюдений')
+    # Товар с минимальной ценой за день
+    min_product = models.ForeignKey(
+        CatalogProduct, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name='Самый дешёвый товар'
+    )
+
+    class Meta:
+        verbose_name = "Дневная цена запроса"
+        verbose_name_plural = "Дневные цены запросов"
+        ordering = ['day', 'marketplace']
+        constraints = [
+            models.UniqueConstraint(fields=['query_key', 'day', 'marketplace'], name='query_daily_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.query_key} ({self.get_marketplace_display()}) {self.day}: от {self.min_price}"
+
+
+class BatchJob(models.Model):
+    """Пакетная проверка цен по списку запросов с общими параметрами поиска."""
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', "В очереди"
+        RUNNING = 'running', "Выполняется"
+        DONE = 'done', "Завершена"
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='batch_jobs')
+    sort_value = models.CharField(max_length=20, choices=SORT_VALUE_CHOICES, default="priceup", verbose_name="Фильтр сортировки")
+    price_min = models.PositiveIntegerField(blank=True, null=True, verbose_name="Цена от")
+    price_max = models.PositiveIntegerField(blank=True, null=True, verbose_name="Цена до")
+    marketplaces = ArrayField(
+        models.PositiveSmallIntegerField(choices=Marketplace.choices),
+        verbose_name="Маркетплейсы",
+    )
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING, verbose_name="Статус")
+    # Сколько строк файла оказались повторами уже добавленных запросов
+    duplicates = models.PositiveIntegerField(default=0, verbose_name="Повторов")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создана")
+    started_at = models.DateTimeField(blank=True, null=True, verbose_name="Последний запуск")
+    finished_at = models.DateTimeField(blank=True, null=True, verbose_name="Завершена")
+
+    class Meta:
+        verbose_name = "Пакетная проверка"
+        verbose_name_plural = "Пакетные проверки"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Пакет {self.pk} ({self.get_status_display()})"
+
+    @property
+    def price_bounds(self):
+        """Price bounds as the adapters take them: strings, '' for none."""
+        return tuple('' if price is None else str(price) for price in (self.price_min, self.price_max))
+
+
+class BatchItem(models.Model):
+    """Уникальный (после нормализации) запрос пакета и ссылка на сохранённый поиск."""
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', "Ожидает"
+        DONE = 'done', "Выполнен"
+        FAILED = 'failed', "Ошибка"
+
+    job = models.ForeignKey(BatchJob, on_delete=models.CASCADE, related_name='items', verbose_name="Пакет")
+    position = models.PositiveIntegerField(verbose_name="Номер в списке")
+    query_text = models.CharField(max_length=255, verbose_name="Текст запроса")
+    query_key = models.CharField(max_length=255, verbose_name="Нормализованный запрос")
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING, verbose_name="Статус")
+    search_query = models.ForeignKey(
+        SearchQuery, on_delete=models.SET_NULL, blank=True, null=True, related_name='+', verbose_name="Поиск"
+    )
+    error = models.TextField(blank=True, default="", verbose_name="Ошибка")
+    progress = models.PositiveSmallIntegerField(default=0, verbose_name="Разобрано страниц Мегамаркета, %")
+    finished_at = models.DateTimeField(blank=True, null=True, verbose_name="Выполнен")
+
+    class Meta:
+        verbose_name = "Запрос пакета"
+        verbose_name_plural = "Запросы пакета"
+        ordering = ['job', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'query_key'], name='batchitem_job_key_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['job', 'status'], name='batchitem_job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.query_text} ({self.get_status_display()})"
+
+
+class PriceWatch(models.Model):
+    """Отслеживание цены: запрос пользователя, который периодически выполняется заново."""
+
+    INTERVAL_CHOICES = [
+        (6, "Каждые 6 часов"),
+        (12, "Каждые 12 часов"),
+        (24, "Раз в день"),
+        (168, "Раз в неделю"),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='price_watches')
+    query_text = models.CharField(max_length=255, verbose_name="Текст запроса")
+    # Отслеживания с одинаковым нормализованным запросом проверяются одним поиском
+    query_key = models.CharField(max_length=255, blank=True, default="", verbose_name="Нормализованный запрос")
+    marketplaces = ArrayField(
+        models.PositiveSmallIntegerField(choices=Marketplace.choices),
+        verbose_name="Маркетплейсы",
+    )
+    threshold = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Уведомить при цене не выше")
+    interval_hours = models.PositiveSmallIntegerField(choices=INTERVAL_CHOICES, default=24, verbose_name="Проверять")
+    is_active = models.BooleanField(default=True, verbose_name="Включено")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создано")
+    next_run_at = models.DateTimeField(default=timezone.now, verbose_name="Следующая проверка")
+    last_checked_at = models.DateTimeField(blank=True, null=True, verbose_name="Последняя проверка")
+    last_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, verbose_name="Последняя цена")
+    last_search = models.ForeignKey(
+        SearchQuery, on_delete=models.SET_NULL, blank=True, null=True, related_name='+', verbose_name="Последний поиск"
+    )
+
+    class Meta:
+        verbose_name = "Отслеживание цены"
+        verbose_name_plural = "Отслеживания цен"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['next_run_at'], condition=models.Q(is_active=True), name='pricewatch_due_idx'),
+            models.Index(fields=['user', '-created_at'], name='pricewatch_user_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.query_key:
+            self.query_key = normalize_query(self.query_text)
+        super().save(*args, **kwargs)
+
+    def get_marketplace_names(self):
+        return [Marketplace(value).label for value in self.marketplaces]
+
+    def __str__(self):
+        return f"{self.query_text} до {self.threshold} ₽ ({self.user})"
+
+
+class PriceAlert(models.Model):
+    """Срабатывание отслеживания: цена опустилась до порога или ниже."""
+    watch = models.ForeignKey(PriceWatch, on_delete=models.CASCADE, related_name='alerts', verbose_name="Отслеживание")
+    price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Цена")
+    product = models.ForeignKey(
+        CatalogProduct, on_delete=models.SET_NULL, blank=True, null=True, related_name='+', verbose_name="Товар"
+    )
+    search_query = models.ForeignKey(
+        SearchQuery, on_delete=models.SET_NULL, blank=True, null=True, related_name='+', verbose_name="Поиск"
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создано")
+    sent_at = models.DateTimeField(blank=True, null=True, verbose_name="Отправлено")
+
+    class Meta:
+        verbose_name = "Уведомление о цене"
+        verbose_name_plural = "Уведомления о цене"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.watch.query_text}: {self.price} ₽"
+
+
+class MMListingOffer(models.Model):
+    """Последнее предложение Мегамаркета по товару и отпечаток его строки в выдаче.
+
+    Пока отпечаток (goodsId, цена, наличие) не меняется, предложение берётся
+    отсюда без запроса productOffers/get (mm_api.ProductManager, offer_store).
+    """
+    goods_id = models.CharField(max_length=64, unique=True, verbose_name='goodsId')
+    fingerprint = models.CharField(max_length=40, verbose_name='Отпечаток строки выдачи')
+    offer = models.JSONField(verbose_name='Поля предложения')
+    updated_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name='Обновлено')
+
+    class Meta:
+        verbose_name = "Предложение Мегамаркета"
+        verbose_name_plural = "Предложения Мегамаркета"
+
+    def __str__(self):
+        return self.goods_id
+
+
+class SearchTrace(models.Model):
+    """Трассировка медленного поиска: этапы адаптеров, повторы, запросы предложений и изображений.
+
+    Сохраняется, только если поиск шёл дольше SEARCH_TRACE_THRESHOLD_MS.
+    """
+    search_query = models.ForeignKey(
+        SearchQuery, on_delete=models.CASCADE, related_name='traces', verbose_name="Поиск"
+    )
+    name = models.CharField(max_length=100, verbose_name="Обработчик")
+    duration_ms = models.FloatField(verbose_name="Длительность, мс")
+    spans = models.JSONField(default=list, verbose_name="Этапы")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Создано")
+
+    class Meta:
+        verbose_name = "Трассировка поиска"
+        verbose_name_plural = "Трассировки поиска"
+
+    def __str__(self):
+        return f"{self.name}: {self.duration_ms:.0f} мс"
@@ -0,0 +1,212 @@
+"""Monthly range partitions of PostgreSQL tables.
+
+Observations and search results are partitioned by ``observed_at``; each
+month lives in its own table ``<table>_pYYYY_MM`` and rows outside the
+existing months land in ``<table>_default``. Month boundaries are in UTC.
+"""
+from datetime import datetime, timezone
+
+# Секционированные таблицы и их ключ секционирования.
+# Результаты поиска секционируются по времени наблюдения, чтобы месяц
+# результатов и наблюдений удалялся одновременно.
+PARTITIONED_TABLES = {
+    "search_priceobservation": "observed_at",
+    "search_searchresult": "observed_at",
+}
+# Сколько месяцев вперёд создавать секции заранее.
+MONTHS_AHEAD = 3
+
+
+def month_start(value: datetime) -> datetime:
+    value = value.astimezone(timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_default"
+
+
+def is_partitioned(cursor, table: str) -> bool:
+    cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table])
+    return cursor.fetchone() is not None
+
+
+def list_partitions(cursor, table: str) -> list[datetime]:
+    """Return months that have their own partition, oldest first."""
+    cursor.execute(
+        """
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass(%s)
+        """,
+        [table],
+    )
+    prefix = f"{table}_p"
+    months = []
+    for (name,) in cursor.fetchall():
+        if name.startswith(prefix):
+            year, month = name[len(prefix):].split("_")
+            months.append(datetime(int(year), int(month), 1, tzinfo=timezone.utc))
+    return sorted(months)
+
+
+def default_partition_months(cursor, table: str) -> list[datetime]:
+    """Return months of the rows that ended up in the default partition."""
+    key = PARTITIONED_TABLES[table]
+    cursor.execute(
+        f"SELECT DISTINCT date_trunc('month', {key} AT TIME ZONE 'UTC') FROM {default_partition_name(table)}"
+    )
+    return [value.replace(tzinfo=timezone.utc) for (value,) in cursor.fetchall()]
+
+
+def create_partition(cursor, table: str, month: datetime) -> bool:
+    """Create the partition of table for month unless it exists.
+
+    Rows of that month already stored in the default partition are moved
+    into the new partition in the same transaction.
+    """
+    name = partition_name(table, month)
+    cursor.execute("SELECT to_regclass(%s)", [name])
+    if cursor.fetchone()[0] is not None:
+        return False
+    key = PARTITIONED_TABLES[table]
+    default = default_partition_name(table)
+    lower, upper = month.isoformat(), add_months(month, 1).isoformat()
+    cursor.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cursor.execute(
+        f"""
+        WITH moved AS (
+            DELETE FROM {default} WHERE {key} >= %s AND {key} < %s RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+        """,
+        [lower, upper],
+    )
+    cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{lower}') TO ('{upper}')")
+    return True
+
+
+def drop_partition(cursor, table: str, month: datetime) -> None:
+    name = partition_name(table, month)
+    cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+    cursor.execute(f"DROP TABLE {name}")
+
+
+def ensure_partitions(cursor, start: datetime, end: datetime) -> list[str]:
+    """Create monthly partitions of every partitioned table from start to end inclusive.
+
+    Months of rows that landed in the default partition get their partitions too.
+    """
+    created = []
+    for table in PARTITIONED_TABLES:
+        months = set(default_partition_months(cursor, table))
+        month = month_start(start)
+        while month <= end:
+            months.add(month)
+            month = add_months(month, 1)
+        for month in sorted(months):
+            if create_partition(cursor, table, month):
+                created.append(partition_name(table, month))
+    return created
+
+
+def partition_table(cursor, table: str, end: datetime) -> None:
+    """Turn an ordinary table into a partitioned one, keeping data, indexes and constraints.
+
+    The primary key becomes (id, <partition key>) because PostgreSQL requires
+    the partition key in every unique index; Django keeps using id alone.
+    Unique constraints must already include the partition key.
+    """
+    key = PARTITIONED_TABLES[table]
+    cursor.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype IN ('u', 'f', 'c')
+        """,
+        [table],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        """
+        SELECT indexdef FROM pg_indexes
+        WHERE tablename = %s
+          AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)
+        """,
+        [table, table],
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute(f"SELECT min({key}) FROM {table}")
+    oldest = cursor.fetchone()[0]
+
+    old = f"{table}_unpartitioned"
+    # Identity-колонки у секционированных таблиц появились только в PostgreSQL 17,
+    # поэтому id получает значения из обычной последовательности.
+    sequence = f"{table}_id_seq"
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {old}")
+    cursor.execute(f"ALTER TABLE {old} ALTER COLUMN id DROP IDENTITY IF EXISTS")
+    cursor.execute(f"ALTER TABLE {old} ALTER COLUMN id DROP DEFAULT")
+    cursor.execute(f"DROP SEQUENCE IF EXISTS {sequence}")
+    cursor.execute(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE ({key})")
+    cursor.execute(f"CREATE TABLE {default_partition_name(table)} PARTITION OF {table} DEFAULT")
+    month = month_start(oldest or end)
+    while month <= end:
+        create_partition(cursor, table, month)
+        month = add_months(month, 1)
+    cursor.execute(f"INSERT INTO {table} SELECT * FROM {old}")
+    cursor.execute(f"DROP TABLE {old}")
+
+    cursor.execute(f"CREATE SEQUENCE {sequence} OWNED BY {table}.id")
+    cursor.execute(f"SELECT setval('{sequence}', coalesce(max(id), 0) + 1, false) FROM {table}")
+    cursor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+    cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, {key})")
+    for name, definition in constraints:
+        cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+    for definition in indexes:
+        cursor.execute(definition)
+
+
+def unpartition_table(cursor, table: str) -> None:
+    """Turn a partitioned table back into an ordinary one (reverse of partition_table)."""
+    cursor.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype IN ('u', 'f', 'c')
+        """,
+        [table],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        """
+        SELECT indexdef FROM pg_indexes
+        WHERE tablename = %s
+          AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)
+        """,
+        [table, table],
+    )
+    indexes = [row[0].replace(" ON ONLY ", " ON ") for row in cursor.fetchall()]
+
+    old = f"{table}_partitioned"
+    sequence = f"{table}_id_seq"
+    cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {old}")
+    cursor.execute(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS)")
+    cursor.execute(f"INSERT INTO {table} SELECT * FROM {old}")
+    cursor.execute(f"DROP TABLE {old} CASCADE")
+    cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+    cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id)")
+    for name, definition in constraints:
+        cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+    for definition in indexes:
+        cursor.execute(definition)
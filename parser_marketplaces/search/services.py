@@ -0,0 +1,245 @@
+import itertools
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, fields
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .analytics import refresh_rollups
+from .models import CatalogProduct, MMListingOffer, PriceObservation, SearchArchive, SearchResult, SearchTrace
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ProductRecord:
+    """Товар из выдачи маркетплейса, приведённый к общему виду."""
+    marketplace: int
+    product_id: int
+    name: str
+    brand: Optional[str] = None
+    color: Optional[str] = None
+    supplier_id: Optional[int] = None
+    pics: int = 0
+    image_url: Optional[str] = None
+    url: Optional[str] = None
+    price_product: Optional[float] = None
+    price_basic: Optional[float] = None
+    review_rating: Optional[float] = None
+    feedbacks: Optional[int] = None
+    supplier_rating: Optional[float] = None
+    delivery_date: Optional[str] = None
+    duty: Optional[float] = None
+
+    @property
+    def key(self):
+        return self.marketplace, self.product_id
+
+
+OBSERVATION_FIELDS = tuple(
+    f.name for f in fields(ProductRecord)
+    if f.name not in CatalogProduct.DESCRIPTIVE_FIELDS + ('marketplace', 'product_id')
+)
+
+
+def convert_products(products, convert):
+    """Convert adapter products with convert, skipping incomplete ones and logging conversion errors."""
+    records = []
+    for product in products or []:
+        try:
+            if not getattr(product, 'product_id', None) or not hasattr(product, 'name'):
+                logger.warning("Пропущен товар с недостаточными данными: %s", product, extra={'event': 'product_skipped'})
+                continue
+            records.append(convert(product))
+        except Exception as e:
+            logger.error("Ошибка при обработке товара %s: %s", getattr(product, 'name', 'Unknown'), e)
+    return records
+
+
+def _release_connection():
+    # Потоки разбора Мегамаркета короткоживущие: соединение закрывается (или
+    # возвращается в пул) сразу. Внутри транзакции закрывать его нельзя.
+    if not connection.in_atomic_block:
+        connection.close()
+
+
+class MMOfferStore:
+    """Offer store of mm_api.ProductManager backed by MMListingOffer.
+
+    Entries older than MM_OFFER_MAX_AGE_HOURS are treated as missing. Called
+    from parser threads outside the request cycle, so the connection is
+    released after each call.
+    """
+
+    def get_many(self, goods_ids):
+        since = timezone.now() - timedelta(hours=settings.MM_OFFER_MAX_AGE_HOURS)
+        try:
+            return {
+                goods_id: (fingerprint, offer)
+                for goods_id, fingerprint, offer in MMListingOffer.objects
+                .filter(goods_id__in=goods_ids, updated_at__gte=since)
+                .values_list('goods_id', 'fingerprint', 'offer')
+            }
+        finally:
+            _release_connection()
+
+    def save_many(self, entries):
+        try:
+            MMListingOffer.objects.bulk_create(
+                [
+                    MMListingOffer(goods_id=goods_id, fingerprint=fingerprint, offer=offer, updated_at=timezone.now())
+                    for goods_id, (fingerprint, offer) in entries.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['goods_id'],
+                update_fields=['fingerprint', 'offer', 'updated_at'],
+            )
+        finally:
+            _release_connection()
+
+
+def order_records(record_lists, sort_value):
+    """Merge per-marketplace records into one list ordered by sort_value."""
+    # Составляем общий список товаров в зависимости от выбранного фильтра
+    if sort_value == "popular":
+        return [record for group in itertools.zip_longest(*record_lists) for record in group if record]
+    records = list(itertools.chain.from_iterable(record_lists))
+    if sort_value == "priceup":
+        records.sort(key=lambda p: (p.price_product is None, p.price_product))
+    elif sort_value == "pricedown":
+        records.sort(key=lambda p: (p.price_product is None, p.price_product if p.price_product is not None else 0), reverse=True)
+    elif sort_value == "rate":
+        records.sort(key=lambda p: (p.review_rating is None, p.review_rating if p.review_rating is not None else 0), reverse=True)
+    return records
+
+
+def upsert_catalog(records):
+    """Return catalog rows for records, creating new products and updating changed ones.
+
+    Unchanged products are not written at all, so repeated searches only
+    insert observations.
+    """
+    latest = {record.key: record for record in records}
+    catalog = {}
+    for product in CatalogProduct.objects.filter(
+        marketplace__in={key[0] for key in latest},
+        product_id__in={key[1] for key in latest},
+    ):
+        if (product.marketplace, product.product_id) in latest:
+            catalog[product.marketplace, product.product_id] = product
+
+    changed = []
+    for key, record in latest.items():
+        product = catalog.get(key)
+        if product is None:
+            continue
+        if any(getattr(product, name) != getattr(record, name) for name in CatalogProduct.DESCRIPTIVE_FIELDS):
+            for name in CatalogProduct.DESCRIPTIVE_FIELDS:
+                setattr(product, name, getattr(record, name))
+            product.updated_at = timezone.now()
+            changed.append(product)
+    if changed:
+        CatalogProduct.objects.bulk_update(changed, CatalogProduct.DESCRIPTIVE_FIELDS + ('updated_at',))
+
+    missing = [key for key in latest if key not in catalog]
+    if missing:
+        CatalogProduct.objects.bulk_create(
+            [
+                CatalogProduct(
+                    marketplace=latest[key].marketplace,
+                    product_id=latest[key].product_id,
+                    **{name: getattr(latest[key], name) for name in CatalogProduct.DESCRIPTIVE_FIELDS},
+                )
+                for key in missing
+            ],
+            ignore_conflicts=True,
+        )
+        for product in CatalogProduct.objects.filter(
+            marketplace__in={key[0] for key in missing},
+            product_id__in={key[1] for key in missing},
+        ):
+            catalog.setdefault((product.marketplace, product.product_id), product)
+    return catalog
+
+
+@stage('persistence')
+@transaction.atomic
+def store_results(search_query, records):
+    """Save records shown for search_query and return their observations in display order."""
+    prices = [record.price_product for record in records if record.price_product is not None]
+    search_query.product_count = len(records)
+    search_query.min_price = min(prices) if prices else None
+    search_query.save(update_fields=['product_count', 'min_price'])
+    if not records:
+        return []
+    catalog = upsert_catalog(records)
+    observed_at = timezone.now()
+    observations = PriceObservation.objects.bulk_create([
+        PriceObservation(
+            product=catalog[record.key],
+            observed_at=observed_at,
+            **{name: getattr(record, name) for name in OBSERVATION_FIELDS},
+        )
+        for record in records
+    ])
+    SearchResult.objects.bulk_create([
+        SearchResult(searchquery=search_query, observation=observation, position=position, observed_at=observed_at)
+        for position, observation in enumerate(observations)
+    ])
+    # Итоги пересчитываются после фиксации, чтобы учесть параллельно сохранённые поиски
+    transaction.on_commit(lambda: refresh_rollups(search_query, observations))
+    return observations
+
+
+async def save_trace(current, search_query):
+    """Finish current and store it if the search took longer than SEARCH_TRACE_THRESHOLD_MS."""
+    current.finish()
+    threshold = settings.SEARCH_TRACE_THRESHOLD_MS
+    if not threshold or current.duration_ms < threshold:
+        return None
+    return await SearchTrace.objects.acreate(
+        search_query=search_query,
+        name=current.name,
+        duration_ms=round(current.duration_ms, 3),
+        spans=sorted(current.spans, key=lambda span: span['start_ms']),
+    )
+
+
+def archive_results(search_query_ids):
+    """Save compressed snapshots of the results of the given searches.
+
+    The snapshots keep history pages working after the result and
+    observation partitions of those searches are dropped.
+    """
+    rows = defaultdict(list)
+    results = (
+        SearchResult.objects
+        .filter(searchquery_id__in=search_query_ids)
+        .select_related('observation__product')
+        .order_by('searchquery_id', 'position')
+    )
+    for result in results.iterator(chunk_size=2000):
+        observation = result.observation
+        product = observation.product
+        row = {'marketplace': product.marketplace, 'product_id': product.product_id, 'observed_at': observation.observed_at}
+        row.update((name, getattr(product, name)) for name in CatalogProduct.DESCRIPTIVE_FIELDS)
+        row.update((name, getattr(observation, name)) for name in OBSERVATION_FIELDS)
+        rows[result.searchquery_id].append(row)
+
+    archives = []
+    for search_query_id, query_rows in rows.items():
+        prices = [row['price_product'] for row in query_rows if row['price_product'] is not None]
+        archive = SearchArchive(
+            searchquery_id=search_query_id,
+            product_count=len(query_rows),
+            min_price=min(prices) if prices else None,
+        )
+        archive.set_rows(query_rows)
+        archives.append(archive)
+    SearchArchive.objects.bulk_create(archives, ignore_conflicts=True)
+    return len(archives)
@@ -1,3 +1,874 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .adapters import enabled_marketplaces, get_adapter, item_progress, PriceRange
+from .batch import create_batch_job, Limiter, recover_interrupted_jobs, run_batch
+from .images import fetch_image, make_thumbnail, thumbnail_path
+from .management.commands.bench_parsers import BENCH_DATA, Command as BenchCommand
+from .management.commands.stub_marketplaces import MARKETPLACES, make_server
+from .models import (
+    BatchItem, BatchJob, CatalogProduct, Marketplace, PriceAlert, PriceObservation, PriceWatch, ProductPriceDaily,
+    QueryPriceDaily, SearchArchive, SearchQuery, SearchResult,
+)
+from .partitions import PARTITIONED_TABLES, add_months, default_partition_name, list_partitions, month_start, partition_name
+from .services import MMOfferStore, ProductRecord, store_results
+import cassettes
+from media_files import ImageIndex, image_index, write_atomic
+from metrics import STAGE_SECONDS
+from mm_api import JobProgressSink, MegamarketError, MemoryOfferCache, ProductManager as MMProductManager
+from ozon_selenium import OzonParser, parse_tiles
+from .watches import run_due_watches, WATCH_REUSE_WINDOW
+from users.models import ApiToken
+from wb_api import WildberriesAPI
+
+
+def wb_product(product_id, price, **overrides):
+    """Return a product as wb_api.ProductManager.search_and_display gives it."""
+    fields = {
+        'product_id': product_id, 'name': 'Товар', 'brand': None, 'color': None, 'supplier_id': None, 'pics': 0,
+        'price_product': price, 'price_basic': None, 'review_rating': None, 'feedbacks': None,
+        'supplier_rating': None, 'delivery_date': None,
+    }
+    return SimpleNamespace(**{**fields, **overrides})
+
+
+def mock_wb(*products, side_effect=None):
+    """Return a mock of wb_api.ProductManager whose searches give products or call side_effect."""
+    wb = mock.Mock()
+    wb.return_value.search_and_display.return_value = list(products)
+    wb.return_value.search_and_display.side_effect = side_effect
+    return wb
+
+
+class PriceRollupsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('analytics', password='pass')
+
+    def _search(self, text, prices):
+        search_query = SearchQuery.objects.create(user=self.user, query_text=text)
+        records = [
+            ProductRecord(marketplace=marketplace, product_id=product_id, name=f'Товар {product_id}', price_product=price)
+            for marketplace, product_id, price in prices
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            store_results(search_query, records)
+        return search_query
+
+    def test_rollups_are_refreshed_when_results_are_stored(self):
+        self._search('Galaxy  S24', [(Marketplace.WILDBERRIES, 1, 100), (Marketplace.WILDBERRIES, 2, 300)])
+        self._search('galaxy s24', [(Marketplace.WILDBERRIES, 1, 80), (Marketplace.MEGAMARKET, 3, 250)])
+
+        today = timezone.localdate()
+        wb = QueryPriceDaily.objects.get(query_key='galaxy s24', marketplace=Marketplace.WILDBERRIES, day=today)
+        self.assertEqual(
+            (wb.min_price, wb.median_price, wb.max_price, wb.observation_count),
+            (Decimal(80), Decimal(100), Decimal(300), 3),
+        )
+        self.assertEqual(wb.min_product.product_id, 1)
+        self.assertEqual(QueryPriceDaily.objects.filter(query_key='galaxy s24').count(), 2)
+
+        product = ProductPriceDaily.objects.get(product__product_id=1, day=today)
+        self.assertEqual((product.min_price, product.median_price, product.max_price), (80, 90, 100))
+
+    def test_analytics_view_reads_rollups(self):
+        self._search('galaxy s24', [(Marketplace.WILDBERRIES, 1, 100), (Marketplace.YANDEX_MARKET, 5, 90)])
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('search:analytics'), {'query': 'Galaxy S24', 'days': 7})
+        cheapest = response.context['cheapest']
+        self.assertEqual([row.marketplace for row in cheapest], [Marketplace.YANDEX_MARKET, Marketplace.WILDBERRIES])
+        self.assertEqual(len(response.context['chart']['labels']), 1)
+
+        response = self.client.get(reverse('search:product_analytics', args=[cheapest[0].min_product_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['chart']['datasets'][0]['data'], [90.0])
+
+
+class CatalogStorageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('catalog', password='pass')
+
+    def _store(self, products):
+        search_query = SearchQuery.objects.create(user=self.user, query_text='чайник')
+        store_results(search_query, [
+            ProductRecord(marketplace=Marketplace.WILDBERRIES, product_id=product_id, name=name, price_product=price)
+            for product_id, name, price in products
+        ])
+        return search_query
+
+    def test_products_are_stored_once_and_observed_per_search(self):
+        self._store([(1, 'Чайник', 100), (2, 'Утюг', 60)])
+        kettle_updated_at = CatalogProduct.objects.get(product_id=1).updated_at
+        search_query = self._store([(1, 'Чайник', 90), (2, 'Утюг Pro', 50)])
+
+        # Неизменённый товар не перезаписывается, изменённый обновляется
+        self.assertEqual(CatalogProduct.objects.get(product_id=1).updated_at, kettle_updated_at)
+        self.assertEqual(CatalogProduct.objects.get(product_id=2).name, 'Утюг Pro')
+        self.assertEqual(CatalogProduct.objects.count(), 2)
+        self.assertEqual(PriceObservation.objects.count(), 4)
+        self.assertEqual(
+            list(search_query.results.order_by('position').values_list('observation__price_product', flat=True)),
+            [Decimal(90), Decimal(50)],
+        )
+        self.assertEqual((search_query.product_count, search_query.min_price), (2, Decimal(50)))
+
+
+class PartitionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('partitions', password='pass')
+        cls.current = month_start(timezone.now())
+
+    def _search(self, product_id, observed_at):
+        product = CatalogProduct.objects.create(marketplace=Marketplace.WILDBERRIES, product_id=product_id, name='Чайник')
+        observation = PriceObservation.objects.create(product=product, observed_at=observed_at, price_product=1000)
+        search_query = SearchQuery.objects.create(user=self.user, query_text='чайник')
+        SearchResult.objects.create(searchquery=search_query, observation=observation, position=0, observed_at=observed_at)
+        return search_query
+
+    def _months(self):
+        with connection.cursor() as cursor:
+            return {table: set(list_partitions(cursor, table)) for table in PARTITIONED_TABLES}
+
+    def _count(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {table}")
+            return cursor.fetchone()[0]
+
+    def test_partitions_are_created_ahead_and_rows_leave_the_default(self):
+        old = add_months(self.current, -5)
+        self._search(1, old + timezone.timedelta(days=2))
+        self.assertEqual(self._count('search_searchresult_default'), 1)
+
+        call_command('partitions', ahead=2, stdout=io.StringIO())
+        expected = {old, self.current, add_months(self.current, 1), add_months(self.current, 2)}
+        for table, months in self._months().items():
+            self.assertLessEqual(expected, months, table)
+            self.assertEqual(self._count(default_partition_name(table)), 0)
+            self.assertEqual(self._count(partition_name(table, old)), 1)
+        # Повторный запуск ничего не создаёт
+        out = io.StringIO()
+        call_command('partitions', ahead=2, stdout=out)
+        self.assertEqual(out.getvalue(), '')
+
+    def test_expired_partitions_are_archived_then_dropped(self):
+        old = add_months(self.current, -4)
+        expired = self._search(1, old + timezone.timedelta(days=2))
+        kept = self._search(2, timezone.now())
+        call_command('partitions', stdout=io.StringIO())
+
+        call_command('partitions', retain=2, stdout=io.StringIO())
+        for months in self._months().values():
+            self.assertNotIn(old, months)
+            self.assertIn(self.current, months)
+        archive = SearchArchive.objects.get()
+        self.assertEqual((archive.searchquery_id, archive.get_rows()[0]['product_id']), (expired.pk, 1))
+        self.assertFalse(SearchResult.objects.filter(searchquery=expired).exists())
+        self.assertTrue(SearchResult.objects.filter(searchquery=kept).exists())
+
+    def test_drop_skips_the_archive(self):
+        old = add_months(self.current, -4)
+        self._search(1, old + timezone.timedelta(days=2))
+        call_command('partitions', stdout=io.StringIO())
+        call_command('partitions', retain=2, drop=True, stdout=io.StringIO())
+        self.assertNotIn(old, self._months()['search_priceobservation'])
+        self.assertFalse(SearchArchive.objects.exists())
+        with self.assertRaises(CommandError):
+            call_command('partitions', retain=0, stdout=io.StringIO())
+
+
+class SearchViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('searcher', password='pass')
+
+    def test_marketplaces_are_searched_concurrently_and_stored(self):
+        wb = mock_wb(wb_product(7, 150))
+        yandex = mock.Mock()
+        yandex.return_value.search_and_display.side_effect = RuntimeError('timeout')
+        self.client.force_login(self.user)
+
+        with mock.patch('wb_api.ProductManager', wb), \
+                mock.patch('yandex_api.ProductManager', yandex), \
+                mock.patch('mm_api.ProductManager') as mm:
+            response = self.client.get(
+                reverse('search:product_search', kwargs={'product_name': 'чайник'}),
+                {'marketplaces': [Marketplace.WILDBERRIES.label, Marketplace.YANDEX_MARKET.label]},
+            )
+
+        self.assertEqual(response.status_code, 200)
+        mm.assert_not_called()
+        search_query = SearchQuery.objects.get(user=self.user)
+        self.assertEqual((search_query.product_count, search_query.min_price), (1, Decimal(150)))
+        self.assertEqual(search_query.marketplaces, [Marketplace.WILDBERRIES, Marketplace.YANDEX_MARKET])
+
+    def test_search_stages_are_exposed_on_metrics(self):
+        adapter_runs = STAGE_SECONDS.count(stage='adapter', marketplace='wb')
+        persistence_runs = STAGE_SECONDS.count(stage='persistence', marketplace='')
+        self.client.force_login(self.user)
+        with mock.patch('wb_api.ProductManager'), \
+                mock.patch('yandex_api.ProductManager'), mock.patch('mm_api.ProductManager'):
+            self.client.get(
+                reverse('search:product_search', kwargs={'product_name': 'чайник'}),
+                {'marketplaces': [Marketplace.WILDBERRIES.label]},
+            )
+        self.assertEqual(STAGE_SECONDS.count(stage='adapter', marketplace='wb'), adapter_runs + 1)
+        self.assertEqual(STAGE_SECONDS.count(stage='persistence', marketplace=''), persistence_runs + 1)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            f'search_stage_duration_seconds_count{{stage="adapter",marketplace="wb"}} {adapter_runs + 1}',
+            response.content.decode(),
+        )
+        with self.settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code, 200)
+
+    def _search(self):
+        with mock.patch('wb_api.ProductManager'), \
+                mock.patch('yandex_api.ProductManager'), mock.patch('mm_api.ProductManager'):
+            self.client.get(
+                reverse('search:product_search', kwargs={'product_name': 'чайник'}),
+                {'marketplaces': [Marketplace.WILDBERRIES.label, Marketplace.YANDEX_MARKET.label]},
+            )
+        return SearchQuery.objects.filter(user=self.user).latest('created_at')
+
+    def test_slow_searches_are_traced(self):
+        self.client.force_login(self.user)
+        self.assertFalse(self._search().traces.exists())
+
+        with self.settings(SEARCH_TRACE_THRESHOLD_MS=1):
+            search_query = self._search()
+        trace = search_query.traces.get()
+        self.assertEqual(
+            sorted((span['name'], span['marketplace']) for span in trace.spans),
+            [('adapter', 'wb'), ('adapter', 'yma'), ('persistence', ''), ('render', '')],
+        )
+        self.assertTrue(all(span['start_ms'] + span['duration_ms'] <= trace.duration_ms for span in trace.spans))
+
+        self.client.force_login(get_user_model().objects.create_superuser('admin', password='pass'))
+        response = self.client.get(reverse('admin:search_searchtrace_change', args=[trace.pk]))
+        self.assertContains(response, 'persistence')
+
+
+class ApiSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('api', password='pass')
+        cls.token, cls.key = ApiToken.issue(cls.user, 'tests')
+
+    def _get(self, params):
+        return self.async_client.get(reverse('search:api_search'), params, headers={'Authorization': f'Token {self.key}'})
+
+    async def test_results_are_streamed_as_ndjson_and_saved(self):
+        wb = mock_wb(wb_product(1, 900, name='Чайник'), wb_product(2, 500, name='Чайник'))
+        with mock.patch('wb_api.ProductManager', wb), mock.patch('mm_api.ProductManager') as mm:
+            response = await self._get({'query': 'чайник', 'marketplaces': ['wb'], 'sort': 'priceup', 'price_max': 1000})
+            lines = [json.loads(chunk) async for chunk in response.streaming_content]
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        mm.assert_not_called()
+        self.assertEqual(wb.return_value.search_and_display.call_args.kwargs['price_max'], '1000')
+        self.assertEqual([line['type'] for line in lines], ['product', 'product', 'marketplace', 'done'])
+        self.assertEqual(lines[0]['marketplace'], 'wb')
+        self.assertEqual(lines[2], {'type': 'marketplace', 'marketplace': 'wb', 'count': 2})
+        search_query = await SearchQuery.objects.aget(pk=lines[-1]['search_id'])
+        self.assertEqual((search_query.product_count, search_query.min_price), (2, Decimal(500)))
+        self.assertEqual(search_query.marketplaces, [Marketplace.WILDBERRIES])
+
+    async def test_invalid_parameters_return_errors(self):
+        response = await self._get({'marketplaces': ['ozon']})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(json.loads(response.content)['errors']), {'query', 'marketplaces'})
+
+
+class BatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('batch', password='pass')
+        cls.token, cls.key = ApiToken.issue(cls.user, 'tests')
+
+    @staticmethod
+    def _search(query, sort, **kwargs):
+        return [wb_product(len(query), 100, name=query)]
+
+    def test_repeated_and_blank_lines_are_skipped(self):
+        job = create_batch_job(self.user, ['Чайник', '', '# комментарий', 'чайник ', 'Утюг', 'ЧАЙНИК'], [Marketplace.WILDBERRIES])
+        self.assertEqual(list(job.items.values_list('query_text', flat=True)), ['Чайник', 'Утюг'])
+        self.assertEqual(job.duplicates, 2)
+        with self.assertRaises(ValueError):
+            create_batch_job(self.user, ['', '#'], [Marketplace.WILDBERRIES])
+
+    def test_disabled_marketplaces_are_not_batched(self):
+        with self.assertRaises(ValueError):
+            create_batch_job(self.user, ['чайник'], [Marketplace.WILDBERRIES, Marketplace.OZON])
+        with self.assertRaisesMessage(CommandError, 'ozon'):
+            call_command('batch_search', 'queries.txt', user=self.user.username, marketplaces='wb,ozon')
+        self.assertFalse(BatchJob.objects.exists())
+
+    def test_megamarket_progress_is_written_to_the_item(self):
+        item = create_batch_job(self.user, ['чайник'], [Marketplace.MEGAMARKET]).items.get()
+        progress = item_progress(item)
+        progress.set_pages(4)
+        progress.page_finished(1)
+        item.refresh_from_db()
+        self.assertEqual(item.progress, 25)
+        # запоздавший отчёт о меньшем числе страниц не уменьшает готовность
+        progress.report(1, 4)
+        progress.report(3, 4)
+        progress.report(2, 4)
+        item.refresh_from_db()
+        self.assertEqual(item.progress, 75)
+        progress.stop()
+        item.refresh_from_db()
+        self.assertEqual(item.progress, 100)
+
+    async def test_run_saves_each_query_and_resumes_unfinished(self):
+        job = await sync_to_async(create_batch_job)(self.user, ['чайник', 'утюг', 'пылесос'], [Marketplace.WILDBERRIES])
+        seen = []
+        with mock.patch('wb_api.ProductManager', mock_wb(side_effect=self._search)):
+            stats = await run_batch(job, on_item=lambda item: seen.append(item.query_text))
+            self.assertEqual((stats.done, stats.failed), (3, 0))
+            self.assertEqual(sorted(seen), ['пылесос', 'утюг', 'чайник'])
+            self.assertEqual(await SearchQuery.objects.filter(user=self.user, product_count=1).acount(), 3)
+
+            await job.items.filter(query_text='утюг').aupdate(status=BatchItem.Status.PENDING)
+            stats = await run_batch(job)
+        self.assertEqual(stats.done, 1)
+        self.assertEqual((await BatchJob.objects.aget(pk=job.pk)).status, BatchJob.Status.DONE)
+
+    @override_settings(BATCH_HOST_CONCURRENCY={'wb': 1})
+    async def test_marketplace_limit_is_shared_by_jobs(self):
+        jobs = [
+            await sync_to_async(create_batch_job)(self.user, [f'{name} {i}' for i in range(3)], [Marketplace.WILDBERRIES])
+            for name in ('чайник', 'утюг')
+        ]
+        active, peak = [0], [0]
+
+        def slow_search(*args, **kwargs):
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            active[0] -= 1
+            return self._search(*args, **kwargs)
+
+        with mock.patch('wb_api.ProductManager', mock_wb(side_effect=slow_search)):
+            stats = await asyncio.gather(*(run_batch(job) for job in jobs))
+        self.assertEqual([job_stats.done for job_stats in stats], [3, 3])
+        self.assertEqual(peak[0], 1)
+
+    def test_limiter_is_shared_by_event_loops(self):
+        limiter, active, peak = Limiter(lambda: 2), [0], [0]
+        lock = threading.Lock()
+
+        async def task():
+            async with limiter:
+                with lock:
+                    active[0] += 1
+                    peak[0] = max(peak[0], active[0])
+                await asyncio.sleep(0.01)
+                with lock:
+                    active[0] -= 1
+
+        async def main():
+            waiting = asyncio.create_task(task())
+            await asyncio.gather(*(task() for _ in range(5)))
+            await waiting
+
+        threads = [threading.Thread(target=asyncio.run, args=(main(),)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((peak[0], limiter.active), (2, 0))
+
+    def test_interrupted_jobs_are_returned_to_the_queue(self):
+        job = create_batch_job(self.user, ['чайник'], [Marketplace.WILDBERRIES])
+        BatchJob.objects.filter(pk=job.pk).update(status=BatchJob.Status.RUNNING)
+        self.assertEqual(recover_interrupted_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, BatchJob.Status.PENDING)
+
+    def test_api_creates_job_and_reports_results(self):
+        headers = {'Authorization': f'Token {self.key}'}
+        with mock.patch('search.views.start_batch') as start_batch:
+            response = self.client.post(
+                reverse('search:api_batch_create'),
+                {'queries': 'чайник\nутюг\nЧайник', 'marketplaces': ['wb']},
+                headers=headers,
+            )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.json()['queries'], response.json()['duplicates']), (2, 1))
+        job = start_batch.call_args.args[0]
+        self.assertEqual(job.marketplaces, [Marketplace.WILDBERRIES])
+
+        response = self.client.get(reverse('search:api_batch', args=[job.pk]), headers=headers)
+        self.assertEqual((response.json()['pending'], response.json()['done']), (2, 0))
+        self.assertEqual([row['query'] for row in response.json()['results']], ['чайник', 'утюг'])
+
+
+class PriceWatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = get_user_model().objects.create_user('alice', email='alice@example.com', password='pass')
+        cls.bob = get_user_model().objects.create_user('bob', email='bob@example.com', password='pass')
+
+    def _wb(self, price):
+        return mock_wb(wb_product(11, price, name='Чайник Bosch'))
+
+    def test_one_search_is_shared_by_all_watchers(self):
+        cheap = PriceWatch.objects.create(user=self.alice, query_text='Чайник', marketplaces=[Marketplace.WILDBERRIES], threshold=2000)
+        dear = PriceWatch.objects.create(user=self.bob, query_text='чайник ', marketplaces=[Marketplace.WILDBERRIES], threshold=1000)
+        wb = self._wb(1500)
+
+        with mock.patch('wb_api.ProductManager', wb):
+            stats = run_due_watches()
+
+        self.assertEqual(wb.return_value.search_and_display.call_count, 1)
+        self.assertEqual((stats.watches, stats.queries, stats.searched, stats.alerts), (2, 1, 1, 1))
+        cheap.refresh_from_db()
+        dear.refresh_from_db()
+        self.assertEqual((cheap.last_price, dear.last_price), (1500, 1500))
+        self.assertEqual(cheap.last_search_id, dear.last_search_id)
+        self.assertGreater(cheap.next_run_at, timezone.now())
+        alert = PriceAlert.objects.get()
+        self.assertEqual((alert.watch, alert.product.product_id), (cheap, 11))
+        self.assertIsNotNone(alert.sent_at)
+        self.assertEqual(mail.outbox[0].to, ['alice@example.com'])
+
+        # Пока цена остаётся ниже порога, повторных уведомлений нет, в том числе после
+        # проверки, на которой маркетплейс не ответил
+        failing = mock_wb(side_effect=ConnectionError('down'))
+        for wb, last_price in ((self._wb(1400), 1400), (failing, 1400), (self._wb(1300), 1300)):
+            # Прошлый поиск старше окна повторного использования, поэтому запрос выполняется снова
+            SearchQuery.objects.update(created_at=timezone.now() - 2 * WATCH_REUSE_WINDOW)
+            PriceWatch.objects.update(next_run_at=timezone.now())
+            with mock.patch('wb_api.ProductManager', wb):
+                stats = run_due_watches()
+            self.assertEqual((stats.searched, stats.alerts), (1, 0))
+            cheap.refresh_from_db()
+            self.assertEqual(cheap.last_price, last_price)
+        self.assertEqual(PriceAlert.objects.count(), 1)
+
+        dear.refresh_from_db()
+        self.client.force_login(self.bob)
+        response = self.client.get(reverse('search_history_detail', args=[dear.last_search_id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_recent_search_is_reused(self):
+        search_query = SearchQuery.objects.create(
+            user=self.bob, query_text='чайник', price_range='-', marketplaces=[Marketplace.WILDBERRIES, Marketplace.MEGAMARKET]
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            store_results(search_query, [ProductRecord(marketplace=Marketplace.WILDBERRIES, product_id=5, name='Чайник', price_product=900)])
+        watch = PriceWatch.objects.create(user=self.alice, query_text='Чайник', marketplaces=[Marketplace.WILDBERRIES], threshold=1000)
+
+        with mock.patch('wb_api.ProductManager') as wb:
+            stats = run_due_watches()
+
+        wb.assert_not_called()
+        self.assertEqual((stats.reused, stats.searched, stats.alerts), (1, 0, 1))
+        watch.refresh_from_db()
+        self.assertEqual((watch.last_price, watch.last_search_id), (900, search_query.pk))
+
+    def test_watch_page_adds_watch(self):
+        self.client.force_login(self.alice)
+        response = self.client.post(reverse('search:watches'), {
+            'query_text': 'Утюг', 'marketplaces': [Marketplace.WILDBERRIES], 'threshold': 3000, 'interval_hours': 24,
+        })
+        self.assertRedirects(response, reverse('search:watches'))
+        watch = PriceWatch.objects.get(user=self.alice)
+        self.assertEqual((watch.query_key, watch.marketplaces), ('утюг', [Marketplace.WILDBERRIES]))
+
+
+class MMIncrementalRefreshTests(TransactionTestCase):
+    # Страницы выдачи разбираются в потоках парсера, их соединения не видят транзакцию TestCase
+    def setUp(self):
+        self.prices = {f'{goods_id}_1': 1000 + goods_id for goods_id in range(20)}
+        self.offer_calls = []
+
+    def _api_request(self, api_url, json_data, headers, delay=0):
+        if api_url.endswith('catalog/search'):
+            items = [
+                {
+                    'goods': {'goodsId': goods_id, 'title': f'Товар {goods_id}', 'webUrl': '', 'titleImage': ''},
+                    'price': price,
+                    'isAvailable': True,
+                }
+                for goods_id, price in self.prices.items()
+            ]
+            return {'limit': 44, 'offset': 0, 'total': len(items), 'items': items}
+        goods_id = json_data['goodsId']
+        self.offer_calls.append(goods_id)
+        return {'success': True, 'offers': [{
+            'finalPrice': self.prices[goods_id], 'goodsId': goods_id.split('_')[0],
+            'deliveryPossibilities': [{'displayDeliveryDate': 'завтра'}],
+        }]}
+
+    def _parse(self, product_name='товар', **kwargs):
+        kwargs.setdefault('offer_store', MMOfferStore())
+        parser = MMProductManager(product_name=product_name, max_pages=1, download_images=False, **kwargs)
+        with mock.patch.object(parser, '_api_request', side_effect=self._api_request):
+            parser.parse()
+        return parser
+
+    def test_offers_are_requested_only_for_new_or_changed_items(self):
+        first = self._parse()
+        self.assertEqual((first.offer_requests, first.offers_reused), (16, 0))
+
+        self.prices['3_1'] = 900
+        second = self._parse()
+        self.assertEqual((second.offer_requests, second.offers_reused), (1, 15))
+        self.assertEqual(self.offer_calls[-1], '3_1')
+        self.assertEqual(
+            sorted(offer.price for offer in second.parsed_offers),
+            sorted([offer.price for offer in first.parsed_offers if offer.product_id != '3'] + [900]),
+        )
+
+    def test_offer_cache_is_shared_between_queries(self):
+        cache = MemoryOfferCache(ttl=600)
+        first = self._parse('товар', offer_store=None, offer_cache=cache)
+        second = self._parse('другой товар', offer_store=None, offer_cache=cache)
+        self.assertEqual((first.offer_requests, first.cache_misses), (16, 16))
+        self.assertEqual((second.offer_requests, second.cache_hits), (0, 16))
+        self.assertEqual(cache.hit_ratio, 0.5)
+        self.assertEqual(
+            sorted(offer.price for offer in second.parsed_offers), sorted(offer.price for offer in first.parsed_offers)
+        )
+
+    def test_progress_is_reported_to_the_job_sink(self):
+        reports = []
+        self._parse(progress=JobProgressSink(lambda *args: reports.append(args)))
+        self.assertEqual(reports, [(1, 1), (1, 1)])
+
+    def test_job_sink_reports_pages_in_order(self):
+        reports = []
+
+        def report(pages_done, pages):
+            time.sleep(0.001)
+            reports.append(pages_done)
+
+        progress = JobProgressSink(report, interval=0)
+        progress.set_pages(40)
+        threads = [threading.Thread(target=progress.page_finished, args=(page,)) for page in range(40)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(reports, list(range(1, 41)))
+
+    def test_api_failures_raise_instead_of_exiting(self):
+        with self.assertRaises(MegamarketError):
+            MMProductManager(product_name='товар', include='[', download_images=False)
+        parser = MMProductManager(product_name='товар', max_pages=1, download_images=False)
+        with mock.patch('mm_api.cassettes.request', side_effect=ConnectionError('down')) as request, \
+                mock.patch('mm_api.sleep'), self.assertRaises(MegamarketError):
+            parser.parse()
+        self.assertEqual(request.call_count, 10)
+
+    def test_offer_cache_expires_and_is_bounded(self):
+        cache = MemoryOfferCache(ttl=60, max_size=2)
+        with mock.patch('mm_api.time.monotonic', return_value=0):
+            cache.set_many({'1': {'price': 1}, '2': {'price': 2}})
+            cache.get_many(['1'])
+            cache.set_many({'3': {'price': 3}})
+            self.assertEqual(cache.get_many(['1', '2', '3']), {'1': {'price': 1}, '3': {'price': 3}})
+        with mock.patch('mm_api.time.monotonic', return_value=60):
+            self.assertEqual(cache.get_many(['1', '3']), {})
+        self.assertEqual(len(cache), 0)
+
+
+class StubMarketplacesTests(SimpleTestCase):
+    def setUp(self):
+        self.server = make_server(latency=[f'{name}=fixed:0' for name in MARKETPLACES], throttle_rate=0.5)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_adapters_are_served_by_the_stub(self):
+        with override_settings(WB_SEARCH_BASE_URL=self.server.base_url, MM_BASE_URL=self.server.base_url):
+            products = WildberriesAPI().search_products('товар', 'popular', '')['data']['products']
+            parser = MMProductManager(product_name='товар', download_images=False)
+            parser.connection_error_delay = 0
+            # Первый ответ Мегамаркета — «слишком частые запросы», парсер повторяет запрос
+            with mock.patch('random.random', side_effect=[0.1, 0.9, 0.9, 0.9]) as chance:
+                page = parser._get_page(44)
+        self.assertEqual(len(products), 100)
+        self.assertEqual(chance.call_count, 4)
+        self.assertEqual(page['offset'], '44')
+        self.assertEqual(len(page['items']), 44)
+        self.assertTrue(page['items'][0]['goods']['titleImage'].startswith(self.server.base_url))
+
+    def test_recorded_cassette_replays_without_the_server(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / 'search.jsonl.gz'
+
+        def search():
+            parser = MMProductManager(product_name='товар', download_images=False)
+            return WildberriesAPI().search_products('товар', 'popular', ''), parser._get_page(0)
+
+        with override_settings(WB_SEARCH_BASE_URL=self.server.base_url, MM_BASE_URL=self.server.base_url), \
+                mock.patch('random.random', return_value=0.9):
+            with cassettes.use(path, 'record'):
+                recorded = search()
+            self.server.shutdown()
+            with cassettes.use(path, 'replay', timing='none') as cassette:
+                replayed = search()
+        self.assertEqual(len(cassette), 2)
+        self.assertEqual(replayed, recorded)
+        with cassettes.use(path, 'replay', timing='none'), self.assertRaises(cassettes.CassetteMiss):
+            WildberriesAPI().search_products('другой товар', 'popular', '')
+
+    def test_client_errors_are_recorded_and_replayed(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / 'errors.jsonl.gz'
+        url = f'{self.server.base_url}/catalog'
+        self.server.shutdown()
+        self.server.server_close()
+
+        with cassettes.use(path, 'record'), self.assertRaises(requests.ConnectionError) as recorded:
+            cassettes.request(requests, 'get', url, timeout=1)
+        with mock.patch('requests.get', side_effect=ValueError('плохой ответ')), \
+                cassettes.use(path, 'record'), self.assertRaises(ValueError):
+            cassettes.request(requests, 'get', url, params={'page': 2})
+
+        with cassettes.use(path, 'replay', timing='none') as cassette:
+            self.assertEqual(len(cassette), 2)
+            with self.assertRaises(requests.ConnectionError) as replayed:
+                cassettes.request(requests, 'get', url, timeout=1)
+            with self.assertRaisesMessage(ValueError, 'плохой ответ'):
+                cassettes.request(requests, 'get', url, params={'page': 2})
+        self.assertIs(type(replayed.exception), type(recorded.exception))
+        self.assertEqual(str(replayed.exception), str(recorded.exception))
+
+
+class BenchParsersTests(SimpleTestCase):
+    base = {'items_per_s': 1000.0, 'relative_speed': 2.0, 'peak_kib': 200.0, 'blocks': 600}
+
+    def _compare(self, base=None, **result):
+        return BenchCommand._compare('wb', {**self.base, **result}, base or self.base, 10)
+
+    def test_regressions_over_the_limit_are_reported(self):
+        # Сравнивается скорость относительно калибровки, а не товары в секунду
+        self.assertEqual(self._compare(items_per_s=500.0), [])
+        regressions = self._compare(items_per_s=1000.0, relative_speed=1.6)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('скорость 1.6', regressions[0])
+        regressions = self._compare(peak_kib=250.0, blocks=700)
+        self.assertEqual(len(regressions), 2)
+        self.assertIn('пик памяти, КиБ 250', regressions[0])
+        self.assertIn('блоков в результате 700', regressions[1])
+
+    def test_changes_within_the_limit_pass(self):
+        self.assertEqual(self._compare(relative_speed=1.9, peak_kib=210.0, blocks=640), [])
+        self.assertEqual(self._compare(relative_speed=4.0, peak_kib=100.0, blocks=300), [])
+        self.assertEqual(self._compare({**self.base, 'peak_kib': 0, 'blocks': 0}, peak_kib=50.0, blocks=10), [])
+
+    def test_allocations_are_measured(self):
+        result = BenchCommand._measure(lambda: [str(i) * 2 for i in range(1000)], 0.01, rounds=2)
+        self.assertEqual(result['items'], 1000)
+        self.assertGreaterEqual(result['blocks'], 1000)
+        self.assertGreater(result['relative_speed'], 0)
+
+
+class AdapterImportTests(SimpleTestCase):
+    def test_adapters_are_not_imported_at_start_up(self):
+        code = (
+            "import sys, django; django.setup(); "
+            "import parser_marketplaces.urls, search.batch, search.management.commands.batch_search; "
+            "print(','.join(m for m in ('wb_api', 'yandex_api', 'mm_api', 'ozon_selenium', 'selenium', 'curl_cffi', 'bs4', 'requests') if m in sys.modules))"
+        )
+        result = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), '')
+
+
+class AdapterRegistryTests(SimpleTestCase):
+    def test_ozon_is_searched_only_when_enabled(self):
+        self.assertNotIn(Marketplace.OZON, enabled_marketplaces())
+        tiles = parse_tiles((BENCH_DATA / 'ozon_tiles.html').read_text(encoding='utf-8'))
+        with override_settings(OZON_SEARCH_ENABLED=True), mock.patch('ozon_selenium.OzonParser') as parser:
+            parser.return_value.collect.return_value = tiles
+            self.assertEqual(enabled_marketplaces()[-1], Marketplace.OZON)
+            records = async_to_sync(get_adapter(Marketplace.OZON).search)('смартфон', price_range=PriceRange('10000', '50000'))
+        parser.assert_called_once_with('смартфон')
+        self.assertTrue(records)
+        self.assertTrue(all(10000 <= record.price_product <= 50000 for record in records))
+        self.assertEqual((records[0].product_id, records[0].price_product), (666243833, 10350))
+
+    def test_ozon_load_failure_is_logged(self):
+        with mock.patch('ozon_selenium.OzonParser._init_driver') as driver, \
+                mock.patch('ozon_selenium.WebDriverWait', side_effect=TimeoutError('нет строки поиска')):
+            with self.assertLogs('ozon_selenium', 'WARNING') as logs:
+                OzonParser('смартфон').open_site()
+            driver.return_value.save_screenshot.assert_not_called()
+            self.assertIn('нет строки поиска', logs.output[0])
+
+            with tempfile.TemporaryDirectory() as directory, self.assertLogs('ozon_selenium', 'WARNING'):
+                OzonParser('смартфон', screenshot_dir=directory).open_site()
+                OzonParser('смартфон', screenshot_dir=directory).open_site()
+                paths = [call.args[0] for call in driver.return_value.save_screenshot.call_args_list]
+        self.assertEqual(len(set(paths)), 2)
+        self.assertTrue(all(os.path.dirname(path) == directory for path in paths))
+
+    def test_failed_megamarket_search_gives_no_records(self):
+        wb = mock_wb(wb_product(7, 150))
+
+        async def search():
+            return await asyncio.gather(
+                get_adapter(Marketplace.MEGAMARKET).search('чайник'), get_adapter(Marketplace.WILDBERRIES).search('чайник'),
+            )
+
+        # Все попытки запроса к API Мегамаркета заканчиваются ошибкой соединения
+        with mock.patch('mm_api.cassettes.request', side_effect=ConnectionError('down')) as request, \
+                mock.patch('mm_api.sleep'), mock.patch('mm_api.ProductManager.parse_cookie_file', return_value={}), \
+                mock.patch('wb_api.ProductManager', wb):
+            mm_records, wb_records = async_to_sync(search)()
+        self.assertEqual(request.call_count, 10)
+        self.assertEqual(mm_records, [])
+        self.assertEqual([record.product_id for record in wb_records], [7])
+
+    def test_slow_marketplace_gives_no_records(self):
+        wb = mock_wb(side_effect=lambda *args, **kwargs: time.sleep(0.5))
+        adapter = get_adapter(Marketplace.WILDBERRIES)
+        adapter.timeout = 0.05
+        with mock.patch('wb_api.ProductManager', wb):
+            self.assertEqual(async_to_sync(adapter.search)('чайник', limit=10), [])
+
+
+class ImageProxyTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        # Неудавшиеся загрузки запоминаются в кэше
+        cache.clear()
+        self.addCleanup(cache.clear)
+        CatalogProduct.objects.create(marketplace=Marketplace.YANDEX_MARKET, product_id=5, name='Чайник', image_url='https://img/5.webp')
+        buffer = io.BytesIO()
+        Image.new('RGB', (800, 600), (10, 20, 30)).save(buffer, 'WEBP')
+        self.webp = buffer.getvalue()
+
+    def _download(self, *args, **kwargs):
+        time.sleep(0.1)
+        return SimpleNamespace(content=self.webp, raise_for_status=lambda: None)
+
+    def test_original_is_downloaded_once_and_served_with_its_type(self):
+        with mock.patch('yandex_api.cassettes.request', side_effect=self._download) as download:
+            threads = [threading.Thread(target=fetch_image, args=('yma', 5, 'https://img/5.webp')) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            response = self.client.get(reverse('search:image_proxy', args=['yma', 5]))
+        self.assertEqual(download.call_count, 1)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        self.assertEqual(b''.join(response.streaming_content), self.webp)
+        self.assertEqual(
+            sorted(os.listdir(Path(settings.MEDIA_ROOT) / 'image' / 'yma' / '5')), ['1.jpg'],
+        )
+
+    def test_unknown_marketplace_or_image_is_not_found(self):
+        self.assertEqual(self.client.get(reverse('search:image_proxy', args=['shop', 5])).status_code, 404)
+        with mock.patch('yandex_api.cassettes.request', side_effect=requests.ConnectionError('down')) as download:
+            for _ in range(2):
+                self.assertEqual(self.client.get(reverse('search:image_proxy', args=['yma', 5])).status_code, 404)
+        # Неудавшаяся загрузка не повторяется сразу и не оставляет каталогов
+        self.assertEqual(download.call_count, 1)
+        self.assertFalse((Path(settings.MEDIA_ROOT) / 'image').exists())
+        with mock.patch('wb_api.cassettes.request') as download:
+            self.assertEqual(self.client.get(reverse('search:image_proxy', args=['yma', 6])).status_code, 404)
+            self.assertEqual(self.client.get(reverse('search:image_proxy', args=['wb', 6])).status_code, 404)
+            self.assertEqual(self.client.get(reverse('search:image_thumbnail', args=['wb', 6, 200])).status_code, 404)
+        download.assert_not_called()
+
+    def test_failed_writes_leave_no_files(self):
+        folder = Path(settings.MEDIA_ROOT) / 'image' / 'wb' / '7'
+        with mock.patch('wb_api.cassettes.request', side_effect=self._download), \
+                mock.patch('media_files.os.replace', side_effect=OSError('диск заполнен')):
+            self.assertFalse(get_adapter(Marketplace.WILDBERRIES).save_image(7, None))
+        self.assertEqual(os.listdir(folder), [])
+        with mock.patch('wb_api.cassettes.request', side_effect=self._download):
+            self.assertTrue(get_adapter(Marketplace.WILDBERRIES).save_image(7, None))
+        self.assertEqual((folder / '1.jpg').read_bytes(), self.webp)
+
+    def test_thumbnails_are_generated_once_per_width_and_format(self):
+        url = reverse('search:image_thumbnail', args=['yma', 5, 200])
+        with mock.patch('yandex_api.cassettes.request', side_effect=self._download):
+            webp = self.client.get(url, headers={'Accept': 'image/avif,image/webp,*/*'})
+            jpeg = self.client.get(url)
+        self.assertEqual((webp['Content-Type'], jpeg['Content-Type']), ('image/webp', 'image/jpeg'))
+        self.assertIn('Accept', webp['Vary'])
+        with Image.open(io.BytesIO(b''.join(jpeg.streaming_content))) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (200, 150)))
+        with mock.patch('search.images.Image.open') as open_image:
+            self.assertEqual(make_thumbnail('yma', 5, 200, 'webp'), thumbnail_path('yma', 5, 200, 'webp'))
+        open_image.assert_not_called()
+        self.assertEqual(
+            sorted(os.listdir(Path(settings.MEDIA_ROOT) / 'image' / 'yma' / '5')), ['1.jpg', '1_200.jpg', '1_200.webp'],
+        )
+        with mock.patch('media_files.os.replace', side_effect=OSError('диск заполнен')):
+            self.assertIsNone(make_thumbnail('yma', 5, 400, 'jpg'))
+        self.assertEqual(len(os.listdir(Path(settings.MEDIA_ROOT) / 'image' / 'yma' / '5')), 3)
+        self.assertEqual(self.client.get(reverse('search:image_thumbnail', args=['yma', 5, 300])).status_code, 404)
+
+    def test_index_is_scanned_once_and_updated_by_writers(self):
+        folder = Path(settings.MEDIA_ROOT) / 'image' / 'wb' / '7'
+        folder.mkdir(parents=True)
+        (folder / '1.jpg').write_bytes(b'')
+        (folder / '1.jpg.1.2.tmp').write_bytes(b'')
+        index = ImageIndex()
+        self.assertTrue(index.has('wb', 7))
+        self.assertFalse(index.has('wb', 7, '1.jpg.1.2.tmp'))
+        # Файлы, записанные мимо индекса, не видны до повторного сканирования
+        (folder / '1_200.webp').write_bytes(b'')
+        self.assertFalse(index.has('wb', 7, '1_200.webp'))
+        index.add('wb', 7, '1_200.webp')
+        self.assertTrue(index.has('wb', 7, '1_200.webp'))
+        with tempfile.TemporaryDirectory() as other, override_settings(MEDIA_ROOT=other):
+            self.assertFalse(index.has('wb', 7))
+
+        # Общий индекс пополняет write_atomic, удалённые файлы из него вычёркиваются
+        self.assertTrue(image_index.has('wb', 7))
+        self.assertTrue(write_atomic(str(folder / '1_400.webp'), b''))
+        self.assertTrue(image_index.has('wb', 7, '1_400.webp'))
+        CatalogProduct.objects.create(marketplace=Marketplace.WILDBERRIES, product_id=7, name='Утюг')
+        (folder / '1.jpg').unlink()
+        url = reverse('search:image_proxy', args=['wb', 7])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertFalse(image_index.has('wb', 7))
+        with mock.patch('wb_api.cassettes.request', side_effect=self._download):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertTrue(image_index.has('wb', 7))
@@ -6,5 +6,15 @@ app_name = 'search'
 urlpatterns = [
     path('search/', views.search_view, name='search_page'),
     path('search/<str:product_name>/', views.search_view, name='product_search'),
+    path('watches/', views.watches_view, name='watches'),
+    path('watches/<int:watch_id>/toggle/', views.watch_toggle, name='watch_toggle'),
+    path('watches/<int:watch_id>/delete/', views.watch_delete, name='watch_delete'),
+    path('api/search/', views.api_search, name='api_search'),
+    path('api/batch/', views.api_batch_create, name='api_batch_create'),
+    path('api/batch/<int:job_id>/', views.api_batch, name='api_batch'),
+    path('analytics/', views.analytics_view, name='analytics'),
+    path('analytics/product/<int:product_id>/', views.product_analytics_view, name='product_analytics'),
+    path('img/<slug:marketplace>/<int:product_id>/', views.image_proxy, name='image_proxy'),
+    path('img/<slug:marketplace>/<int:product_id>/<int:width>/', views.image_thumbnail, name='image_thumbnail'),
 ]
 
@@ -1,16 +1,31 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import get_object_or_404, render, redirect
 from django.contrib.auth.decorators import login_required
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET, require_POST
 from django.urls import reverse
-from django.conf import settings
-import os
-from .forms import SearchForm
-from .models import Product, SearchQuery, SORT_VALUE_CHOICES, SORT_PARAM_MAPPING
-from wb_api import ProductManager as WBProductManager
-from yandex_api import ProductManager as YandexProductManager
-from mm_api import ProductManager as MMProductParser
-import logging
-import itertools
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils import timezone
+from datetime import timedelta
+from .adapters import PriceRange, enabled_marketplaces, get_adapter
+from .batch import create_batch_job, item_result, start_batch
+from .forms import AnalyticsForm, ApiBatchForm, ApiSearchForm, PriceWatchForm, SearchForm
+from .images import fetch_image, image_content_type, image_index, image_path, make_thumbnail, THUMBNAIL_WIDTHS
+from .models import (
+    BatchItem, BatchJob, CatalogProduct, PriceAlert, PriceWatch, ProductPriceDaily, QueryPriceDaily, SearchQuery, Marketplace, normalize_query,
+    SORT_VALUE_CHOICES, MARKETPLACE_SLUGS,
+)
+from .services import order_records, save_trace, store_results
+from users.authentication import api_token_required
+from media_files import ImageIndex
+from metrics import stage
+from tracing import Trace, activate
+import asyncio
+import dataclasses
+from collections import Counter
 import json
+import logging
 
 # Константа с вариантами сортировки
 SORT_OPTIONS = [
@@ -18,41 +33,51 @@ SORT_OPTIONS = [
 ]
 logger = logging.getLogger(__name__)
 
+# Отслеживаний цен на пользователя
+MAX_WATCHES_PER_USER = 50
+
+# Период графика цены отдельного товара, дней
+PRODUCT_ANALYTICS_DAYS = 90
+
+# Изображения товаров не меняются по одному и тому же адресу,
+# поэтому браузеру разрешено кэшировать их на год.
+IMAGE_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+
+
 @login_required
-def search_view(request, product_name=None):
-    # Определяем названия маркетплейсов как строки
-    marketplace_wb_name = "Wildberries"
-    marketplace_yandex_name = "Яндекс.Маркет"
-    marketplace_mm_name = "Мегамаркет"
+async def search_view(request, product_name=None):
+    # Маркетплейсы с включёнными адаптерами; выбираются по названию
+    marketplaces = enabled_marketplaces()
+    default_marketplaces = [marketplace.label for marketplace in marketplaces]
 
     # Определяем фильтры один раз
     sort_options = SORT_OPTIONS
 
     # Получаем значение из GET-параметра
     sort_value = request.GET.get('sort', 'priceup')
-    logger.info(f"Фильтр сортировки: {sort_value}")
+    logger.debug("Фильтр сортировки: %s", sort_value)
 
     # Получаем параметры цены из GET или POST
     price_min = request.GET.get('price_min', request.POST.get('price_min', ''))
     price_max = request.GET.get('price_max', request.POST.get('price_max', ''))
-    logger.info(f"Полученные параметры цены: price_min={price_min}, price_max={price_max}")
+    logger.debug("Полученные параметры цены: price_min=%s, price_max=%s", price_min, price_max)
 
     if product_name:
         query = product_name
         # Получаем выбранные маркетплейсы из GET-параметров
-        selected_marketplaces = request.GET.getlist('marketplaces', [marketplace_wb_name, marketplace_yandex_name, marketplace_mm_name])
+        selected_marketplaces = request.GET.getlist('marketplaces', default_marketplaces)
     elif request.method == 'POST':
         form = SearchForm(request.POST)
         if form.is_valid():
             query = form.cleaned_data['query']
             sort_value = request.POST.get('sort', 'priceup')
-            selected_marketplaces = request.POST.getlist('marketplaces', [marketplace_wb_name, marketplace_yandex_name, marketplace_mm_name])
+            selected_marketplaces = request.POST.getlist('marketplaces', default_marketplaces)
             if not selected_marketplaces:
-                selected_marketplaces = [marketplace_wb_name, marketplace_yandex_name, marketplace_mm_name]
+                selected_marketplaces = default_marketplaces
             # Формируем параметры для redirect
             price_min = request.POST.get('price_min', '')
             price_max = request.POST.get('price_max', '')
-            logger.info(f"POST параметры цены: price_min={price_min}, price_max={price_max}")
+            logger.debug("POST параметры цены: price_min=%s, price_max=%s", price_min, price_max)
             price_params = []
             # Проверяем, есть ли непустые значения, которые можно преобразовать в числа
             if price_min.strip() or price_max.strip():
@@ -60,187 +85,49 @@ def search_view(request, product_name=None):
                     min_val = int(float(price_min)) if price_min.strip() else 1
                     max_val = int(float(price_max)) if price_max.strip() else 1000000
                     price_params.extend([f"price_min={min_val}", f"price_max={max_val}"])
-                    logger.info(f"Сформированы параметры для redirect: price_min={min_val}, price_max={max_val}")
+                    logger.debug("Сформированы параметры для redirect: price_min=%s, price_max=%s", min_val, max_val)
                 except ValueError as e:
-                    logger.error(f"Ошибка при обработке цен: {e}, price_min={price_min}, price_max={price_max}")
+                    logger.error("Ошибка при обработке цен: %s, price_min=%s, price_max=%s", e, price_min, price_max)
                     # Не добавляем параметры цен в случае ошибки
             redirect_url = f"{reverse('search:product_search', kwargs={'product_name': query})}?sort={sort_value}&{'&'.join(f'marketplaces={m}' for m in selected_marketplaces)}"
             if price_params:
                 redirect_url += f"&{'&'.join(price_params)}"
-            logger.info(f"Redirect URL: {redirect_url}")
+            logger.debug("Redirect URL: %s", redirect_url)
             return redirect(redirect_url)
     else:
         form = SearchForm()
         query = None
-        selected_marketplaces = [marketplace_wb_name, marketplace_yandex_name, marketplace_mm_name]
+        selected_marketplaces = default_marketplaces
 
     if query:
-        wb_sort = SORT_PARAM_MAPPING.get(sort_value, {}).get("wb", sort_value)
-        yandex_sort = SORT_PARAM_MAPPING.get(sort_value, {}).get("yandex", "dpop")
-        mm_sort = int(SORT_PARAM_MAPPING.get(sort_value, {}).get("mm", "0"))
-
-        wb_results = []
-        yandex_results = []
-        mm_results = []
-
-        # Поиск на выбранных маркетплейсах
-        if marketplace_wb_name in selected_marketplaces:
-            logger.info(f"Поиск на Wildberries: query={query}, sort={wb_sort}, price_min={price_min}, price_max={price_max}")
-            wb_results = WBProductManager().search_and_display(query, wb_sort, price_min=price_min, price_max=price_max)
-        if marketplace_yandex_name in selected_marketplaces:
-            logger.info(f"Поиск на Яндекс.Маркете: query={query}, sort={yandex_sort}, price_min={price_min}, price_max={price_max}")
-            yandex_results = YandexProductManager().search_and_display(query, yandex_sort, price_min=price_min, price_max=price_max)
-        if marketplace_mm_name in selected_marketplaces:
-            logger.info(f"Поиск на Мегамаркете: query={query}, sort={mm_sort}, price_min={price_min}, price_max={price_max}")
-            mm_parser = MMProductParser(
-                product_name=query,
-                cookie_file_path=os.path.join(settings.BASE_DIR, "cookies.json"),
-                log_level="INFO",
-                max_pages=1,
-                sorting=mm_sort,
-                price_min=price_min,
-                price_max=price_max,
-            )
-            mm_parser.parse()
-            mm_results = mm_parser.parsed_offers
+        current_trace = Trace('search_view')
+        # Поиск на выбранных маркетплейсах выполняется одновременно
+        selected = [marketplace for marketplace in marketplaces if marketplace.label in selected_marketplaces]
+        price_range = PriceRange(price_min, price_max)
+        logger.info(
+            "Поиск: query=%s, маркетплейсы=%s, sort=%s, price_min=%s, price_max=%s",
+            query, selected_marketplaces, sort_value, price_min, price_max,
+        )
+        with activate(current_trace):
+            record_lists = await asyncio.gather(*(
+                get_adapter(marketplace).search(query, sort_value, price_range) for marketplace in selected
+            ))
 
         # Сохраняем запрос в SearchQuery
-        search_query = SearchQuery.objects.create(
-            user=request.user,
+        search_query = await SearchQuery.objects.acreate(
+            user=await request.auser(),
             query_text=query,
             sort_value=sort_value,
-            price_range = f"{price_min}-{price_max}",
-            marketplace_names=json.dumps(selected_marketplaces)
+            price_range=str(price_range),
+            marketplaces=[marketplace.value for marketplace in selected],
         )
+        logger.info("Результаты: %s", ", ".join(
+            f"{MARKETPLACE_SLUGS[marketplace]}={len(records)}" for marketplace, records in zip(selected, record_lists)
+        ))
 
-        wb_objects = []
-        yandex_objects = []
-        mm_objects = []
-
-        # Обработка результатов Wildberries
-        if wb_results:
-            for product in wb_results:
-                try:
-                    if not hasattr(product, 'product_id') or not hasattr(product, 'name'):
-                        logger.info(f"Пропущен товар с недостаточными данными: {vars(product)}")
-                        continue
-                    wb_image_path = f"image/wb/{product.product_id}/1.jpg"
-                    full_image_path = os.path.join(settings.MEDIA_ROOT, wb_image_path)
-                    first_image_path = f"/media/{wb_image_path}" if os.path.exists(full_image_path) else None
-                    obj = Product.objects.create(
-                        marketplace_name=marketplace_wb_name,
-                        searchquery=search_query,
-                        product_id=product.product_id,
-                        name=product.name or "Без названия",
-                        brand=product.brand,
-                        review_rating=product.review_rating,
-                        feedbacks=product.feedbacks,
-                        color=product.color,
-                        price_product=product.price_product,
-                        price_basic=product.price_basic,
-                        supplier_id=product.supplier_id,
-                        supplier_rating=product.supplier_rating,
-                        pics=product.pics or 0,
-                        first_image_path=first_image_path,
-                        delivery_date=product.delivery_date
-                    )
-                    wb_objects.append(obj)
-                except Exception as e:
-                    logger.error(f"Ошибка при сохранении товара {getattr(product, 'name', 'Unknown')}: {e}")
-                    continue
-
-        # Обработка результатов Яндекс.Маркета
-        if yandex_results:
-            logger.info("Yandex results count: %s", len(yandex_results))
-            for product in yandex_results:
-                try:
-                    if not hasattr(product, 'product_id') or not hasattr(product, 'name'):
-                        logger.warning(f"Пропущен товар с недостаточными данными: {vars(product)}")
-                        continue
-                    yandex_image_path = f"image/yma/{product.product_id}/1.jpg" if getattr(product, 'image_url', None) else None
-                    first_image_path = None
-                    if yandex_image_path:
-                        full_image_path = os.path.join(settings.MEDIA_ROOT, yandex_image_path)
-                        first_image_path = f"/media/{yandex_image_path}" if os.path.exists(full_image_path) else None
-                    obj = Product.objects.create(
-                        marketplace_name=marketplace_yandex_name,
-                        searchquery=search_query,
-                        product_id=int(product.product_id) if product.product_id else 0,
-                        name=product.name or "Без названия",
-                        brand=product.brand,
-                        review_rating=product.rating,
-                        feedbacks=product.reviews_count,
-                        color=None,
-                        price_product=product.price,
-                        price_basic=product.original_price,
-                        supplier_id=None,
-                        supplier_rating=None,
-                        pics=1 if getattr(product, 'image_url', None) else 0,
-                        first_image_path=first_image_path,
-                        url=product.url,
-                        delivery_date=product.delivery_date,
-                        duty=product.duty
-                    )
-                    yandex_objects.append(obj)
-                except Exception as e:
-                    logger.error(f"Ошибка при сохранении товара {getattr(product, 'name', 'Unknown')}: {e}")
-                    continue
-
-        # Обработка результатов Мегамаркета
-        if mm_results:
-            logger.info("Megamarket results count: %s", len(mm_results))
-            for product in mm_results:
-                try:
-                    if not hasattr(product, 'product_id') or not hasattr(product, 'name'):
-                        logger.warning(f"Пропущен товар с недостаточными данными: {vars(product)}")
-                        continue
-                    mm_image_path = f"image/mm/{product.product_id}/1.jpg" if getattr(product, 'image_url', None) else None
-                    first_image_path = None
-                    if mm_image_path:
-                        full_image_path = os.path.join(settings.MEDIA_ROOT, mm_image_path)
-                        first_image_path = f"/media/{mm_image_path}" if os.path.exists(full_image_path) else None
-                    obj = Product.objects.create(
-                        marketplace_name=marketplace_mm_name,
-                        searchquery=search_query,
-                        product_id=product.product_id,
-                        name=product.name or "Без названия",
-                        brand=product.brand,
-                        review_rating=product.rating,
-                        feedbacks=product.reviews_count,
-                        color=None,
-                        price_product=product.price,
-                        price_basic=product.old_price,
-                        supplier_id=product.merchant_id,
-                        supplier_rating=product.merchant_rating,
-                        pics=1 if getattr(product, 'image_url', None) else 0,
-                        first_image_path=first_image_path,
-                        url=product.url,
-                        delivery_date=product.delivery_date,
-                        duty=None
-                    )
-                    mm_objects.append(obj)
-                except Exception as e:
-                    logger.error(f"Ошибка при сохранении товара {getattr(product, 'name', 'Unknown')}: {e}")
-                    continue
-
-        # Составляем общий список товаров в зависимости от выбранного фильтра
-        if sort_value == "popular":
-            display_results = []
-            for wb_obj, ym_obj, mm_obj in itertools.zip_longest(wb_objects, yandex_objects, mm_objects):
-                if wb_obj:
-                    display_results.append(wb_obj)
-                if ym_obj:
-                    display_results.append(ym_obj)
-                if mm_obj:
-                    display_results.append(mm_obj)
-        else:
-            display_results = wb_objects + yandex_objects + mm_objects
-            if sort_value == "priceup":
-                display_results.sort(key=lambda p: (p.price_product is None, p.price_product))
-            elif sort_value == "pricedown":
-                display_results.sort(key=lambda p: (p.price_product is None, p.price_product if p.price_product is not None else 0), reverse=True)
-            elif sort_value == "rate":
-                display_results.sort(key=lambda p: (p.review_rating is None, p.review_rating if p.review_rating is not None else 0), reverse=True)
+        display_records = order_records(record_lists, sort_value)
+        with activate(current_trace):
+            display_results = await sync_to_async(store_results)(search_query, display_records)
         # price_range = f"{price_min if price_min.strip() else '1'}-{price_max if price_max.strip() else '1000000'}" if (price_min.strip() or price_max.strip()) else ""
         data = {
             'title': f'Результаты поиска товара "{query}"',
@@ -253,13 +140,292 @@ def search_view(request, product_name=None):
         if price_min.strip() or price_max.strip():
             data['price_min'] = price_min if price_min.strip() else '1'
             data['price_max'] = price_max if price_max.strip() else '1000000'
-        return render(request, 'product_results.html', context=data)
+        # Шаблон обращается к request.user и сессии, которые загружаются синхронно
+        with activate(current_trace), stage('render'):
+            response = await sync_to_async(render)(request, 'product_results.html', context=data)
+        await save_trace(current_trace, search_query)
+        return response
 
-    return render(request, 'search/search_form.html', {
+    return await sync_to_async(render)(request, 'search/search_form.html', {
         'form': form,
         'sort_options': sort_options,
         'current_sort': sort_value,
         'selected_marketplaces': selected_marketplaces,
+        'marketplace_options': [
+            {'slug': MARKETPLACE_SLUGS[marketplace], 'label': marketplace.label} for marketplace in marketplaces
+        ],
         'price_min': price_min,
         'price_max': price_max,
-    })
\ No newline at end of file
+    })
+
+def _ndjson(item):
+    return json.dumps(item, ensure_ascii=False, cls=DjangoJSONEncoder) + "\n"
+
+
+@require_GET
+@api_token_required
+async def api_search(request):
+    """Search marketplaces and stream records as NDJSON, one marketplace at a time as it finishes.
+
+    Lines are ``{"type": "product", ...}`` records, a ``{"type": "marketplace"}``
+    line after each marketplace's records and a final ``{"type": "done"}``
+    line with the id of the search saved to history.
+    """
+    form = ApiSearchForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400, json_dumps_params={'ensure_ascii': False})
+    data = form.cleaned_data
+    query = data['query']
+    sort_value = data['sort']
+    price_range = PriceRange(*('' if data[name] is None else str(data[name]) for name in ('price_min', 'price_max')))
+    selected = data['marketplaces']
+    user = request.user
+    logger.info("API-поиск: query=%s, маркетплейсы=%s, sort=%s, user=%s", query, selected, sort_value, user.pk)
+
+    current_trace = Trace('api_search')
+
+    async def search(marketplace):
+        with activate(current_trace):
+            return marketplace, await get_adapter(marketplace).search(query, sort_value, price_range)
+
+    async def stream():
+        tasks = [asyncio.ensure_future(search(marketplace)) for marketplace in selected]
+        records = {}
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                marketplace, marketplace_records = await next_done
+                records[marketplace] = marketplace_records
+                slug = MARKETPLACE_SLUGS[marketplace]
+                for record in marketplace_records:
+                    yield _ndjson({'type': 'product', **dataclasses.asdict(record), 'marketplace': slug})
+                yield _ndjson({'type': 'marketplace', 'marketplace': slug, 'count': len(marketplace_records)})
+        finally:
+            # Клиент отключился: ответы оставшихся маркетплейсов не нужны
+            for task in tasks:
+                task.cancel()
+
+        search_query = await SearchQuery.objects.acreate(
+            user=user,
+            query_text=query,
+            sort_value=sort_value,
+            price_range=str(price_range),
+            marketplaces=[marketplace.value for marketplace in selected],
+        )
+        ordered = order_records([records[marketplace] for marketplace in selected], sort_value)
+        with activate(current_trace):
+            await sync_to_async(store_results)(search_query, ordered)
+        await save_trace(current_trace, search_query)
+        yield _ndjson({'type': 'done', 'search_id': search_query.pk, 'count': len(ordered)})
+
+    return StreamingHttpResponse(stream(), content_type='application/x-ndjson; charset=utf-8')
+
+
+@require_POST
+@api_token_required
+async def api_batch_create(request):
+    """Create a batch price check from a list of queries and start it in the background."""
+    form = ApiBatchForm(request.POST, request.FILES)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400, json_dumps_params={'ensure_ascii': False})
+    data = form.cleaned_data
+    try:
+        job = await sync_to_async(create_batch_job)(
+            request.user, data['lines'], data['marketplaces'],
+            sort_value=data['sort'], price_min=data['price_min'], price_max=data['price_max'],
+        )
+    except ValueError as e:
+        return JsonResponse({'errors': {'__all__': [str(e)]}}, status=400, json_dumps_params={'ensure_ascii': False})
+    start_batch(job)
+    return JsonResponse({
+        'id': job.pk,
+        'queries': await job.items.acount(),
+        'duplicates': job.duplicates,
+        'status_url': request.build_absolute_uri(reverse('search:api_batch', args=[job.pk])),
+    }, status=202)
+
+
+@require_GET
+@api_token_required
+async def api_batch(request, job_id):
+    """Return the status, throughput and per-query results of a batch price check."""
+    job = await BatchJob.objects.filter(pk=job_id, user=request.user).afirst()
+    if job is None:
+        return JsonResponse({'error': "Пакет не найден"}, status=404, json_dumps_params={'ensure_ascii': False})
+    items = [item async for item in job.items.select_related('search_query')]
+    counts = Counter(item.status for item in items)
+    # Скорость последнего запуска: выполненные с его начала запросы в минуту
+    finished = [item for item in items if job.started_at and item.finished_at and item.finished_at >= job.started_at]
+    elapsed = ((job.finished_at or timezone.now()) - job.started_at).total_seconds() if job.started_at else 0
+    return JsonResponse({
+        'id': job.pk,
+        'status': job.status,
+        'queries': len(items),
+        'duplicates': job.duplicates,
+        'done': counts[BatchItem.Status.DONE],
+        'failed': counts[BatchItem.Status.FAILED],
+        'pending': counts[BatchItem.Status.PENDING],
+        'queries_per_minute': round(len(finished) * 60 / elapsed, 1) if elapsed else None,
+        'results': [item_result(item) for item in items],
+    }, encoder=DjangoJSONEncoder, json_dumps_params={'ensure_ascii': False})
+
+
+def _original_image(marketplace, product_id):
+    marketplace_value = next((value for value, slug in MARKETPLACE_SLUGS.items() if slug == marketplace), None)
+    if marketplace_value is None:
+        raise Http404("Неизвестный маркетплейс")
+
+    path = image_path(marketplace, product_id)
+    if not image_index.has(marketplace, product_id):
+        # Скачиваются только изображения товаров из каталога, иначе любой id
+        # в адресе заставлял бы сервер обращаться к маркетплейсу
+        product = (
+            CatalogProduct.objects
+            .filter(marketplace=marketplace_value, product_id=product_id)
+            .values_list('image_url')
+            .first()
+        )
+        if product is None:
+            raise Http404("Товар не найден")
+        path = fetch_image(marketplace, product_id, product[0])
+        if path is None:
+            raise Http404("Изображение не найдено")
+    return path
+
+
+def _image_response(path, content_type=None):
+    """Serve the image file at path; without content_type it is detected from the file."""
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        # Файл удалён после сканирования: следующий запрос скачает или построит его заново
+        key = ImageIndex.key(path)
+        if key:
+            image_index.discard(*key)
+        raise Http404("Изображение не найдено")
+    response = FileResponse(file, content_type=content_type or image_content_type(file))
+    patch_cache_control(response, public=True, max_age=IMAGE_CACHE_MAX_AGE, immutable=True)
+    return response
+
+
+def image_proxy(request, marketplace, product_id):
+    """Serve product image, fetching it from the marketplace on first request."""
+    return _image_response(_original_image(marketplace, product_id))
+
+
+def image_thumbnail(request, marketplace, product_id, width):
+    """Serve card-sized thumbnail, WebP for browsers that accept it and progressive JPEG otherwise."""
+    if width not in THUMBNAIL_WIDTHS:
+        raise Http404("Неподдерживаемый размер")
+    fmt = "webp" if "image/webp" in request.headers.get("Accept", "") else "jpg"
+    if not image_index.has(marketplace, product_id, f"1_{width}.{fmt}"):
+        _original_image(marketplace, product_id)
+    path = make_thumbnail(marketplace, product_id, width, fmt)
+    if path is None:
+        raise Http404("Изображение не найдено")
+    response = _image_response(path, f"image/{'webp' if fmt == 'webp' else 'jpeg'}")
+    patch_vary_headers(response, ("Accept",))
+    return response
+
+
+def _price_chart(rows, series):
+    """Build Chart.js line data from daily rollups.
+
+    series maps a dataset label to (row filter or None, price field).
+    """
+    days = sorted({row.day for row in rows})
+    index = {day: i for i, day in enumerate(days)}
+    datasets = []
+    for label, (predicate, field) in series.items():
+        data = [None] * len(days)
+        for row in rows:
+            if predicate is None or predicate(row):
+                data[index[row.day]] = float(getattr(row, field))
+        if any(value is not None for value in data):
+            datasets.append({'label': label, 'data': data})
+    return {'labels': [day.strftime('%d.%m') for day in days], 'datasets': datasets}
+
+
+@login_required
+def analytics_view(request):
+    """Show the cheapest offers and daily prices of a query across marketplaces."""
+    form = AnalyticsForm(request.GET or None)
+    context = {'title': 'Аналитика цен', 'form': form}
+    if form.is_valid():
+        since = timezone.localdate() - timedelta(days=form.cleaned_data['days'] - 1)
+        rows = list(
+            QueryPriceDaily.objects
+            .filter(query_key=normalize_query(form.cleaned_data['query']), day__gte=since)
+            .select_related('min_product')
+        )
+        best = {}
+        for row in rows:
+            if row.marketplace not in best or row.min_price < best[row.marketplace].min_price:
+                best[row.marketplace] = row
+        series = {}
+        for marketplace in Marketplace:
+            series[f"{marketplace.label}: мин."] = (lambda row, m=marketplace: row.marketplace == m, 'min_price')
+            series[f"{marketplace.label}: медиана"] = (lambda row, m=marketplace: row.marketplace == m, 'median_price')
+        context.update({
+            'cheapest': sorted(best.values(), key=lambda row: row.min_price),
+            'chart': _price_chart(rows, series),
+            'searched': True,
+        })
+    return render(request, 'search/analytics.html', context)
+
+
+@login_required
+def product_analytics_view(request, product_id):
+    """Show daily min/median/max price of one catalog product."""
+    product = get_object_or_404(CatalogProduct, pk=product_id)
+    since = timezone.localdate() - timedelta(days=PRODUCT_ANALYTICS_DAYS - 1)
+    rows = list(ProductPriceDaily.objects.filter(product=product, day__gte=since))
+    context = {
+        'title': f'Цена товара "{product.name}"',
+        'product': product,
+        'chart': _price_chart(rows, {
+            'Минимальная': (None, 'min_price'),
+            'Медианная': (None, 'median_price'),
+            'Максимальная': (None, 'max_price'),
+        }),
+        'searched': True,
+    }
+    return render(request, 'search/analytics.html', context)
+
+
+@login_required
+def watches_view(request):
+    """List the user's price watches and their recent alerts, and add a watch."""
+    watches = PriceWatch.objects.filter(user=request.user)
+    form = PriceWatchForm(request.POST or None)
+    if request.method == 'POST' and form.is_valid():
+        if watches.count() >= MAX_WATCHES_PER_USER:
+            form.add_error(None, f"Можно отслеживать не больше {MAX_WATCHES_PER_USER} запросов")
+        else:
+            watch = form.save(commit=False)
+            watch.user = request.user
+            watch.save()
+            return redirect('search:watches')
+    return render(request, 'search/watches.html', {
+        'title': 'Отслеживание цен',
+        'form': form,
+        'watches': watches,
+        'alerts': PriceAlert.objects.filter(watch__user=request.user).select_related('watch', 'product')[:20],
+    })
+
+
+@login_required
+@require_POST
+def watch_toggle(request, watch_id):
+    watch = get_object_or_404(PriceWatch, pk=watch_id, user=request.user)
+    watch.is_active = not watch.is_active
+    # Включённое заново отслеживание проверяется при ближайшем запуске планировщика
+    watch.next_run_at = timezone.now()
+    watch.save(update_fields=['is_active', 'next_run_at'])
+    return redirect('search:watches')
+
+
+@login_required
+@require_POST
+def watch_delete(request, watch_id):
+    get_object_or_404(PriceWatch, pk=watch_id, user=request.user).delete()
+    return redirect('search:watches')
@@ -0,0 +1,182 @@
+"""Scheduled price watches.
+
+Due watches are grouped by normalized query, so each query is searched at
+most once per run however many users watch it: on the union of its
+watchers' marketplaces, through batch jobs with per-marketplace limits.
+A recent unfiltered search of the same query is reused instead of a new
+one. Thresholds of all due watches are then checked against the cheapest
+offer per (search, marketplace), fetched for every search in one query.
+"""
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import send_mass_mail
+from django.utils import timezone
+
+from .adapters import enabled_marketplaces
+from .batch import create_batch_job, run_batch, MAX_BATCH_QUERIES
+from .models import BatchItem, PriceAlert, PriceWatch, SearchQuery, SearchResult
+
+logger = logging.getLogger(__name__)
+
+# Пользователь, в историю которого сохраняются поиски отслеживаний: выдача общая для всех наблюдателей
+WATCH_USERNAME = "price_watch"
+# Поиск того же запроса за это время используется вместо нового
+WATCH_REUSE_WINDOW = timedelta(minutes=30)
+# Через сколько повторить проверку, если поиск не удался
+WATCH_RETRY_DELAY = timedelta(hours=1)
+
+
+@dataclass
+class WatchRunStats:
+    watches: int = 0
+    queries: int = 0
+    reused: int = 0
+    searched: int = 0
+    alerts: int = 0
+
+
+def service_user():
+    user, created = get_user_model().objects.get_or_create(username=WATCH_USERNAME, defaults={'is_active': False})
+    if created:
+        user.set_unusable_password()
+        user.save(update_fields=['password'])
+    return user
+
+
+def recent_searches(marketplaces_by_key, since):
+    """Return {query_key: search id} of unfiltered searches since since covering the needed marketplaces."""
+    found = {}
+    searches = (
+        SearchQuery.objects
+        .filter(
+            query_key__in=marketplaces_by_key,
+            created_at__gte=since,
+            sort_value="priceup",
+            price_range="-",
+            product_count__gt=0,
+        )
+        .order_by('-created_at')
+        .values_list('pk', 'query_key', 'marketplaces')
+    )
+    for pk, query_key, marketplaces in searches:
+        if query_key not in found and marketplaces_by_key[query_key] <= set(marketplaces):
+            found[query_key] = pk
+    return found
+
+
+def cheapest_offers(search_query_ids, since):
+    """Return {(search id, marketplace): cheapest observation with its product} in one query."""
+    results = (
+        SearchResult.objects
+        .filter(searchquery_id__in=search_query_ids, observed_at__gte=since, observation__price_product__isnull=False)
+        .select_related('observation__product')
+        .order_by('searchquery_id', 'observation__product__marketplace', 'observation__price_product')
+        .distinct('searchquery_id', 'observation__product__marketplace')
+    )
+    return {(result.searchquery_id, result.observation.product.marketplace): result.observation for result in results}
+
+
+def check_thresholds(watches, search_by_key, now):
+    """Update watches from their searches and return new alerts.
+
+    An alert is created when the cheapest price on the watch's marketplaces
+    reaches the threshold after being above it (or unknown) at the last
+    check that found offers, so a price staying low alerts once.
+    """
+    offers = cheapest_offers(set(search_by_key.values()), now - WATCH_REUSE_WINDOW)
+    alerts = []
+    for watch in watches:
+        search_id = search_by_key.get(watch.query_key)
+        if search_id is None:
+            watch.next_run_at = now + WATCH_RETRY_DELAY
+            continue
+        watch.next_run_at = now + timedelta(hours=watch.interval_hours)
+        best = min(
+            (offers[search_id, marketplace] for marketplace in watch.marketplaces if (search_id, marketplace) in offers),
+            key=lambda observation: observation.price_product,
+            default=None,
+        )
+        previous = watch.last_price
+        watch.last_checked_at, watch.last_search_id = now, search_id
+        if best is None:
+            # Маркетплейсы не вернули предложений (адаптер при ошибке отдаёт пустой список):
+            # последняя известная цена остаётся, иначе следующая проверка уведомит повторно
+            continue
+        watch.last_price = best.price_product
+        if best.price_product <= watch.threshold and (previous is None or previous > watch.threshold):
+            alerts.append(PriceAlert(watch=watch, price=best.price_product, product=best.product, search_query_id=search_id))
+    PriceWatch.objects.bulk_update(
+        watches, ['next_run_at', 'last_checked_at', 'last_search', 'last_price'], batch_size=1000
+    )
+    return PriceAlert.objects.bulk_create(alerts, batch_size=1000)
+
+
+def send_alerts(alerts):
+    """E-mail alerts to watchers who have an address and mark them sent."""
+    messages, sent = [], []
+    for alert in alerts:
+        user = alert.watch.user
+        if not user.email:
+            continue
+        product = alert.product
+        lines = [f"Цена по запросу «{alert.watch.query_text}» опустилась до {alert.price} ₽ (порог {alert.watch.threshold} ₽)."]
+        if product:
+            lines.append(f"{product.name} ({product.get_marketplace_display()})")
+            if product.url:
+                lines.append(product.url)
+        messages.append((f"Цена снизилась: {alert.watch.query_text}", "\n".join(lines), settings.DEFAULT_FROM_EMAIL, [user.email]))
+        sent.append(alert.pk)
+    if not messages:
+        return 0
+    try:
+        send_mass_mail(messages)
+    except Exception as e:
+        logger.error("Ошибка при отправке уведомлений о ценах: %s", e)
+        return 0
+    PriceAlert.objects.filter(pk__in=sent).update(sent_at=timezone.now())
+    return len(sent)
+
+
+def run_due_watches(now=None):
+    """Check every due watch, searching each unique query once, and return stats."""
+    now = now or timezone.now()
+    watches = list(PriceWatch.objects.filter(is_active=True, next_run_at__lte=now).select_related('user'))
+    stats = WatchRunStats(watches=len(watches))
+    if not watches:
+        return stats
+
+    # Маркетплейсы с выключенными адаптерами (Ozon без OZON_SEARCH_ENABLED) не опрашиваются
+    enabled = set(enabled_marketplaces())
+    marketplaces_by_key = defaultdict(set)
+    texts = {}
+    for watch in watches:
+        marketplaces_by_key[watch.query_key].update(enabled.intersection(watch.marketplaces))
+        texts.setdefault(watch.query_key, watch.query_text)
+    search_by_key = recent_searches(marketplaces_by_key, now - WATCH_REUSE_WINDOW)
+    stats.queries, stats.reused = len(marketplaces_by_key), len(search_by_key)
+
+    # Один пакет на каждый набор маркетплейсов, не больше MAX_BATCH_QUERIES запросов
+    groups = defaultdict(list)
+    for query_key, marketplaces in marketplaces_by_key.items():
+        if query_key not in search_by_key and marketplaces:
+            groups[tuple(sorted(marketplaces))].append(texts[query_key])
+    user = service_user() if groups else None
+    for marketplaces, queries in groups.items():
+        for start in range(0, len(queries), MAX_BATCH_QUERIES):
+            job = create_batch_job(user, queries[start:start + MAX_BATCH_QUERIES], marketplaces)
+            # async_to_sync выполняет запросы к базе в этом же потоке и соединении
+            async_to_sync(run_batch)(job)
+            done = list(job.items.filter(status=BatchItem.Status.DONE).values_list('query_key', 'search_query_id'))
+            search_by_key.update(done)
+            stats.searched += len(done)
+
+    alerts = check_thresholds(watches, search_by_key, now)
+    stats.alerts = len(alerts)
+    send_alerts(alerts)
+    return stats
@@ -0,0 +1,79 @@
+"""Lightweight per-request tracing.
+
+activate(trace) makes a Trace current for the code it wraps, in a
+ContextVar, so asyncio tasks started inside see it; blocking code run in
+thread pools must be submitted through contextvars.copy_context().run.
+span() and event() record into the current trace and do nothing when there
+is none, so code outside a traced request pays only a ContextVar lookup.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current: ContextVar['Trace | None'] = ContextVar('trace', default=None)
+
+
+class Trace:
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.finished = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def duration_ms(self):
+        return ((self.finished or time.perf_counter()) - self.started) * 1000
+
+    def add(self, name, start, end, marketplace='', detail='', error=''):
+        span = {
+            'name': name,
+            'marketplace': marketplace,
+            'detail': detail,
+            'start_ms': round((start - self.started) * 1000, 3),
+            'duration_ms': round((end - start) * 1000, 3),
+            'thread': threading.current_thread().name,
+        }
+        if error:
+            span['error'] = error
+        with self._lock:
+            self.spans.append(span)
+
+
+@contextmanager
+def activate(current):
+    """Record spans of the wrapped code into current; a trace may be activated many times."""
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name, marketplace='', detail=''):
+    current = _current.get()
+    if current is None:
+        yield
+        return
+    start = time.perf_counter()
+    error = ''
+    try:
+        yield
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.add(name, start, time.perf_counter(), marketplace, detail, error)
+
+
+def event(name, marketplace='', detail=''):
+    """Record an instant span, e.g. a retry."""
+    current = _current.get()
+    if current is not None:
+        now = time.perf_counter()
+        current.add(name, now, now, marketplace, detail)
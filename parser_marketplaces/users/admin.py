@@ -1,5 +1,16 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User
+from .models import ApiToken, User
 
 admin.site.register(User, UserAdmin)
+
+
+@admin.register(ApiToken)
+class AdminApiToken(admin.ModelAdmin):
+    """Токены выпускаются командой create_api_token; в админке их можно только просмотреть и отозвать."""
+    list_display = ('name', 'user', 'prefix', 'created_at', 'last_used_at')
+    list_select_related = ('user',)
+    readonly_fields = ('user', 'name', 'prefix', 'created_at', 'last_used_at')
+
+    def has_add_permission(self, request):
+        return False
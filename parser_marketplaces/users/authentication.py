@@ -1,5 +1,13 @@
+from functools import wraps
+
 from django.contrib.auth import get_user_model
 from django.contrib.auth.backends import BaseBackend
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .models import ApiToken
+
+TOKEN_KEYWORDS = ('Token', 'Bearer')
 
 
 class EmailAuthBackend(BaseBackend):
@@ -19,3 +27,36 @@ class EmailAuthBackend(BaseBackend):
             return user_model.objects.get(pk=user_id)
         except user_model.DoesNotExist:
             return None
+
+
+async def aauthenticate_token(request):
+    """Return the active user of the API token in the Authorization header, or None."""
+    keyword, _, key = request.headers.get('Authorization', '').partition(' ')
+    if keyword not in TOKEN_KEYWORDS or not key.strip():
+        return None
+    token = await (
+        ApiToken.objects
+        .select_related('user')
+        .filter(key_hash=ApiToken.hash_key(key.strip()), user__is_active=True)
+        .afirst()
+    )
+    if token is None:
+        return None
+    await ApiToken.objects.filter(pk=token.pk).aupdate(last_used_at=timezone.now())
+    return token.user
+
+
+def api_token_required(view_func):
+    """Authenticate an async API view by token instead of the session; 401 in JSON otherwise."""
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        user = await aauthenticate_token(request)
+        if user is None:
+            response = JsonResponse({'error': "Требуется токен API"}, status=401)
+            response['WWW-Authenticate'] = TOKEN_KEYWORDS[0]
+            return response
+        request.user = user
+        return await view_func(request, *args, **kwargs)
+    # Запросы с токеном не используют cookie сессии, поэтому проверка CSRF к ним не относится
+    wrapper.csrf_exempt = True
+    return wrapper
@@ -0,0 +1,24 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from users.models import ApiToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Выпускает токен API для пользователя. Ключ выводится один раз и не сохраняется; "
+        "отозвать токен можно в админке."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='имя пользователя')
+        parser.add_argument('--name', default='script', help='назначение токена, например имя скрипта')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['username'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"Пользователь {options['username']} не найден")
+        token, key = ApiToken.issue(user, options['name'])
+        self.stderr.write(f"Токен «{token.name}» для {user.username} создан, сохраните ключ:")
+        self.stdout.write(key)
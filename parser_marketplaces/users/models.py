@@ -1,3 +1,7 @@
+import hashlib
+import secrets
+
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.core.validators import RegexValidator
@@ -28,4 +32,32 @@ class User(AbstractUser):
     )
 
     def __str__(self):
-        return f"Профиль пользователя: {self.phone}"
\ No newline at end of file
+        return f"Профиль пользователя: {self.phone}"
+
+
+class ApiToken(models.Model):
+    """Токен доступа к API для скриптов. Хранится только хэш ключа."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='api_tokens', verbose_name="Пользователь")
+    name = models.CharField(max_length=100, verbose_name="Назначение")
+    prefix = models.CharField(max_length=8, verbose_name="Начало ключа")
+    key_hash = models.CharField(max_length=64, unique=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создан")
+    last_used_at = models.DateTimeField(null=True, blank=True, verbose_name="Последнее использование")
+
+    class Meta:
+        verbose_name = "Токен API"
+        verbose_name_plural = "Токены API"
+
+    def __str__(self):
+        return f"{self.name} ({self.prefix}…)"
+
+    @staticmethod
+    def hash_key(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def issue(cls, user, name):
+        """Create a token for user and return (token, key); the key is not stored and is shown once."""
+        key = secrets.token_urlsafe(32)
+        token = cls.objects.create(user=user, name=name, prefix=key[:8], key_hash=cls.hash_key(key))
+        return token, key
@@ -1,3 +1,38 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+
+from .models import ApiToken
+
+
+class ApiTokenTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('script', password='pass')
+
+    def test_command_issues_token_and_stores_only_hash(self):
+        out = StringIO()
+        call_command('create_api_token', 'script', '--name', 'export', stdout=out, stderr=StringIO())
+        key = out.getvalue().strip()
+
+        token = ApiToken.objects.get(user=self.user)
+        self.assertEqual((token.name, token.prefix), ('export', key[:8]))
+        self.assertEqual(token.key_hash, ApiToken.hash_key(key))
+        self.assertNotIn(key, token.key_hash)
+
+    def test_api_rejects_missing_or_unknown_token(self):
+        url = reverse('search:api_search')
+        self.assertEqual(self.client.get(url, {'query': 'чайник'}).status_code, 401)
+        response = self.client.get(url, {'query': 'чайник'}, headers={'Authorization': 'Token wrong'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
 
-# Create your tests here.
+    def test_inactive_user_token_is_rejected(self):
+        _, key = ApiToken.issue(self.user, 'export')
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(reverse('search:api_search'), {'query': 'чайник'}, headers={'Authorization': f'Token {key}'})
+        self.assertEqual(response.status_code, 401)
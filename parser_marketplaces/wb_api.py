@@ -10,13 +10,11 @@ from urllib.parse import urlencode
 from datetime import datetime, timedelta
 import math
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    handlers=[logging.StreamHandler()]
-)
+import cassettes
+from media_files import write_atomic
+from metrics import stage
+
 logger = logging.getLogger(__name__)
-logger.info("Приложение запущено внутри контейнера")
 
 @dataclass
 class Product:
@@ -81,6 +79,8 @@ class Product:
         return None
 
     def display(self):
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
         text = (
             f"Название: {self.name}\n"
             f"Цвет: {self.color}\n"
@@ -96,12 +96,13 @@ class Product:
             f"Путь к 1 изображению: {self.first_image_path}\n"
             f"Дата доставки: {self.delivery_date}\n"
         )
-        logger.info(text)
+        logger.debug("%s", text)
 
 class WildberriesAPI:
-    BASE_URL = 'https://search.wb.ru/exactmatch/ru/male/v13/search'
+    SEARCH_PATH = '/exactmatch/ru/male/v13/search'
 
     def __init__(self):
+        self.base_url = settings.WB_SEARCH_BASE_URL.rstrip('/') + self.SEARCH_PATH
         self.headers = {
             "accept": "*/*",
             "accept-encoding": "gzip, deflate, br, zstd",
@@ -137,10 +138,13 @@ class WildberriesAPI:
             'uclusters': '3',
             'uiv': '0',
         }
-        logger.info(f"Request URL: {self.BASE_URL}?{urlencode(params)}")
-        response = requests.get(self.BASE_URL, headers=self.headers, params=params)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Request URL: %s?%s", self.base_url, urlencode(params))
+        with stage('network', 'wb'):
+            response = cassettes.request(requests, 'get', self.base_url, headers=self.headers, params=params)
         try:
-            return response.json()
+            with stage('parse', 'wb'):
+                return response.json()
         except ValueError:
             logger.error("Invalid JSON response")
             return {}
@@ -160,27 +164,29 @@ class ProductManager:
     def __init__(self):
         self.api = WildberriesAPI()
 
-    def search_and_display(self, search_query: str, search_sort='popular', price_min='', price_max='', save_image_all=False):
+    def search_and_display(self, search_query: str, search_sort='popular', price_min='', price_max='', save_image_all=False, download_images=True):
         try:
             priceU = None  # Инициализируем priceU как None
             if price_min.strip() or price_max.strip():  # Проверяем, задан ли хотя бы один параметр
                 min_val = int(float(price_min)) if price_min.strip() else 1
                 max_val = int(float(price_max)) if price_max.strip() else 1000000
                 priceU = f"{min_val * 100};{max_val * 100}"
-                logger.info(f"Сформирован priceU для поиска: {priceU}")
+                logger.debug("Сформирован priceU для поиска: %s", priceU)
         except ValueError as e:
-            logger.error(f"Ошибка при обработке цен: {e}, price_min={price_min}, price_max={price_max}")
+            logger.error("Ошибка при обработке цен: %s, price_min=%s, price_max=%s", e, price_min, price_max)
         priceU = None
 
         response = self.api.search_products(search_query, search_sort, priceU)
-        products = self._parse_response(response)[:16]
+        with stage('parse', 'wb'):
+            products = self._parse_response(response)[:16]
         if not products:
             logger.info("Товары не найдены.")
             return []
-        for product in products:
-            if product.pics > 0:
-                ImageDownloader.save_images(product.product_id, product.pics, save_image_all)
-        logger.info(f"Количество товаров: {len(products)}")
+        if download_images:
+            for product in products:
+                if product.pics > 0:
+                    ImageDownloader.save_images(product.product_id, product.pics, save_image_all)
+        logger.info("Количество товаров: %s", len(products))
         return products
 
     def _parse_response(self, response):
@@ -189,31 +195,34 @@ class ProductManager:
 
 class ImageDownloader:
     @staticmethod
-    def save_images(product_id, product_pics, save_image_all, timeout=10):
+    def image_url(product_id, index=1):
         _short_id = product_id // 100000
+        host = settings.WB_IMAGES_BASE_URL.rstrip('/')
+        if not host:
+            host = f"https://basket-{ImageDownloader._determine_basket(_short_id)}.wbbasket.ru"
+        return f"{host}/vol{_short_id}/part{product_id // 1000}/{product_id}/images/big/{index}.webp"
+
+    @staticmethod
+    @stage('images', 'wb')
+    def save_images(product_id, product_pics, save_image_all, timeout=10):
         folder_path = os.path.join(settings.MEDIA_ROOT, 'image', 'wb', str(product_id))
-        os.makedirs(folder_path, exist_ok=True)
-        basket = ImageDownloader._determine_basket(_short_id)
         if not save_image_all:
             product_pics = 1
+        saved = 0
         for i in range(1, product_pics + 1):
-            image_url = f"https://basket-{basket}.wbbasket.ru/vol{_short_id}/part{product_id // 1000}/{product_id}/images/big/{i}.webp"
+            image_url = ImageDownloader.image_url(product_id, i)
             image_path = f"{folder_path}/{i}.jpg"
-            logger.info(f"Попытка загрузки изображения: {image_url}")
+            logger.debug("Попытка загрузки изображения: %s", image_url)
             try:
-                response = requests.get(image_url)
+                response = cassettes.request(requests, 'get', image_url, timeout=timeout)
                 response.raise_for_status()
-                with open(image_path, "wb") as file:
-                    file.write(response.content)
-                logger.info(f"Успешно сохранено: {image_path}")
             except requests.exceptions.RequestException as e:
-                logger.error(f"Ошибка загрузки {image_url}: {e}")
-            except requests.exceptions.HTTPError as err:
-                logger.error(f"Сервер вернул ошибку: {err.response.status_code}")
-            except requests.exceptions.ConnectionError:
-                logger.error("Не удалось подключиться к серверу")
-            except requests.exceptions.Timeout:
-                logger.error("Превышено время ожидания")
+                logger.warning("Ошибка загрузки %s: %s", image_url, e, extra={'event': 'image_download_failed'})
+                continue
+            if write_atomic(image_path, response.content):
+                saved += 1
+                logger.debug("Успешно сохранено: %s", image_path)
+        return saved > 0
 
     @staticmethod
     def _determine_basket(_short_id):
@@ -273,6 +282,7 @@ class ImageDownloader:
             return '27'
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
     manager = ProductManager()
     search_query = input("Введите название товара для поиска: ")
     manager.search_and_display(search_query)
\ No newline at end of file
@@ -8,13 +8,11 @@ from bs4 import BeautifulSoup
 import re
 from django.conf import settings
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    handlers=[logging.StreamHandler()]
-)
+import cassettes
+from media_files import write_atomic
+from metrics import stage
+
 logger = logging.getLogger(__name__)
-logger.info("Приложение запущено")
 
 @dataclass
 class Product:
@@ -40,12 +38,6 @@ class Product:
         if image_url and not image_url.startswith('http'):
             image_url = base_url + image_url
 
-        if image_url:
-            match = re.search(r'/(\d+)', image_url)
-            if match:
-                product_id = match.group(1)
-            else:
-                product_id = None
 
         name_elem = soup.find('span', attrs={'data-auto': 'snippet-title'})
         name = name_elem.text.strip() if name_elem else None
@@ -72,13 +64,25 @@ class Product:
         url_elem = soup.find('a', attrs={'data-auto': 'snippet-link'})
         url = base_url + url_elem['href'] if url_elem and url_elem.get('href') else None
 
+        # Id товара берём из параметра sku ссылки: число из адреса картинки
+        # совпадает у разных товаров.
+        product_id = None
+        match = re.search(r'[?&]sku=(\d+)', url) if url else None
+        if not match and image_url:
+            match = re.search(r'/(\d+)', image_url)
+        if match:
+            product_id = match.group(1)
+
         payment_type = soup.find('div', class_=re.compile(r'ds-textLine'))
         payment_name = None
         if payment_type:
             shop_span = payment_type.find('span', class_=re.compile(r'ds-text_lineClamp'))
             payment_name = shop_span.get_text(strip=True) if shop_span else None
         else:
-            logger.warning("Элемент с классом 'ds-textLine' не найден, shop_name будет None")
+            logger.warning(
+                "Элемент с классом 'ds-textLine' не найден, shop_name будет None",
+                extra={'event': 'yma_snippet_incomplete'},
+            )
 
         delivery_date_elem = soup.find('div', attrs={'data-zone-name': 'deliveryInfo'}).find('span', class_=re.compile(r'_1yLiV')) if soup.find('div', attrs={'data-zone-name': 'deliveryInfo'}) else None
         delivery_date = delivery_date_elem.text.strip() if delivery_date_elem else None
@@ -115,6 +119,8 @@ class Product:
         )
 
     def display(self):
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
         text = (
             f"ID товара: {self.product_id or 'N/A'}\n"
             f"Название: {self.name or 'N/A'}\n"
@@ -133,12 +139,11 @@ class Product:
                 '\n'.join(f"  {k}: {v}" for k, v in self.characteristics.items()) if self.characteristics else "  N/A"
             ) + "\n"
         )
-        logger.info("product: %s", text)
+        logger.debug("product: %s", text)
 
 class YandexMarketAPI:
-    BASE_URL = "https://market.yandex.ru/search"
-
     def __init__(self):
+        self.base_url = settings.YMA_BASE_URL.rstrip('/') + "/search"
         self.headers = {
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
             "Accept-Encoding": "gzip, deflate, br, zstd",
@@ -170,13 +175,15 @@ class YandexMarketAPI:
                 params["pricefrom"] = int(float(price_min))
             if price_max.strip():
                 params["priceto"] = int(float(price_max))
-            logger.info(f"Фильтры цен: pricefrom={params.get('pricefrom', 'не указано')}, priceto={params.get('priceto', 'не указано')}")
+            logger.debug("Фильтры цен: pricefrom=%s, priceto=%s", params.get('pricefrom'), params.get('priceto'))
         except ValueError as e:
-            logger.error(f"Ошибка при обработке цен: {e}, price_min={price_min}, price_max={price_max}")
+            logger.error("Ошибка при обработке цен: %s, price_min=%s, price_max=%s", e, price_min, price_max)
 
-        logger.info(f"Request URL: {self.BASE_URL}?{urlencode(params)}")
-        response = requests.get(self.BASE_URL, headers=self.headers, params=params)
-        logger.info("HTTP Status Code: %s", response.status_code)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Request URL: %s?%s", self.base_url, urlencode(params))
+        with stage('network', 'yma'):
+            response = cassettes.request(requests, 'get', self.base_url, headers=self.headers, params=params)
+        logger.debug("HTTP Status Code: %s", response.status_code)
         with open("output.html", "w", encoding="utf-8") as file:
             file.write(response.text)
         return response.text
@@ -187,7 +194,8 @@ class ProductManager:
 
     def search_and_display(self, search_query: str, search_sort: str = "dpop", price_min='', price_max='', save_image_all: bool = True) -> List[Product]:
         html_content = self.api.search_products(search_query, search_sort, price_min, price_max)
-        products = self._parse_response(html_content)
+        with stage('parse', 'yma'):
+            products = self._parse_response(html_content)
         if not products:
             logger.info("Товары не найдены.")
             return []
@@ -195,7 +203,7 @@ class ProductManager:
         for product in products:
             if product.image_url and save_image_all:
                 ImageDownloader.save_images(product.product_id, product.image_url)
-        logger.info(f"Количество товаров: {len(products)}")
+        logger.info("Количество товаров: %s", len(products))
         return products
 
     def _parse_response(self, html_content: str) -> List[Product]:
@@ -212,23 +220,24 @@ class ProductManager:
 
 class ImageDownloader:
     @staticmethod
+    @stage('images', 'yma')
     def save_images(product_id: str, image_url: str, timeout: int = 10):
         folder_path = os.path.join(settings.MEDIA_ROOT, 'image', 'yma', str(product_id))
         image_path = os.path.join(folder_path, "1.jpg")
-        logger.info(f"Попытка загрузки изображения: {image_url}")
+        logger.debug("Попытка загрузки изображения: %s", image_url)
         try:
-            response = requests.get(image_url, timeout=timeout)
+            response = cassettes.request(requests, 'get', image_url, timeout=timeout)
             response.raise_for_status()
-            os.makedirs(folder_path, exist_ok=True)
-            with open(image_path, "wb") as file:
-                file.write(response.content)
-            logger.info(f"Успешно сохранено: {image_path}")
         except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка загрузки {image_url}: {e}")
-        except OSError as e:
-            logger.error(f"Ошибка сохранения файла {image_path}: {e}")
+            logger.warning("Ошибка загрузки %s: %s", image_url, e, extra={'event': 'image_download_failed'})
+            return False
+        if not write_atomic(image_path, response.content):
+            return False
+        logger.debug("Успешно сохранено: %s", image_path)
+        return True
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
     manager = ProductManager()
     search_query = input("Введите название товара для поиска: ")
     manager.search_and_display(search_query)
\ No newline at end of file